@@ -0,0 +1,245 @@
+"""Time alignment and resampling of many TSND151 streams on a common time grid.
+
+StreamAligner takes decoded records of several sensors (see tsnd.batch_decoder)
+with their host times (see tsnd.clock.TimestampConverter), and produces one
+structured array on a common grid: 'time' and each field as
+(sensors, axes) per row, interpolated linearly, or by SLERP for quaternions.
+Records are fed chunk by chunk and only the samples around the next grid
+time are kept, so hours of data are aligned in bounded memory.
+
+Example
+-------
+>>> aligner = StreamAligner(['left_wrist', 'right_wrist'], period_ms=10)
+>>> for name, tsnd151, converter, q in sensors:
+...     rec = decode_quaternion_acc_gyro_batch(drain_queue(q))
+...     aligner.feed(name, converter.convert(rec['ms']), rec)
+>>> aligned = aligner.pop()
+>>> aligned['time'], aligned['acc'][:, 0, :]  # acc of left_wrist, (N, 3)
+
+NumPy is required for this module.
+"""
+import numpy as np
+
+_QUATERNION_FIELDS_ = ('quat',)
+_NLERP_DOT_ = 0.9995  # above it, quaternions are too close for a stable SLERP
+
+
+def _slerp(q0, q1, w):
+    """Vectorized SLERP of unit quaternions q0, q1 (N, 4) with weights w (N,)."""
+    dot = np.sum(q0 * q1, axis=1)
+    q1 = np.where(dot[:, None] < 0, -q1, q1)  # the shorter arc
+    dot = np.abs(dot)
+
+    theta = np.arccos(np.clip(dot, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    close = dot > _NLERP_DOT_
+    safe = np.where(close, 1.0, sin_theta)
+    s0 = np.where(close, 1.0 - w, np.sin((1.0 - w) * theta) / safe)
+    s1 = np.where(close, w, np.sin(w * theta) / safe)
+
+    q = s0[:, None] * q0 + s1[:, None] * q1
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+class _Stream:
+    """Unconsumed samples of one sensor."""
+
+    def __init__(self):
+        self.times = np.empty(0, dtype=np.int64)  # us
+        self.values = {}  # field -> float64 (N, count)
+
+    def append(self, times, records, fields):
+        times = np.asarray(times, dtype='datetime64[us]').astype(np.int64)
+        if len(times) != len(records):
+            raise ValueError(f"Length of times and records differ: {len(times)} != {len(records)}")
+
+        values = {}
+        for name in fields:
+            if name in records.dtype.names:
+                v = records[name].astype(np.float64).reshape(len(records), -1)
+                if name in _QUATERNION_FIELDS_:
+                    norm = np.linalg.norm(v, axis=1, keepdims=True)
+                    v = v / np.where(norm > 0, norm, 1.0)
+                values[name] = v
+
+        times = np.concatenate([self.times, times])
+        for name, v in values.items():
+            values[name] = np.concatenate([self.values[name], v]) if name in self.values else v
+
+        if len(times) > 1 and np.any(np.diff(times) < 0):
+            order = np.argsort(times, kind='stable')
+            times = times[order]
+            values = {name: v[order] for name, v in values.items()}
+
+        self.times = times
+        self.values = values
+
+    def trim(self, t):
+        """Drop samples not needed for grid times >= t, i.e., keep the last sample <= t."""
+        i = max(0, int(np.searchsorted(self.times, t, side='right')) - 1)
+        if i > 0:
+            self.times = self.times[i:]
+            self.values = {name: v[i:] for name, v in self.values.items()}
+
+
+class StreamAligner:
+    """Aligner of many streams on a common time grid, fed chunk by chunk.
+
+    A grid time is emitted when every stream has samples after it, or when it is
+    max_lag_ms behind the latest sample of all streams, e.g., a sensor stopped
+    sending or has not sent its first sample yet. Values of a stream without samples around a grid time, or with
+    samples more than max_gap_ms apart around it, are NaN.
+
+    Parameters
+    ----------
+    names: list of str
+        names of the streams, in the order of the sensor axis of the output
+    period_ms: int, float
+        interval of the grid
+    fields: list of str or None
+        fields to align, e.g., ['acc', 'gyro', 'quat']. If None, the fields of the
+        first records fed (except 'ms') are used.
+    start: numpy.datetime64, datetime.datetime or None
+        first grid time. If None, the latest first sample time of the streams.
+    max_gap_ms: int, float
+        max interval of samples to interpolate over
+    max_lag_ms: int, float
+        max delay of the grid to the latest sample, which bounds the memory while a stream stalls
+
+    """
+
+    def __init__(self, names, period_ms, fields=None, start=None, max_gap_ms=100, max_lag_ms=5000):
+        if period_ms <= 0:
+            raise ValueError(f"Invalid period_ms: {period_ms}")
+        self.names = list(names)
+        self.period_us = int(round(period_ms * 1000))
+        self.fields = list(fields) if fields is not None else None
+        self.max_gap_us = int(max_gap_ms * 1000)
+        self.max_lag_us = int(max_lag_ms * 1000)
+        self._streams = {name: _Stream() for name in self.names}
+        self._counts = {}  # field -> number of axes
+        self._next_us = (int(np.datetime64(start, 'us').astype(np.int64)) if start is not None else None)
+
+    def feed(self, name, times, records):
+        """Add a chunk of a stream.
+
+        Parameters
+        ----------
+        name: str
+        times: numpy.ndarray
+            datetime64 of each record, e.g., by tsnd.clock.TimestampConverter
+        records: numpy.ndarray
+            structured array by tsnd.batch_decoder
+
+        """
+        if len(records) == 0:
+            return
+        if self.fields is None:
+            self.fields = [f for f in records.dtype.names if f != 'ms']
+        for f in self.fields:
+            if f in records.dtype.names and f not in self._counts:
+                self._counts[f] = int(np.prod(records.dtype[f].shape, dtype=np.int64))
+        self._streams[name].append(times, records, self.fields)
+
+    @property
+    def dtype(self):
+        """dtype of the output, known after the first records of each field are fed."""
+        s = len(self.names)
+        return np.dtype([('time', 'datetime64[us]')]
+                        + [(f, np.float64, (s, self._counts[f])) for f in self.fields if f in self._counts])
+
+    def pop(self, final=False):
+        """Return grid rows ready to emit as a structured array, see the class docstring.
+
+        Parameters
+        ----------
+        final: bool
+            If True, emit up to the latest sample of all streams, e.g., at the end of the data.
+
+        """
+        streams = [self._streams[name] for name in self.names]
+        lasts = [int(st.times[-1]) for st in streams if len(st.times) > 0]
+        if self.fields is None or len(lasts) == 0:
+            return np.empty(0, dtype=self.dtype if self.fields is not None else [('time', 'datetime64[us]')])
+
+        if self._next_us is None:
+            start = max(int(st.times[0]) for st in streams if len(st.times) > 0)
+            if len(lasts) < len(streams) and not final and max(lasts) - self.max_lag_us < start:
+                # wait for the first samples of all streams, but not over max_lag_ms like a stalled stream
+                return np.empty(0, dtype=self.dtype)
+            self._next_us = start
+
+        if final:
+            end = max(lasts)
+        else:
+            end = min(lasts) if len(lasts) == len(streams) else -1
+            end = max(end, max(lasts) - self.max_lag_us)
+
+        if end < self._next_us:
+            return np.empty(0, dtype=self.dtype)
+        grid = np.arange(self._next_us, end + 1, self.period_us, dtype=np.int64)
+
+        out = np.empty(len(grid), dtype=self.dtype)
+        out['time'] = grid.astype('datetime64[us]')
+        for f in self._counts:
+            out[f] = np.nan
+        for i, st in enumerate(streams):
+            self._interpolate(st, grid, out, i)
+
+        self._next_us = int(grid[-1]) + self.period_us
+        for st in streams:
+            st.trim(self._next_us)
+        return out
+
+    def _interpolate(self, st, grid, out, sensor):
+        n = len(st.times)
+        if n == 0:
+            return
+
+        i1 = np.searchsorted(st.times, grid, side='left')  # first sample >= grid time
+        i0 = i1 - 1
+        exact = (i1 < n) & (st.times[np.minimum(i1, n - 1)] == grid)
+        i0 = np.where(exact, i1, i0)
+        valid = exact | ((i0 >= 0) & (i1 < n))
+        i0c = np.clip(i0, 0, n - 1)
+        i1c = np.clip(i1, 0, n - 1)
+
+        t0, t1 = st.times[i0c], st.times[i1c]
+        span = t1 - t0
+        valid &= span <= self.max_gap_us
+        w = np.where(span > 0, (grid - t0) / np.where(span > 0, span, 1), 0.0)
+        rows = np.nonzero(valid)[0]
+        if len(rows) == 0:
+            return
+
+        w = w[rows]
+        for f, v in st.values.items():
+            v0, v1 = v[i0c[rows]], v[i1c[rows]]
+            if f in _QUATERNION_FIELDS_:
+                res = _slerp(v0, v1, w)
+            else:
+                res = v0 + w[:, None] * (v1 - v0)
+            out[f][rows, sensor, :] = res
+
+
+def align_streams(streams, period_ms, **kwargs):
+    """Align whole streams at once, see StreamAligner.
+
+    Parameters
+    ----------
+    streams: dict
+        {name: (times, records)}
+    period_ms: int, float
+    kwargs:
+        passed to StreamAligner
+
+    Returns
+    -------
+    numpy.ndarray
+        structured array with 'time' and each field as (sensors, axes) per row
+
+    """
+    aligner = StreamAligner(list(streams), period_ms, **kwargs)
+    for name, (times, records) in streams.items():
+        aligner.feed(name, times, records)
+    return aligner.pop(final=True)
@@ -0,0 +1,510 @@
+"""asyncio client for TSND151.
+
+AsyncTSND151 provides the operations of TSND151 as coroutines on a
+non-blocking serial port watched by the event loop (loop.add_reader), so one
+event loop can drive dozens of sensors without a thread per sensor or per
+in-flight command.
+
+Example
+-------
+>>> async def main():
+...     async with await AsyncTSND151.open('/dev/rfcomm0') as tsnd151:
+...         await tsnd151.set_time()
+...         await tsnd151.set_acc_and_gyro_interval(10, 1, 0)
+...         await tsnd151.start_recording()
+...         async for rec in tsnd151.stream('acc_gyro_data', batch_size=100):
+...             print(rec['ms'], rec['acc'])
+
+The serial port has to provide fileno(), i.e. a POSIX serial port.
+stream() requires NumPy (tsnd.batch_decoder).
+"""
+import asyncio
+import datetime
+from collections import deque
+from logging import getLogger
+import serial
+from tsnd.frame_decoder import FrameDecoder
+from tsnd.tsnd151 import TSND151
+from tsnd.utils.common_utils import check_range
+
+
+class _StreamBuffer:
+    """Raw payloads of a streaming code, waiting to be decoded as a batch."""
+
+    def __init__(self, max_records):
+        self.payloads = deque(maxlen=max_records)  # the oldest is dropped in O(1) when it is full
+        self.dropped = 0
+        self.event = asyncio.Event()
+
+    @property
+    def num(self):
+        return len(self.payloads)
+
+    def append(self, args, batch_size):
+        payloads = self.payloads
+        if len(payloads) == payloads.maxlen:
+            self.dropped += 1
+        payloads.append(args)
+        if len(payloads) >= batch_size:
+            self.event.set()
+
+    def take(self):
+        payloads = b''.join(self.payloads)
+        self.payloads.clear()
+        self.event.clear()
+        return payloads
+
+
+class AsyncTSND151:
+    """asyncio controller for TSND151. Please use AsyncTSND151.open.
+
+    Parameters
+    ----------
+    response_wait_timeout: int, float
+        timeout value to wait response
+
+    """
+
+    _LOGGER_ = getLogger("TSND151")
+
+    def __init__(self, response_wait_timeout=5):
+        self.response_wait_timeout = response_wait_timeout
+        self.serial = None
+        self._loop = None
+        self._decoder = FrameDecoder(TSND151._RESPONSE_ARG_LEN_MAP_, TSND151._START_BIT_)
+        self._waiters = {}  # response code -> deque of futures
+        self._streams = {}  # response code -> _StreamBuffer
+        self._stream_batch_size = {}
+        self._stream_dropped = {}  # response code -> records dropped by finished streams
+        self._cmd_lock = None
+        self._recording = False
+        self._recording_start_time = None
+        self._closed = False
+
+    @staticmethod
+    async def open(path_to_serial_port, baudrate=115200, response_wait_timeout=5):
+        """Open a TSND151 on the running event loop."""
+        tsnd151 = AsyncTSND151(response_wait_timeout=response_wait_timeout)
+        tsnd151._loop = asyncio.get_running_loop()
+        tsnd151._cmd_lock = asyncio.Lock()
+
+        if isinstance(path_to_serial_port, str):
+            tsnd151.serial = await tsnd151._loop.run_in_executor(
+                None, lambda: serial.Serial(port=path_to_serial_port, baudrate=baudrate, timeout=0))
+        else:
+            tsnd151.serial = path_to_serial_port
+        tsnd151._loop.add_reader(tsnd151.serial.fileno(), tsnd151._on_readable)
+
+        return tsnd151
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        if self.serial is not None:
+            try:
+                self._loop.remove_reader(self.serial.fileno())
+            except (OSError, ValueError):
+                pass
+            self.serial.close()
+
+        for waiters in self._waiters.values():
+            for fut in waiters:
+                if not fut.done():
+                    fut.set_exception(IOError("Serial is closed"))
+        self._waiters.clear()
+        for buf in self._streams.values():
+            buf.event.set()
+
+    @property
+    def recording_start_time(self):
+        return self._recording_start_time
+
+    def is_recording(self):
+        return self._recording
+
+    def dropped_records(self, resp_code):
+        """Number of records of resp_code dropped by stream() while the consumer was slow."""
+        if resp_code not in TSND151._RESPONSE_CODE_MAP_:
+            raise ValueError("Invalid response code")
+        code = TSND151._RESPONSE_CODE_MAP_[resp_code]
+        buf = self._streams.get(code)
+        return self._stream_dropped.get(code, 0) + (buf.dropped if buf is not None else 0)
+
+    # I/O
+
+    def _on_readable(self):
+        try:
+            waiting = self.serial.in_waiting
+            data = self.serial.read(waiting if waiting > 0 else 1)
+        except (serial.SerialException, IOError, OSError) as e:
+            self._LOGGER_.warning(f'Serial read failed. cause: {e}')
+            self._loop.create_task(self.close())
+            return
+
+        for cmd, args in self._decoder.feed(data):
+            self._dispatch(cmd, args)
+
+    def _dispatch(self, cmd, args):
+        if cmd == TSND151._RESPONSE_CODE_MAP_['start_recording']:
+            self._recording = True
+        elif cmd == TSND151._RESPONSE_CODE_MAP_['stop_recording']:
+            self._recording = False
+
+        waiters = self._waiters.get(cmd)
+        if waiters:
+            # responses come in the order of requests. A reply for a timed out request is dropped
+            # if it arrives in its window, like TSND151._complete, else it is regarded as lost.
+            now = self._loop.time()
+            while len(waiters) > 0:
+                fut = waiters.popleft()
+                if not fut.done():
+                    fut.set_result(args)
+                    return
+                if now < getattr(fut, 'drop_response_until', now):
+                    return
+
+        buf = self._streams.get(cmd)
+        if buf is not None:
+            buf.append(args, self._stream_batch_size[cmd])
+
+    def _expect(self, code_name):
+        """Register a future for the next response of code_name. Call it before sending."""
+        code = TSND151._RESPONSE_CODE_MAP_[code_name]
+        fut = self._loop.create_future()
+        fut.add_done_callback(self._on_request_done)
+        self._waiters.setdefault(code, deque()).append(fut)
+        return fut
+
+    def _on_request_done(self, fut):
+        if fut.cancelled() and not hasattr(fut, 'drop_response_until'):  # cancelled by a caller
+            fut.drop_response_until = self._loop.time() + TSND151._LATE_RESPONSE_SEC_
+
+    def _cancel_request(self, fut):
+        """Cancel a future kept registered to drop its late response.
+
+        drop_response_until is set before the cancel, since a reply may be dispatched
+        before the done callbacks run.
+        """
+        fut.drop_response_until = self._loop.time() + TSND151._LATE_RESPONSE_SEC_
+        fut.cancel()
+
+    def _discard(self, fut):
+        """Unregister a future whose response will never come, e.g., the command is rejected."""
+        fut.cancel()
+        for waiters in self._waiters.values():
+            if fut in waiters:
+                waiters.remove(fut)
+
+    def _send(self, cmd, args=(0x00,)):
+        if self._closed:
+            raise IOError("Serial is closed")
+        self.serial.write(bytes(TSND151.build_cmd(cmd, args)))
+
+    async def _wait(self, fut, code_name, timeout_sec=None):
+        if timeout_sec is None:
+            timeout_sec = self.response_wait_timeout
+        try:
+            return await asyncio.wait_for(fut, timeout_sec)
+        except asyncio.TimeoutError:
+            self._cancel_request(fut)
+            raise TimeoutError(f'Timeout occurred while waiting response for {code_name}')
+        except asyncio.CancelledError:
+            self._cancel_request(fut)
+            raise
+
+    async def request(self, cmd_name, args=(0x00,), code_name='simple', timeout_sec=None):
+        """Send a command and wait the response of code_name."""
+        fut = self._expect(code_name)
+        self._send(TSND151._CMD_CODE_MAP_[cmd_name], args)
+        return await self._wait(fut, code_name, timeout_sec)
+
+    async def _simple(self, cmd_name, args=(0x00,), check_mode=True):
+        async with self._cmd_lock:
+            if check_mode and not await self._check_is_cmd_mode():
+                return False
+            return await self.request(cmd_name, args) == TSND151._OK_BIT_
+
+    # commands
+
+    async def get_mode(self):
+        """
+        return: 0: USB_CMD, 1:USB_RECORDING, 2: BLT_CMD, 3:BLT_RECORDING
+        """
+        return (await self.request('get_mode', code_name='mode'))[0]
+
+    async def _check_is_cmd_mode(self, cannot_send_cmd_warn=True):
+        mode = await self.get_mode()
+        is_cmd_mode = mode == 0 or mode == 2
+        if cannot_send_cmd_warn and not is_cmd_mode:
+            self._LOGGER_.warning('Mode is recording. Command cannot be sent.')
+        return is_cmd_mode
+
+    async def check_is_cmd_mode(self, cannot_send_cmd_warn=True):
+        async with self._cmd_lock:
+            return await self._check_is_cmd_mode(cannot_send_cmd_warn)
+
+    async def set_time(self, dt=None):
+        if dt is not None and not isinstance(dt, datetime.datetime):
+            raise ValueError('Invalid dt. type(dt) have to be datetime.datetime.')
+
+        async with self._cmd_lock:
+            if not await self._check_is_cmd_mode():
+                return False
+            if dt is None:
+                dt = datetime.datetime.now()
+            msec = int(round(dt.microsecond / 1000)).to_bytes(2, "little", signed=False)
+            resp = await self.request('set_time', [dt.year % 100, dt.month, dt.day, dt.hour, dt.minute,
+                                                   dt.second, msec[0], msec[1]])
+            return resp == TSND151._OK_BIT_
+
+    async def get_time(self):
+        async with self._cmd_lock:
+            if not await self._check_is_cmd_mode():
+                return None
+            return TSND151.parse_time(await self.request('get_time', code_name='time'))
+
+    async def set_acc_range(self, g=4):
+        """g: 2 or 4 or 8 or 16"""
+        flags = {2: 0x00, 4: 0x01, 8: 0x02, 16: 0x03}
+        if g not in flags:
+            raise ValueError(f"Invalid acc range: (2,4,8,16) but {g}")
+
+        async with self._cmd_lock:
+            if not await self._check_is_cmd_mode():
+                return False
+            resp = await self.request('set_acc_range', [flags[g]], 'acc_range')
+            return resp[0] == flags[g]
+
+    async def set_gyro_range(self, dps=2000):
+        """dps: 250, 500, 1000, 2000"""
+        flags = {250: 0x00, 500: 0x01, 1000: 0x02, 2000: 0x03}
+        if dps not in flags:
+            raise ValueError(f"Invalid gyro range: (250,500,1000,2000) but {dps}")
+        return await self._simple('set_gyro_range', [flags[dps]])
+
+    async def set_quaternion_interval(self, interval_in_5ms_unit, avg_num_for_send=1, avg_num_for_save=0):
+        """See TSND151.set_quaternion_interval"""
+        check_range("interval_in_5ms_unit", interval_in_5ms_unit, 0, 51)
+        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
+        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
+        return await self._simple('set_quaternion_interval',
+                                  [interval_in_5ms_unit * 5, avg_num_for_send, avg_num_for_save])
+
+    async def set_acc_and_gyro_interval(self, interval_in_ms, avg_num_for_send=1, avg_num_for_save=0):
+        """See TSND151.set_acc_and_gyro_interval"""
+        check_range("interval_in_ms", interval_in_ms, 0, 255)
+        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
+        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
+        return await self._simple('set_acc_and_gyro_interval', [interval_in_ms, avg_num_for_send, avg_num_for_save])
+
+    async def set_magnetism_interval(self, interval_in_ms, avg_num_for_send=1, avg_num_for_save=0):
+        """See TSND151.set_magnetism_interval"""
+        if interval_in_ms != 0:
+            check_range("interval_in_ms", interval_in_ms, 10, 255)
+        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
+        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
+        return await self._simple('set_magnetism_interval', [interval_in_ms, avg_num_for_send, avg_num_for_save])
+
+    async def set_atmosphere_interval(self, interval_in_10ms_unit, avg_num_for_send=1, avg_num_for_save=0):
+        """See TSND151.set_atmosphere_interval"""
+        if interval_in_10ms_unit != 0:
+            check_range("interval_in_10ms_unit", interval_in_10ms_unit, 4, 255)
+        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
+        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
+        return await self._simple('set_atmosphere_interval',
+                                  [interval_in_10ms_unit, avg_num_for_send, avg_num_for_save])
+
+    async def set_battery_voltage_measurement(self, send=False, save=False):
+        """See TSND151.set_battery_voltage_measurement"""
+        return await self._simple('set_battery_voltage_measurement',
+                                  TSND151._set_battery_voltage_measurement_args(send, save))
+
+    async def set_option_button_behavior(self, mode):
+        mode = TSND151.OptionButtonMode(mode)
+        return await self._simple('set_option_button_behavior', [mode])
+
+    async def get_option_button_behavior(self):
+        """
+        return: one of the TSND151.OptionButtonMode
+        """
+        res = await self.request('get_option_button_behavior', code_name='option_button_behavior')
+        return TSND151.OptionButtonMode(int.from_bytes(res, byteorder='little'))
+
+    async def set_overwrite_protection(self, enable=False):
+        """See TSND151.set_overwrite_protection"""
+        return await self._simple('set_overwrite_protection', TSND151._set_overwrite_protection_args(enable))
+
+    async def get_overwrite_protection(self):
+        async with self._cmd_lock:
+            if not await self._check_is_cmd_mode():
+                return None
+            res = await self.request('get_overwrite_protection', code_name='overwrite_protection')
+            return res == TSND151._OVERWRITE_NG_BIT_
+
+    async def set_auto_power_off(self, minutes):
+        """
+        minutes: 0:off, 1-20:minutes for auto power off
+        """
+        if minutes != 0:
+            check_range("minutes", minutes, 1, 20)
+        return await self._simple('set_auto_power_off', [minutes])
+
+    async def start_recording(self, force_restart=False, return_start_time_hms=False):
+        async with self._cmd_lock:
+            if not await self._check_is_cmd_mode(False):
+                self._LOGGER_.warning('Recording already')
+                if not force_restart:
+                    return None
+                elif not await self._stop_recording():
+                    self._LOGGER_.warning('Failed to stop recording')
+                    return None
+
+            flag = [0, 0, 1, 1, 0, 0, 0,  # start immediately
+                    0, 0, 1, 1, 0, 0, 0]  # run forever
+            settings_fut = self._expect('recording_time_settings')
+            started_fut = self._expect('start_recording')
+            try:
+                self._send(TSND151._CMD_CODE_MAP_['start'], flag)
+                resp = await self._wait(settings_fut, 'recording_time_settings')
+                if resp[0] != 1:
+                    self._LOGGER_.warning('Start of recording is rejected')
+                    self._discard(started_fut)
+                    return None
+                if return_start_time_hms:
+                    start_time = datetime.datetime(resp[1] + 2000, resp[2], resp[3], resp[4], resp[5], resp[6])
+                else:
+                    start_time = datetime.datetime(resp[1] + 2000, resp[2], resp[3], 0, 0, 0)
+
+                await self._wait(started_fut, 'start_recording')
+            finally:
+                if not started_fut.done():  # not to take the next start notification
+                    self._cancel_request(started_fut)
+            self._recording = True
+            self._recording_start_time = start_time
+            return start_time
+
+    async def _stop_recording(self):
+        if await self._check_is_cmd_mode(False):
+            self._LOGGER_.info('Stopped already')
+            return True
+
+        stopped_fut = self._expect('stop_recording')
+        try:
+            if await self.request('stop') != TSND151._OK_BIT_:
+                self._discard(stopped_fut)
+                return False
+            await self._wait(stopped_fut, 'stop_recording')
+        finally:
+            if not stopped_fut.done():  # not to take the next stop notification
+                self._cancel_request(stopped_fut)
+        self._recording = False
+        self._recording_start_time = None
+        return True
+
+    async def stop_recording(self):
+        async with self._cmd_lock:
+            return await self._stop_recording()
+
+    async def get_recording_time_settings(self, return_start_time_hms=False):
+        async with self._cmd_lock:
+            if not await self._check_is_cmd_mode():
+                return None
+            resp = await self.request('get_recording_time_settings', code_name='recording_time_settings')
+
+        scheduled = resp[0] == 1
+        if return_start_time_hms:
+            start_time = datetime.datetime(resp[1] + 2000, resp[2], resp[3], resp[4], resp[5], resp[6])
+        else:
+            start_time = datetime.datetime(resp[1] + 2000, resp[2], resp[3], 0, 0, 0)
+        stop_time = datetime.datetime(resp[7] + 2000, resp[8], resp[9], resp[10], resp[11], resp[12])
+        return scheduled, start_time, stop_time
+
+    async def get_saved_entry_num(self):
+        async with self._cmd_lock:
+            if not await self._check_is_cmd_mode():
+                return None
+            return (await self.request('get_saved_entry_num', code_name='saved_entry_num'))[0]
+
+    async def get_saved_entry_start_date(self, entry_num: int, remove_hms=True):
+        """See TSND151.get_saved_entry_start_date"""
+        assert 1 <= entry_num <= 80
+
+        async with self._cmd_lock:
+            if not await self._check_is_cmd_mode():
+                return None
+            if entry_num > (await self.request('get_saved_entry_num', code_name='saved_entry_num'))[0]:
+                return None
+            dt = TSND151.parse_time(await self.request('get_saved_entry_info', [entry_num], 'saved_entry_info'))
+
+        if remove_hms:
+            dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        return dt
+
+    async def get_saved_entry(self, entry_num: int, timeout_sec=600):
+        """Download a saved entry. Records are delivered to stream() of their code."""
+        assert 1 <= entry_num <= 80
+
+        async with self._cmd_lock:
+            if not await self._check_is_cmd_mode():
+                return False
+            if entry_num > (await self.request('get_saved_entry_num', code_name='saved_entry_num'))[0]:
+                return False
+            await self.request('get_saved_entry', [entry_num], 'saved_entry_end', timeout_sec)
+            return True
+
+    async def clear_saved_entry(self):
+        return await self._simple('clear_saved_data')
+
+    # streaming
+
+    async def stream(self, resp_code, batch_size=100, max_latency=0.1, max_buffered_records=100000):
+        """Async iterator of decoded batches of a streaming response code.
+
+        Parameters
+        ----------
+        resp_code: str
+            a key of TSND151._RESPONSE_CODE_MAP_, e.g., 'acc_gyro_data'
+        batch_size: int
+            a batch is yielded when this number of records is received
+        max_latency: float
+            a batch is yielded at least every max_latency sec if records exist
+        max_buffered_records: int
+            the oldest records are dropped over it while the consumer is slow. See dropped_records.
+
+        Yields
+        ------
+        numpy.ndarray
+            structured array by tsnd.batch_decoder.decode_batch
+
+        """
+        from tsnd.batch_decoder import decode_batch
+
+        if resp_code not in TSND151._RESPONSE_CODE_MAP_:
+            raise ValueError("Invalid response code")
+
+        code = TSND151._RESPONSE_CODE_MAP_[resp_code]
+        if code in self._streams:
+            raise ValueError(f"{resp_code} is streamed already")
+        buf = _StreamBuffer(max_buffered_records)
+        self._streams[code] = buf
+        self._stream_batch_size[code] = batch_size
+        try:
+            while not self._closed:
+                try:
+                    await asyncio.wait_for(buf.event.wait(), max_latency)
+                except asyncio.TimeoutError:
+                    pass
+                if buf.num > 0:
+                    yield decode_batch(code, buf.take())
+        finally:
+            del self._streams[code]
+            del self._stream_batch_size[code]
+            self._stream_dropped[code] = self._stream_dropped.get(code, 0) + buf.dropped
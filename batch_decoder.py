@@ -0,0 +1,139 @@
+"""Vectorized decoders for batches of TSND151 sample records.
+
+Each decoder takes N payloads of one response code, either concatenated into
+one bytes-like object or as an iterable of bytes (e.g., drained from a queue),
+and decodes them in one pass into a NumPy structured array.
+
+Example
+-------
+>>> payloads = [q.get() for i in range(q.qsize())]
+>>> rec = decode_quaternion_acc_gyro_batch(payloads)
+>>> rec['ms'], rec['acc'][:, 0]
+
+NumPy is required for this module.
+"""
+import numpy as np
+from tsnd.protocol import RESPONSE_LAYOUTS
+
+# code -> record length and fields as (name, offset, byte size, count, signed), of every code of tsnd.protocol.
+# 'bytes' fields are uint8 values.
+_ALL_LAYOUTS_ = {code: (layout.size, tuple((f.name, f.offset, f.size, f.count, f.signed) for f in layout.fields))
+                 for code, layout in RESPONSE_LAYOUTS.items()}
+
+# sample streams, e.g., of recordings, as {code: (record length, fields)}
+SAMPLE_LAYOUTS = {code: _ALL_LAYOUTS_[code] for code in (b'\x80', b'\x81', b'\x82', b'\x83', b'\x8A')}
+_LAYOUTS_ = SAMPLE_LAYOUTS  # old name, kept for code importing it
+
+
+def _field_dtype(size, signed):
+    if size <= 1:
+        return np.int8 if signed else np.uint8
+    elif size == 2:
+        return np.int16 if signed else np.uint16
+    else:
+        return np.int32 if signed else np.uint32
+
+
+def _as_record_matrix(payloads, rec_len):
+    if isinstance(payloads, (bytes, bytearray, memoryview)):
+        buf = payloads
+    elif isinstance(payloads, np.ndarray):
+        buf = np.ascontiguousarray(payloads, dtype=np.uint8)
+    else:
+        buf = b''.join(payloads)
+
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    if raw.size % rec_len != 0:
+        raise ValueError(f"Invalid payload length: {raw.size} is not a multiple of {rec_len}")
+
+    return raw.reshape(-1, rec_len)
+
+
+def _decode_int_le(raw, offset, size, count, signed):
+    """Decode count little-endian ints of size bytes from each row of raw."""
+    cols = raw[:, offset:offset + size * count].reshape(-1, count, size)
+    if size in (1, 2, 4):
+        # native width: reinterpret bytes directly
+        dt = np.dtype(f"{'i' if signed else 'u'}{size}").newbyteorder('<')
+        res = np.ascontiguousarray(cols).view(dt).reshape(-1, count)
+        return res.astype(_field_dtype(size, signed), copy=False)
+
+    # 24 bit: pad each value to 4 bytes and reinterpret as int32
+    padded = np.empty(cols.shape[0:2] + (4,), dtype=np.uint8)
+    padded[:, :, 0:size] = cols
+    if signed:
+        # sign extension: fill the upper byte with 0xFF if the MSB is set
+        padded[:, :, 3] = (cols[:, :, size - 1] >> 7) * np.uint8(0xFF)
+    else:
+        padded[:, :, 3] = 0
+
+    dt = np.dtype('i4' if signed else 'u4').newbyteorder('<')
+    return padded.view(dt).reshape(-1, count).astype(_field_dtype(size, signed), copy=False)
+
+
+def decode_batch(code, payloads):
+    """Decode payloads of the response code into a structured array.
+
+    Parameters
+    ----------
+    code: bytes
+        response code, a key of tsnd.protocol.RESPONSE_TABLE, e.g., b'\\x80'
+    payloads: bytes-like or iterable of bytes
+        N concatenated payloads, or N payloads
+
+    Returns
+    -------
+    numpy.ndarray
+        structured array of length N. Multi-axis fields have shape (N, axis).
+
+    Raises
+    ------
+    ValueError
+        If the code is not supported or the payload length is invalid.
+
+    """
+    if code not in _ALL_LAYOUTS_:
+        raise ValueError(f"Unsupported response code: {code}")
+
+    rec_len, fields = _ALL_LAYOUTS_[code]
+    raw = _as_record_matrix(payloads, rec_len)
+
+    dtype = np.dtype([(name, _field_dtype(size, signed), (count,)) if count > 1
+                      else (name, _field_dtype(size, signed))
+                      for name, offset, size, count, signed in fields])
+    res = np.empty(raw.shape[0], dtype=dtype)
+    for name, offset, size, count, signed in fields:
+        values = _decode_int_le(raw, offset, size, count, signed)
+        res[name] = values if count > 1 else values[:, 0]
+
+    return res
+
+
+def decode_acc_gyro_batch(payloads):
+    """Batch version of TSND151.parse_acc_gyro: fields ms, acc (N,3), gyro (N,3)."""
+    return decode_batch(b'\x80', payloads)
+
+
+def decode_magnetism_batch(payloads):
+    """Decode magnetism_data records: fields ms, mag (N,3) in 0.1 uT."""
+    return decode_batch(b'\x81', payloads)
+
+
+def decode_atmosphere_batch(payloads):
+    """Batch version of TSND151.parse_atmosphere: fields ms, atmosphere, temperature."""
+    return decode_batch(b'\x82', payloads)
+
+
+def decode_battery_voltage_batch(payloads):
+    """Decode battery_voltage_data records: fields ms, voltage in 0.01 V, remaining in %."""
+    return decode_batch(b'\x83', payloads)
+
+
+def decode_quaternion_acc_gyro_batch(payloads):
+    """Batch version of TSND151.parse_quaternion_acc_gyro: fields ms, quat (N,4), acc (N,3), gyro (N,3)."""
+    return decode_batch(b'\x8A', payloads)
+
+
+def drain_queue(q):
+    """Get all payloads currently stored in q as a list."""
+    return [q.get() for i in range(q.qsize())]
@@ -0,0 +1,275 @@
+"""Benchmarks of the hot paths of TSND151.
+
+It reports, as JSON,
+- parser throughput (parse_acc_gyro, parse_quaternion_acc_gyro, and batch decoders if NumPy is available)
+- read_response / read_frames frames/sec over an in-memory byte source
+- build_cmd and send cost
+- wait_response round-trip latency of get_mode (on the emulator)
+- end-to-end sample latency percentiles for 1, 4 and 16 emulated sensors
+
+Usage::
+
+    python -m tsnd.benchmark [--quick] [--output result.json] [--sensors 1,4,16]
+
+The emulator benchmarks need a pty (Linux/macOS). They are reported as skipped otherwise.
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import sys
+import time
+from tsnd.tsnd151 import TSND151
+
+
+class MemorySerial:
+    """Serial-like in-memory byte source. Written bytes are discarded."""
+
+    def __init__(self, data=b'', chunk_size=4096):
+        self.data = data
+        self.pos = 0
+        self.chunk_size = chunk_size
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk_size, len(self.data) - self.pos)
+
+    def read(self, size=1):
+        res = self.data[self.pos:self.pos + size]
+        self.pos += len(res)
+        return res
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+def _frame(code, args):
+    return bytes(TSND151.build_cmd(code, list(args)))
+
+
+def _stream(frame_num, seed=0):
+    """Byte stream of alternating 0x80 and 0x8A frames."""
+    rand = random.Random(seed)
+    out = bytearray()
+    for i in range(frame_num):
+        if i % 2 == 0:
+            out += _frame(0x80, rand.randbytes(22))
+        else:
+            out += _frame(0x8A, rand.randbytes(30))
+    return bytes(out)
+
+
+def _percentiles(values, ps=(50, 90, 99, 100)):
+    if len(values) == 0:
+        return {}
+    values = sorted(values)
+    return {f'p{p}': values[min(len(values) - 1, int(len(values) * p / 100))] for p in ps}
+
+
+def _offline_device(data=b''):
+    tsnd151 = TSND151()
+    tsnd151.serial = MemorySerial(data)
+    tsnd151._serial_property['timeout'] = 1
+    return tsnd151
+
+
+def _per_sec(func, num):
+    start = time.perf_counter()
+    func()
+    return num / (time.perf_counter() - start)
+
+
+def bench_parsers(num):
+    rand = random.Random(0)
+    acc_gyro = [rand.randbytes(22) for i in range(num)]
+    quat = [rand.randbytes(30) for i in range(num)]
+
+    res = {
+        'parse_acc_gyro_records_per_sec': _per_sec(lambda: [TSND151.parse_acc_gyro(b) for b in acc_gyro], num)
+        , 'parse_quaternion_acc_gyro_records_per_sec': _per_sec(
+            lambda: [TSND151.parse_quaternion_acc_gyro(b) for b in quat], num)
+    }
+
+    try:
+        from tsnd.batch_decoder import decode_acc_gyro_batch, decode_quaternion_acc_gyro_batch
+    except ImportError:
+        return res
+
+    res['decode_acc_gyro_batch_records_per_sec'] = _per_sec(lambda: decode_acc_gyro_batch(acc_gyro), num)
+    res['decode_quaternion_acc_gyro_batch_records_per_sec'] = _per_sec(
+        lambda: decode_quaternion_acc_gyro_batch(quat), num)
+    return res
+
+
+def bench_read(num):
+    data = _stream(num)
+
+    def _read_response():
+        tsnd151 = _offline_device(data)
+        for i in range(num):
+            tsnd151.read_response()
+        tsnd151.close(0)  # not to sleep on garbage collection in other measurements
+
+    def _read_frames():
+        tsnd151 = _offline_device(data)
+        n = 0
+        while n < num:
+            n += len(tsnd151.read_frames())
+        tsnd151.close(0)
+
+    return {
+        'read_response_frames_per_sec': _per_sec(_read_response, num)
+        , 'read_frames_frames_per_sec': _per_sec(_read_frames, num)
+    }
+
+
+def bench_send(num):
+    tsnd151 = _offline_device()
+    args = [0, 0, 1, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0]
+
+    def _build_cmd():
+        for i in range(num):
+            TSND151.build_cmd(0x13, args)
+
+    def _send():
+        for i in range(num):
+            tsnd151.send(0x13, args)
+
+    res = {
+        'build_cmd_us': 1e6 / _per_sec(_build_cmd, num)
+        , 'send_us': 1e6 / _per_sec(_send, num)
+    }
+    tsnd151.close(0)
+    return res
+
+
+def _open_on_emulator(emu):
+    return TSND151.open(emu.port, wait_sec_on_open_for_stability=0, wait_sec_on_auto_close_for_stability=0)
+
+
+def bench_get_mode(num):
+    from tsnd.emulator import TSND151Emulator
+
+    with TSND151Emulator() as emu:
+        with _open_on_emulator(emu) as tsnd151:
+            latencies = []
+            for i in range(num):
+                start = time.perf_counter()
+                tsnd151.get_mode()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    return {'get_mode_round_trip_ms': _percentiles(latencies)}
+
+
+class _StampingSink:
+    """Response queue which keeps (receive time, ms counter) of each sample."""
+
+    def __init__(self):
+        self.stamps = []
+
+    def put(self, args, block=True, timeout=None):
+        self.stamps.append((time.monotonic(), int.from_bytes(args[0:4], 'little')))
+
+
+def bench_end_to_end(sensor_nums, duration_sec, interval_ms):
+    from tsnd.emulator import TSND151Emulator
+
+    res = {}
+    for sensor_num in sensor_nums:
+        emulators = [TSND151Emulator(serial_number=f'AP{i:08d}') for i in range(sensor_num)]
+        devices = []
+        sinks = []
+        try:
+            for emu in emulators:
+                tsnd151 = _open_on_emulator(emu)
+                devices.append(tsnd151)
+                tsnd151.set_acc_and_gyro_interval(interval_ms, 1, 0)
+                sink = _StampingSink()
+                sinks.append(sink)
+                tsnd151.set_response_queue('acc_gyro_data', sink)
+
+            cpu_start = time.process_time()
+            wall_start = time.monotonic()
+            for tsnd151 in devices:
+                tsnd151.start_recording()
+            time.sleep(duration_sec)
+            for tsnd151 in devices:
+                tsnd151.stop_recording()
+            cpu_sec = time.process_time() - cpu_start
+            wall_sec = time.monotonic() - wall_start
+            recorded_sec = sum(emu.last_recording_sec for emu in emulators)
+
+            latencies = []
+            for emu, sink in zip(emulators, sinks):
+                latencies.extend((t - emu.sample_due_time(ms)) * 1000 for t, ms in sink.stamps)
+        finally:
+            for tsnd151 in devices:
+                tsnd151.close(0)
+            for emu in emulators:
+                emu.close()
+
+        expected = recorded_sec * 1000 / interval_ms
+        res[f'{sensor_num}_sensors'] = {
+            'sample_latency_ms': _percentiles(latencies)
+            , 'received_samples': len(latencies)
+            , 'delivered_ratio': len(latencies) / expected if expected > 0 else None
+            , 'cpu_sec_per_sec': cpu_sec / wall_sec
+        }
+    return res
+
+
+def run(quick=False, sensor_nums=(1, 4, 16), duration_sec=None, interval_ms=10):
+    """Run all benchmarks and return the results as a dict."""
+    num = 20000 if quick else 200000
+    if duration_sec is None:
+        duration_sec = 1 if quick else 3
+
+    results = {
+        'parsers': bench_parsers(num)
+        , 'read': bench_read(num)
+        , 'send': bench_send(num // 10)
+    }
+
+    try:
+        results['get_mode'] = bench_get_mode(50 if quick else 500)
+        results['end_to_end'] = bench_end_to_end(sensor_nums, duration_sec, interval_ms)
+    except (ImportError, OSError) as e:
+        results['get_mode'] = results['end_to_end'] = {'skipped': str(e)}
+
+    return {
+        'timestamp': datetime.datetime.now().isoformat()
+        , 'python': sys.version.split()[0]
+        , 'platform': platform.platform()
+        , 'quick': quick
+        , 'results': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of TSND151 hot paths, emitted as JSON.')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations')
+    parser.add_argument('--output', default=None, help='output JSON path (default: stdout)')
+    parser.add_argument('--sensors', default='1,4,16', help='comma separated numbers of emulated sensors')
+    parser.add_argument('--duration', type=float, default=None, help='streaming sec per end-to-end run')
+    parser.add_argument('--interval-ms', type=int, default=10, help='acc/gyro interval of emulated sensors')
+    opts = parser.parse_args(argv)
+
+    res = run(opts.quick, [int(n) for n in opts.sensors.split(',')], opts.duration, opts.interval_ms)
+    text = json.dumps(res, indent=2)
+    if opts.output is None:
+        print(text)
+    else:
+        with open(opts.output, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
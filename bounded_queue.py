@@ -0,0 +1,223 @@
+"""Bounded response queue with an overflow policy and a high-water callback.
+
+The response queues of TSND151 are unbounded queue.Queue, so a stalled
+consumer of a 1 kHz stream grows memory without limit. BoundedQueue keeps at
+most `capacity` payloads in memory and applies a policy when it is full:
+
+drop_oldest   drop the oldest payload (def)
+drop_newest   drop the new payload
+block         block the putter, i.e., the reader thread, until the consumer catches up.
+              Bytes accumulate in the serial driver meanwhile. After a block times out,
+              payloads are dropped without blocking until the consumer gets one.
+spill         append payloads to a temporary file and read them back in order
+
+Dropped payloads are counted by overflow_count. on_high_water is called once
+the depth reaches high_water, and is re-armed when it falls to low_water.
+
+Example
+-------
+>>> q = tsnd151.set_queue_limit('acc_gyro_data', 60000, 'drop_oldest',
+...                             on_high_water=lambda q: print('consumer is behind', q.qsize()))
+>>> q.get(), q.overflow_count
+"""
+import struct
+import tempfile
+import time
+from collections import deque
+from logging import getLogger
+from queue import Empty
+from threading import Condition, Lock
+
+_LOGGER_ = getLogger("TSND151")
+
+_SPILL_LENGTH_ = struct.Struct('<I')
+
+
+class BoundedQueue:
+    """Queue of payloads with a capacity and an overflow policy, see the module docstring.
+
+    It has put/get/get_nowait/qsize/empty like queue.Queue, so it can be set by
+    TSND151.set_response_queue. Items have to be bytes-like for the spill policy.
+
+    Parameters
+    ----------
+    capacity: int
+        max number of payloads kept in memory
+    policy: str
+        'drop_oldest', 'drop_newest', 'block' or 'spill'
+    high_water: int or None
+        depth to call on_high_water (def: 80% of capacity). The depth includes spilled payloads.
+    low_water: int or None
+        depth to re-arm on_high_water (def: half of high_water)
+    on_high_water: callable or None
+        called with the queue in the putting thread, outside the lock of the queue
+    block_timeout: int, float or None
+        max sec to block for the block policy. The payload is dropped after it. None waits forever.
+    spill_dir: str or None
+        directory of the temporary file for the spill policy
+
+    """
+
+    _POLICIES_ = ('drop_oldest', 'drop_newest', 'block', 'spill')
+
+    def __init__(self, capacity, policy='drop_oldest', high_water=None, low_water=None, on_high_water=None,
+                 block_timeout=None, spill_dir=None):
+        if capacity <= 0:
+            raise ValueError(f"Invalid capacity: {capacity}")
+        if policy not in self._POLICIES_:
+            raise ValueError(f"Invalid policy: {policy}")
+
+        self.capacity = capacity
+        self.policy = policy
+        self.high_water = high_water if high_water is not None else max(1, capacity * 4 // 5)
+        self.low_water = low_water if low_water is not None else self.high_water // 2
+        self.on_high_water = on_high_water
+        self.block_timeout = block_timeout
+        self.spill_dir = spill_dir
+
+        self._items = deque()
+        self._cond = Condition(Lock())
+        self._armed = True
+        self._stalled = False  # a block timed out, and the consumer has not got a payload since
+
+        self._spill = None  # temporary file
+        self._spill_read_pos = 0
+        self._spill_write_pos = 0
+        self._spill_num = 0  # payloads in the file not read yet
+
+        self.put_count = 0
+        self.overflow_count = 0
+        self.spilled_count = 0
+        self.blocked_sec = 0.0
+        self.high_water_count = 0
+        self.max_depth = 0
+
+    def put(self, item, block=True, timeout=None):
+        """Put a payload applying the policy. block and timeout are ignored (see block_timeout)."""
+        with self._cond:
+            self.put_count += 1
+            if self.policy == 'spill' and (self._spill_num > 0 or len(self._items) >= self.capacity):
+                self._spill_put(item)  # after spilled ones to keep the order
+            elif len(self._items) < self.capacity:
+                self._items.append(item)
+            elif self.policy == 'drop_oldest':
+                self._items.popleft()
+                self._items.append(item)
+                self.overflow_count += 1
+            elif self.policy == 'drop_newest':
+                self.overflow_count += 1
+                return
+            elif self._stalled or not self._wait_for_space():
+                self._stalled = True
+                self.overflow_count += 1
+                return
+            else:
+                self._items.append(item)
+
+            depth = len(self._items) + self._spill_num
+            if depth > self.max_depth:
+                self.max_depth = depth
+            fire = self._armed and depth >= self.high_water
+            if fire:
+                self._armed = False
+                self.high_water_count += 1
+            self._cond.notify_all()
+
+        if fire and self.on_high_water is not None:
+            try:
+                self.on_high_water(self)
+            except Exception as e:
+                _LOGGER_.warning(f'on_high_water failed. cause: {e}')
+
+    def _wait_for_space(self):
+        start = time.monotonic()
+        end_time = None if self.block_timeout is None else start + self.block_timeout
+        try:
+            while len(self._items) >= self.capacity:
+                remaining = None if end_time is None else end_time - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+        finally:
+            self.blocked_sec += time.monotonic() - start
+
+    def _spill_put(self, item):
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(prefix='tsnd_spill_', dir=self.spill_dir)
+        self._spill.seek(self._spill_write_pos)
+        self._spill.write(_SPILL_LENGTH_.pack(len(item)))
+        self._spill.write(item)
+        self._spill_write_pos = self._spill.tell()
+        self._spill_num += 1
+        self.spilled_count += 1
+
+    def _unspill(self):
+        """Move spilled payloads back into memory, up to the capacity."""
+        f = self._spill
+        f.seek(self._spill_read_pos)
+        n = min(self._spill_num, self.capacity - len(self._items))
+        for i in range(n):
+            length = _SPILL_LENGTH_.unpack(f.read(_SPILL_LENGTH_.size))[0]
+            self._items.append(f.read(length))
+        self._spill_read_pos = f.tell()
+        self._spill_num -= n
+        if self._spill_num == 0:
+            f.seek(0)
+            f.truncate()
+            self._spill_read_pos = self._spill_write_pos = 0
+
+    def get(self, block=True, timeout=None):
+        """Get the oldest payload, like queue.Queue.get."""
+        with self._cond:
+            if block:
+                end_time = None if timeout is None else time.monotonic() + timeout
+                while len(self._items) == 0 and self._spill_num == 0:
+                    remaining = None if end_time is None else end_time - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise Empty
+                    self._cond.wait(remaining)
+            elif len(self._items) == 0 and self._spill_num == 0:
+                raise Empty
+
+            if len(self._items) == 0:
+                self._unspill()
+            item = self._items.popleft()
+            self._stalled = False
+            if not self._armed and len(self._items) + self._spill_num <= self.low_water:
+                self._armed = True
+            self._cond.notify_all()
+            return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self):
+        return len(self._items) + self._spill_num
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def close(self):
+        """Drop payloads and remove the spill file."""
+        with self._cond:
+            self._items.clear()
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+            self._spill_num = 0
+            self._spill_read_pos = self._spill_write_pos = 0
+            self._cond.notify_all()
+
+    def stats(self):
+        """{'depth', 'max_depth', 'put', 'overflow', 'spilled', 'blocked_sec', 'high_water'}"""
+        with self._cond:
+            return {
+                'depth': len(self._items) + self._spill_num
+                , 'max_depth': self.max_depth
+                , 'put': self.put_count
+                , 'overflow': self.overflow_count
+                , 'spilled': self.spilled_count
+                , 'blocked_sec': self.blocked_sec
+                , 'high_water': self.high_water_count
+            }
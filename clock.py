@@ -0,0 +1,220 @@
+"""Clock synchronization between a TSND151 and the host, and vectorized timestamps.
+
+Samples carry a 32-bit ms counter of the device clock, e.g., ms of the day
+the recording started. ClockSync estimates the offset and the drift of the
+device clock to the host clock by a regression over timestamped get_time
+exchanges, using only exchanges with short round trips. TimestampConverter
+maps whole ms counter arrays to host datetime64 arrays, unwrapping the
+counter at 2^32 ms (about 49.7 days) across chunks.
+
+Times are naive local times like datetime.datetime.now().
+
+Example
+-------
+>>> clock = ClockSync(tsnd151).sync()
+>>> clock.offset_sec, clock.drift_ppm
+>>> start_time = tsnd151.start_recording()  # 0:00 of the start day, the origin of the ms counter
+>>> converter = TimestampConverter(start_time, clock)
+>>> times = converter.convert(decode_quaternion_acc_gyro_batch(drain_queue(q))['ms'])
+>>> clock.sync()  # re-run in a long session to follow the drift
+
+NumPy is required for this module.
+"""
+import datetime
+from collections import deque
+from logging import getLogger
+import numpy as np
+from tsnd.tsnd151 import TSND151
+
+_LOGGER_ = getLogger("TSND151")
+
+_EPOCH_ = datetime.datetime(1970, 1, 1)
+_ONE_US_ = datetime.timedelta(microseconds=1)
+_WRAP_ = 1 << 32  # ms counter range
+_HALF_WRAP_ = 1 << 31
+
+
+def _to_us(dt):
+    """Naive datetime to us since 1970-01-01, the unit of datetime64[us]."""
+    return (dt - _EPOCH_) // _ONE_US_
+
+
+class ClockSync:
+    """Offset and drift of the device clock to the host clock.
+
+    host time = device time + offset + drift * (device time - reference time)
+
+    i.e., the drift is negative if the device clock runs fast.
+
+    Each get_time exchange gives a device time and the host time at the middle
+    of its round trip, from the write of the command to the arrival of the response. The device time has ms resolution (truncated), so
+    0.5 ms is added to it, and the regression over many exchanges averages the
+    resolution out. Exchanges of each sync() with a round trip over the
+    rtt_keep_ratio quantile are dropped, since a slow round trip leaves the
+    device time anywhere in it.
+
+    Parameters
+    ----------
+    tsnd151: TSND151
+    max_exchanges: int
+        max number of exchanges kept for the regression, i.e., older ones are forgotten
+    rtt_keep_ratio: float
+        ratio of the exchanges with the shortest round trips kept in each sync(), in (0, 1]
+    min_drift_span_sec: int, float
+        min span of the kept exchanges to estimate the drift. The drift is 0 below it,
+        since a short span gives a noisy slope.
+
+    """
+
+    def __init__(self, tsnd151, max_exchanges=500, rtt_keep_ratio=0.5, min_drift_span_sec=60):
+        if not 0 < rtt_keep_ratio <= 1:
+            raise ValueError(f"Invalid rtt_keep_ratio: {rtt_keep_ratio}")
+        self.tsnd151 = tsnd151
+        self.rtt_keep_ratio = rtt_keep_ratio
+        self.min_drift_span_sec = min_drift_span_sec
+        self._exchanges = deque(maxlen=max_exchanges)  # (device us, host us, rtt us)
+        self.offset_us = 0.0
+        self.drift = 0.0
+        self.reference_us = 0
+        self.residual_us = None
+        self.synced_at = None
+
+    @property
+    def offset_sec(self):
+        return self.offset_us / 1000000
+
+    @property
+    def drift_ppm(self):
+        return self.drift * 1000000
+
+    @property
+    def exchanges(self):
+        """Kept exchanges as a list of (device us, host us at the middle, round trip us)."""
+        return list(self._exchanges)
+
+    def _exchange(self, timeout_sec):
+        fut = self.tsnd151.send_request('get_time', code_name='time')
+        sent = _to_us(datetime.datetime.now())  # after the write, which may wait for the serial lock
+        received = []
+        fut.add_done_callback(lambda f: received.append(_to_us(datetime.datetime.now())))  # in the reader thread
+        resp = self.tsnd151.wait_request(fut, timeout_sec)
+
+        received = max(sent, received[0])
+        device_us = _to_us(TSND151.parse_time(resp)) + 500  # middle of the truncated ms
+        return device_us, sent + (received - sent) // 2, received - sent
+
+    def sync(self, n=20, timeout_sec=None):
+        """Run n get_time exchanges and update the offset and the drift.
+
+        get_time is sent directly, so it can be re-run while recording.
+
+        Parameters
+        ----------
+        n: int
+            number of exchanges
+        timeout_sec: int, float or None
+            timeout of each exchange (def: tsnd151.response_wait_timeout)
+
+        Returns
+        -------
+        ClockSync
+            self
+
+        Raises
+        ------
+        TimeoutError
+            If a response does not arrive. Exchanges before it are kept.
+
+        """
+        batch = []
+        try:
+            for i in range(n):
+                batch.append(self._exchange(timeout_sec))
+        finally:
+            if len(batch) > 0:
+                rtt_limit = np.quantile([rtt for _, _, rtt in batch], self.rtt_keep_ratio)
+                self._exchanges.extend(x for x in batch if x[2] <= rtt_limit)
+                self._fit()
+        return self
+
+    def _fit(self):
+        exchanges = np.array(self._exchanges, dtype=np.int64)
+        device_us, host_us = exchanges[:, 0], exchanges[:, 1]
+        self.reference_us = int(device_us.mean())
+        x = (device_us - self.reference_us).astype(np.float64)
+        y = (host_us - device_us).astype(np.float64)
+
+        if x.max() - x.min() >= self.min_drift_span_sec * 1000000:
+            self.drift, self.offset_us = (float(v) for v in np.polyfit(x, y, 1))
+        else:
+            self.drift, self.offset_us = 0.0, float(y.mean())
+        self.residual_us = float(np.std(y - (self.offset_us + self.drift * x)))
+        self.synced_at = datetime.datetime.now()
+        _LOGGER_.info(f'Clock synced: offset={self.offset_sec:.6f} sec, drift={self.drift_ppm:.2f} ppm, '
+                      f'residual={self.residual_us:.0f} us, exchanges={len(exchanges)}')
+
+    def to_host_us(self, device_us):
+        """Map device times in us since 1970-01-01 (int64 array) to host times."""
+        device_us = np.asarray(device_us, dtype=np.int64)
+        correction = self.offset_us + self.drift * (device_us - self.reference_us)
+        return device_us + np.rint(correction).astype(np.int64)
+
+    def to_host(self, dt):
+        """Map a device datetime.datetime to the host datetime.datetime."""
+        return _EPOCH_ + int(self.to_host_us(_to_us(dt))) * _ONE_US_
+
+    def __repr__(self):
+        return (f'ClockSync(offset_sec={self.offset_sec:.6f}, drift_ppm={self.drift_ppm:.2f}, '
+                f'exchanges={len(self._exchanges)})')
+
+
+class TimestampConverter:
+    """Converter of ms counters of samples into host datetime64[us] arrays.
+
+    Feed chunks of one stream in order. The counter is unwrapped against the
+    previous sample, i.e., a step back over 2^31 ms is a wraparound, so chunks
+    may cross the wraparound and samples slightly out of order are kept as is.
+
+    Parameters
+    ----------
+    origin: datetime.datetime
+        device time of the ms counter 0, e.g., the start time returned by
+        start_recording (0:00 of the start day)
+    clock: ClockSync or None
+        maps the device time to the host time. If None, device times are returned.
+
+    """
+
+    def __init__(self, origin, clock=None):
+        self.origin = origin
+        self.clock = clock
+        self._origin_us = _to_us(origin)
+        self._last_ms = None  # unwrapped ms counter of the last sample
+
+    def unwrap(self, ms):
+        """Unwrap a chunk of ms counters into an int64 array continuing the previous chunk."""
+        ms = np.asarray(ms, dtype=np.int64).reshape(-1)
+        if ms.size == 0:
+            return ms
+
+        previous = ms[0] if self._last_ms is None else self._last_ms
+        steps = (np.diff(ms, prepend=previous) + _HALF_WRAP_) % _WRAP_ - _HALF_WRAP_
+        unwrapped = previous + np.cumsum(steps)
+        self._last_ms = int(unwrapped[-1])
+        return unwrapped
+
+    def convert(self, ms):
+        """Convert a chunk of ms counters into a datetime64[us] array."""
+        device_us = self._origin_us + self.unwrap(ms) * 1000
+        if self.clock is not None:
+            device_us = self.clock.to_host_us(device_us)
+        return device_us.astype('datetime64[us]')
+
+    def reset(self):
+        """Forget the previous chunk, e.g., for a new recording."""
+        self._last_ms = None
+
+
+def ms_to_datetime64(ms, origin, clock=None):
+    """Convert ms counters of one stream into a datetime64[us] array, see TimestampConverter."""
+    return TimestampConverter(origin, clock).convert(ms)
@@ -0,0 +1,358 @@
+"""Continuity tracking of sample streams: gaps, duplicates and out-of-order frames.
+
+Each sample carries a ms counter which advances by a fixed step per frame,
+the interval times the SMA count for sending, e.g., 2 ms x 10 = 20 ms for
+set_acc_and_gyro_interval(2, 10). ContinuityTracker checks the counter of
+every sample frame against the last one of its stream, counts gaps (with the
+estimated number of lost frames), duplicates and out-of-order frames, keeps
+them as events, and reports totals and the delivered rate per recording
+session. continuity_flags and annotate mark the same events in decoded
+records.
+
+Example
+-------
+>>> tracker = ContinuityTracker(expected_steps_of(tsnd151.applied_settings))
+>>> tsnd151.set_continuity_tracker(tracker)  # observes every frame in the reader thread
+>>> tsnd151.start_recording()
+>>> ...
+>>> tracker.report(tsnd151)['streams']['acc_gyro_data']  # {'received': ..., 'lost': ..., 'delivered_hz': ...}
+>>> rec = annotate(decode_acc_gyro_batch(payloads), 20)  # rec['flags'] & GAP
+
+NumPy is required for this module.
+"""
+import datetime
+import time
+from collections import deque
+from logging import getLogger
+from threading import Lock
+import numpy as np
+from tsnd.tsnd151 import TSND151
+
+_LOGGER_ = getLogger("TSND151")
+
+# flags of a record
+GAP = 0x01  # frames are lost before the record
+DUPLICATE = 0x02  # same ms counter as the last record
+OUT_OF_ORDER = 0x04  # ms counter behind the last record
+
+_WRAP_ = 1 << 32
+_HALF_WRAP_ = 1 << 31
+_INFER_STEP_SAMPLES_ = 16  # samples to infer an unknown step
+
+# sample codes -> response code name
+_SAMPLE_CODES_ = {TSND151._RESPONSE_CODE_MAP_[name]: name
+                  for name in ('acc_gyro_data', 'magnetism_data', 'atmosphere_data', 'quaternion_acc_gyro_data')}
+
+# setter -> (response code name, ms of a unit of the interval)
+_STEP_SETTERS_ = {
+    'set_acc_and_gyro_interval': ('acc_gyro_data', 'interval_in_ms', 1)
+    , 'set_magnetism_interval': ('magnetism_data', 'interval_in_ms', 1)
+    , 'set_atmosphere_interval': ('atmosphere_data', 'interval_in_10ms_unit', 10)
+    , 'set_quaternion_interval': ('quaternion_acc_gyro_data', 'interval_in_5ms_unit', 5)
+}
+
+
+def expected_steps_of(applied_settings):
+    """Expected ms steps of streams from TSND151.applied_settings, as {response code name: ms}.
+
+    Streams disabled or not set by the setters are not included, i.e., their steps are inferred.
+    """
+    steps = {}
+    for setter_name, (code_name, interval_name, unit_ms) in _STEP_SETTERS_.items():
+        kwargs = applied_settings.get(setter_name)
+        if kwargs is None:
+            continue
+        step = kwargs.get(interval_name, 0) * unit_ms * kwargs.get('avg_num_for_send', 1)
+        if step > 0:
+            steps[code_name] = step
+    return steps
+
+
+def _lost_frames(diff, step):
+    return max(0, int(round(diff / step)) - 1)
+
+
+class ContinuityEvent:
+    """A gap, duplicate or out-of-order frame of a stream.
+
+    Parameters
+    ----------
+    kind: str
+        'gap', 'duplicate', 'out_of_order', 'reconnect' or 'rearm'
+    stream: str
+        response code name, or None for 'reconnect' and 'rearm'
+    ms: int or None
+        ms counter of the frame
+    last_ms: int or None
+        ms counter of the last frame of the stream
+    lost: int
+        estimated number of lost frames, for 'gap'
+    gap_sec: float or None
+        sec without the connection for 'reconnect', and without recording for 'rearm' restarting it
+
+    """
+
+    __slots__ = ('kind', 'stream', 'ms', 'last_ms', 'lost', 'gap_sec', 'time')
+
+    def __init__(self, kind, stream, ms, last_ms, lost=0, gap_sec=None):
+        self.kind = kind
+        self.stream = stream
+        self.ms = ms
+        self.last_ms = last_ms
+        self.lost = lost
+        self.gap_sec = gap_sec
+        self.time = datetime.datetime.now()
+
+    def __repr__(self):
+        return (f'ContinuityEvent(kind={self.kind!r}, stream={self.stream!r}, ms={self.ms}, '
+                f'last_ms={self.last_ms}, lost={self.lost}, gap_sec={self.gap_sec})')
+
+
+class _StreamState:
+
+    def __init__(self, step):
+        self.step = step
+        self.last_ms = None  # unwrapped
+        self.first_ms = None
+        self.first_time = None  # host time.monotonic()
+        self.last_time = None
+        self.diffs = []  # to infer the step
+        self.received = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.gaps = 0
+        self.lost = 0
+
+    def totals(self):
+        unique = self.received - self.duplicates - self.out_of_order
+        span_ms = self.last_ms - self.first_ms if self.last_ms is not None else 0
+        elapsed_sec = self.last_time - self.first_time if self.last_time is not None else 0.0
+        return {
+            'step_ms': self.step
+            , 'received': self.received
+            , 'lost': self.lost
+            , 'gaps': self.gaps
+            , 'duplicates': self.duplicates
+            , 'out_of_order': self.out_of_order
+            , 'loss_ratio': self.lost / (unique + self.lost) if unique + self.lost > 0 else 0.0
+            , 'nominal_hz': 1000 / self.step if self.step else None
+            , 'delivered_hz': (unique - 1) * 1000 / span_ms if span_ms > 0 else None  # by the device clock
+            , 'received_hz': (self.received - 1) / elapsed_sec if elapsed_sec > 0 else None  # by the host clock
+        }
+
+
+class ContinuityTracker:
+    """Per-stream continuity tracker fed with every frame, see the module docstring.
+
+    A recording session starts on the start notification (0x88), which resets
+    the last counters since the counters restart. Streams without an expected
+    step infer it as the smallest positive step of their first samples, and
+    gaps are detected after that.
+
+    Parameters
+    ----------
+    expected_steps: dict or None
+        {response code name: ms step}, e.g., by expected_steps_of
+    gap_tolerance: float
+        a step over expected step * (1 + gap_tolerance) is a gap
+    max_events: int
+        max number of events kept, i.e., older ones are forgotten
+    on_event: callable or None
+        called with each ContinuityEvent in the reader thread
+
+    """
+
+    def __init__(self, expected_steps=None, gap_tolerance=0.5, max_events=10000, on_event=None):
+        self.expected_steps = dict(expected_steps or {})
+        self.gap_tolerance = gap_tolerance
+        self.on_event = on_event
+        self.events = deque(maxlen=max_events)
+        self.sessions = []  # totals of finished sessions
+        self._lock = Lock()
+        self._start_code = TSND151._RESPONSE_CODE_MAP_['start_recording']
+        self._new_session()
+
+    def _new_session(self):
+        self._streams = {}  # response code name -> _StreamState
+        self._session_started_at = datetime.datetime.now()
+        self._reconnects = 0
+        self._gap_sec = 0.0
+        self._rearmed_after_sec = None  # gap before the session, if it is restarted by TSND151.rearm
+
+    def observe(self, cmd, args):
+        """Observe a received frame, e.g., from TSND151._dispatch_frames."""
+        if cmd == self._start_code:
+            with self._lock:
+                if len(self._streams) > 0:
+                    self.sessions.append(self._session_totals())
+                self._new_session()
+            return
+
+        name = _SAMPLE_CODES_.get(cmd)
+        if name is None:
+            return
+        ms = int.from_bytes(args[0:4], 'little')
+        with self._lock:
+            event = self._observe_ms(name, ms)
+        if event is not None:
+            self._append(event)
+
+    def _observe_ms(self, name, ms):
+        st = self._streams.get(name)
+        if st is None:
+            st = self._streams[name] = _StreamState(self.expected_steps.get(name))
+        now = time.monotonic()
+        st.received += 1
+        st.last_time = now
+        if st.last_ms is None:
+            st.first_ms = st.last_ms = ms
+            st.first_time = now
+            return None
+
+        diff = (ms - st.last_ms + _HALF_WRAP_) % _WRAP_ - _HALF_WRAP_
+        last_ms = st.last_ms % _WRAP_
+        if diff == 0:
+            st.duplicates += 1
+            return ContinuityEvent('duplicate', name, ms, last_ms)
+        if diff < 0:
+            st.out_of_order += 1
+            return ContinuityEvent('out_of_order', name, ms, last_ms)
+
+        st.last_ms += diff
+        if st.step is None:
+            st.diffs.append(diff)
+            if len(st.diffs) >= _INFER_STEP_SAMPLES_:
+                st.step = min(st.diffs)
+                st.diffs = None
+            return None
+        if diff > st.step * (1 + self.gap_tolerance):
+            lost = _lost_frames(diff, st.step)
+            st.gaps += 1
+            st.lost += lost
+            return ContinuityEvent('gap', name, ms, last_ms, lost)
+        return None
+
+    def mark_reconnect(self, gap_sec=None):
+        """Record a reconnection, e.g., by the auto recovery. Frames lost by it show up as a gap.
+
+        Parameters
+        ----------
+        gap_sec: float or None
+            sec from the lost connection to its reopening
+
+        """
+        event = ContinuityEvent('reconnect', None, None, None, gap_sec=gap_sec)
+        with self._lock:
+            self._reconnects += 1
+            if gap_sec is not None:
+                self._gap_sec += gap_sec
+        self._append(event)
+
+    def mark_rearm(self, gap_sec=None, restarted=False):
+        """Record a re-arm by TSND151.rearm.
+
+        If recording is restarted, the counters restart in a new session, and
+        gap_sec is the time without recording before it (kept as 'rearmed_after_sec' of the session).
+        """
+        event = ContinuityEvent('rearm', None, None, None, gap_sec=gap_sec)
+        if restarted:
+            with self._lock:
+                self._rearmed_after_sec = gap_sec
+        self._append(event)
+
+    def _append(self, event):
+        self.events.append(event)
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def _session_totals(self):
+        return {
+            'started_at': self._session_started_at.isoformat()
+            , 'reconnects': self._reconnects
+            , 'gap_sec': self._gap_sec
+            , 'rearmed_after_sec': self._rearmed_after_sec
+            , 'streams': {name: st.totals() for name, st in self._streams.items()}
+        }
+
+    def totals(self):
+        """Totals of the current session, as {'started_at', 'reconnects', 'gap_sec', 'rearmed_after_sec',
+        'streams': {name: totals}}."""
+        with self._lock:
+            return self._session_totals()
+
+    def report(self, tsnd151=None):
+        """Totals of the current session and the link errors of tsnd151, if given.
+
+        Returns
+        -------
+        dict
+            totals of the current session (see totals), the finished sessions as 'sessions',
+            and 'link': {frames, bcc_errors, invalid_codes, skipped_bytes, recoveries} if tsnd151 is given
+
+        """
+        res = self.totals()
+        res['sessions'] = list(self.sessions)
+        if tsnd151 is not None:
+            stats = tsnd151.stats()
+            res['link'] = {
+                'frames': sum(stats['frames'].values())
+                , 'bcc_errors': stats['bcc_errors']
+                , 'invalid_codes': stats['invalid_codes']
+                , 'skipped_bytes': stats['skipped_bytes']
+                , 'recoveries': stats['recoveries']
+            }
+        return res
+
+
+def continuity_flags(ms, step, last_ms=None, gap_tolerance=0.5):
+    """Flags of records by their ms counters, vectorized.
+
+    Each counter is compared with the largest counter before it (unwrapped at 2^32),
+    like ContinuityTracker.
+
+    Parameters
+    ----------
+    ms: numpy.ndarray
+        ms counters of one stream in received order
+    step: int, float
+        expected ms step
+    last_ms: int or None
+        ms counter of the record before ms[0], e.g., of the previous chunk
+    gap_tolerance: float
+
+    Returns
+    -------
+    tuple
+        (flags as uint8 array of GAP, DUPLICATE, OUT_OF_ORDER, lost frames before each record as int64 array)
+
+    """
+    ms = np.asarray(ms, dtype=np.int64).reshape(-1)
+    flags = np.zeros(len(ms), dtype=np.uint8)
+    lost = np.zeros(len(ms), dtype=np.int64)
+    if len(ms) == 0:
+        return flags, lost
+
+    first = ms[0] if last_ms is None else int(last_ms)
+    unwrapped = first + np.cumsum((np.diff(ms, prepend=first) + _HALF_WRAP_) % _WRAP_ - _HALF_WRAP_)
+    previous_max = np.maximum.accumulate(np.concatenate([[first], unwrapped[:-1]]))
+    diff = unwrapped - previous_max
+    if last_ms is None:
+        diff[0] = step  # nothing to compare
+
+    flags[diff == 0] |= DUPLICATE
+    flags[diff < 0] |= OUT_OF_ORDER
+    gap = diff > step * (1 + gap_tolerance)
+    flags[gap] |= GAP
+    lost[gap] = np.maximum(0, np.rint(diff[gap] / step).astype(np.int64) - 1)
+    return flags, lost
+
+
+def annotate(records, step, last_ms=None, gap_tolerance=0.5):
+    """Copy of decoded records with 'flags' and 'lost' fields, see continuity_flags."""
+    flags, lost = continuity_flags(records['ms'], step, last_ms, gap_tolerance)
+    out = np.empty(len(records), dtype=records.dtype.descr + [('flags', np.uint8), ('lost', np.int64)])
+    for name in records.dtype.names:
+        out[name] = records[name]
+    out['flags'] = flags
+    out['lost'] = lost
+    return out
@@ -0,0 +1,213 @@
+"""Streaming download of saved entries into recording files.
+
+TSND151.get_saved_entry leaves every record of an entry in the response
+queues until the end marker (0xB9) arrives. download_saved_entry instead
+writes the records into chunked recording files (see tsnd.recording) as
+they arrive, one file per response code, so memory use does not depend on
+the size of the entry.
+
+Example
+-------
+>>> def show(progress):
+...     print(f'{progress.records} records, {progress.records_per_sec:.0f} records/s, ETA {progress.eta_sec} s')
+>>> summary = download_saved_entry(tsnd151, 1, 'entry1', progress=show)
+>>> summary['records']  # e.g., {'acc_gyro_data': 360000}
+>>> RecordingReader(summary['paths']['acc_gyro_data']).read_all()
+
+NumPy is required for this module.
+"""
+import os
+import time
+from concurrent import futures
+from tsnd.tsnd151 import TSND151
+from tsnd.recording import RecordingWriter
+from tsnd.batch_decoder import SAMPLE_LAYOUTS
+
+
+class DownloadProgress:
+    """Progress of a download, passed to the progress callback.
+
+    Parameters
+    ----------
+    entry_num: int
+    records: int
+        number of records received
+    bytes_: int
+        number of bytes received (frames)
+    elapsed_sec: float
+    expected_records: int or None
+        number of records of the entry in its information, if known
+
+    """
+
+    def __init__(self, entry_num, records, bytes_, elapsed_sec, expected_records=None):
+        self.entry_num = entry_num
+        self.records = records
+        self.bytes = bytes_
+        self.elapsed_sec = elapsed_sec
+        self.expected_records = expected_records
+
+    @property
+    def records_per_sec(self):
+        return self.records / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+    @property
+    def ratio(self):
+        """Received ratio in [0, 1], or None if the expected number of records is unknown."""
+        if not self.expected_records:
+            return None
+        return min(1.0, self.records / self.expected_records)
+
+    @property
+    def eta_sec(self):
+        """Estimated sec to the end, or None if unknown."""
+        if not self.expected_records or self.records_per_sec == 0:
+            return None
+        return max(0, self.expected_records - self.records) / self.records_per_sec
+
+    def __repr__(self):
+        return (f'DownloadProgress(entry_num={self.entry_num}, records={self.records}, bytes={self.bytes}, '
+                f'elapsed_sec={self.elapsed_sec:.2f}, expected_records={self.expected_records})')
+
+
+def output_paths(path_prefix):
+    """Paths download_saved_entry may write, as {response code name: path}."""
+    return {name: f'{path_prefix}_{name}.tsndrec'
+            for name, code in TSND151._RESPONSE_CODE_MAP_.items() if code in SAMPLE_LAYOUTS}
+
+
+class _WriterSink:
+    """Response queue which writes payloads into a RecordingWriter.
+
+    The writer is opened before the download, so the reader thread only copies
+    payloads. The file is removed on close if no record is received.
+    """
+
+    def __init__(self, path, code, settings, chunk_size):
+        self.path = path
+        self.writer = RecordingWriter(path, code, settings=settings, chunk_size=chunk_size)
+        self.count = 0
+
+    def put(self, args, block=True, timeout=None):
+        self.writer.put(args)
+        self.count += 1
+
+    def close(self):
+        self.writer.close()
+        if self.count == 0:
+            os.remove(self.path)
+
+
+def download_saved_entry(tsnd151, entry_num, path_prefix, progress=None, progress_interval_sec=0.5,
+                         idle_timeout_sec=10, chunk_size=4096):
+    """Download a saved entry into recording files as records arrive.
+
+    Records of each response code are written into
+    '{path_prefix}_{response code name}.tsndrec', e.g., 'entry1_acc_gyro_data.tsndrec'.
+    Only the files of the codes received are kept. The response queues of the
+    codes are restored after the download.
+
+    Parameters
+    ----------
+    tsnd151: TSND151
+    entry_num: int
+       target entry number
+       1 <= entry_num <= 80
+    path_prefix: str
+        prefix of the output paths
+    progress: callable or None
+        called with a DownloadProgress every progress_interval_sec and at the end
+    progress_interval_sec: float
+    idle_timeout_sec: int, float
+        max sec without any record, i.e., the download may take longer in total
+    chunk_size: int
+        number of rows in a chunk of the recording files
+
+    Returns
+    -------
+    dict
+        entry_num: int
+        records: {response code name: number of records}
+        bytes: number of bytes received
+        elapsed_sec: float
+        expected_records: int, from the entry information
+        paths: {response code name: path of the recording file}
+        or None if the entry does not exist
+
+    Raises
+    ------
+    TimeoutError
+        If no record arrives in idle_timeout_sec. Records received are kept in the files.
+
+    """
+    info = tsnd151.get_saved_entry_info(entry_num)
+    if info is None:
+        return None
+    entry = TSND151.parse_saved_entry_info(info)
+    start_time = entry['start_time']
+
+    settings = {
+        'start_time': start_time.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()  # ms is of the day
+        , 'entry_start_time': start_time.isoformat()
+        , 'entry_num': entry_num
+        , 'entry_info': info.hex()
+        , 'port': tsnd151.port
+    }
+    names = {TSND151._RESPONSE_CODE_MAP_[name]: name for name in output_paths(path_prefix)}
+    sinks = {}
+    frame_lens = {name: SAMPLE_LAYOUTS[code][0] + 3 for code, name in names.items()}
+
+    def _progress(elapsed_sec):
+        records = sum(sink.count for sink in sinks.values())
+        bytes_ = sum(sink.count * frame_lens[name] for name, sink in sinks.items())
+        return DownloadProgress(entry_num, records, bytes_, elapsed_sec, entry['record_num'])
+
+    previous_queues = {name: tsnd151.get_response_queue(name) for name in names.values()}
+    start = time.monotonic()
+    try:
+        for name, path in output_paths(path_prefix).items():
+            sinks[name] = _WriterSink(path, TSND151._RESPONSE_CODE_MAP_[name], settings, chunk_size)
+        for name, sink in sinks.items():
+            tsnd151.set_response_queue(name, sink)
+
+        fut = tsnd151.send_request('get_saved_entry', [entry_num], 'saved_entry_end')
+        last_records, last_change = 0, start
+        while True:
+            try:
+                fut.result(progress_interval_sec)
+                break
+            except futures.TimeoutError:
+                pass
+
+            now = time.monotonic()
+            state = _progress(now - start)
+            if state.records != last_records:
+                last_records, last_change = state.records, now
+            elif now - last_change > idle_timeout_sec:
+                fut.cancel()
+                raise TimeoutError(f'No record of saved entry {entry_num} in {idle_timeout_sec} sec')
+
+            if progress is not None:
+                progress(state)
+    finally:
+        for name, q in previous_queues.items():
+            tsnd151.set_response_queue(name, q)
+        for sink in sinks.values():
+            sink.close()
+
+    state = _progress(time.monotonic() - start)
+    if progress is not None:
+        progress(state)
+
+    return {
+        'entry_num': entry_num
+        , 'records': {name: sink.count for name, sink in sinks.items() if sink.count > 0}
+        , 'bytes': state.bytes
+        , 'elapsed_sec': state.elapsed_sec
+        , 'expected_records': entry['record_num']
+        , 'paths': {name: sink.path for name, sink in sinks.items() if sink.count > 0}
+    }
@@ -0,0 +1,520 @@
+"""TSND151 emulator on a pseudo-terminal (Linux/macOS).
+
+The emulator opens a pty and speaks the command protocol modeled in
+TSND151._CMD_CODE_MAP_ and TSND151._RESPONSE_ARG_LEN_MAP_, so TSND151.open can
+be used with emulator.port without the device, e.g., for load tests of many
+TSND151 instances on one machine.
+
+Latency, frame corruption, frame drop and disconnects can be injected.
+
+Example
+-------
+>>> with TSND151Emulator() as emu:
+...     with TSND151.open(emu.port, wait_sec_on_open_for_stability=0) as tsnd151:
+...         tsnd151.set_acc_and_gyro_interval(1, 1, 0)  # 1 kHz
+...         tsnd151.start_recording()
+
+It also runs as a module to serve emulators until Ctrl-C::
+
+    python -m tsnd.emulator --num 4
+"""
+import datetime
+import math
+import os
+import random
+import select
+import time
+import tty
+from collections import deque
+from logging import getLogger
+from threading import Thread, Event, Lock
+from tsnd.tsnd151 import TSND151
+
+# command code -> argument length
+_CMD_ARG_LEN_MAP_ = {
+    0x10: 1
+    , 0x11: 8
+    , 0x12: 1
+    , 0x13: 14
+    , 0x14: 1
+    , 0x15: 1
+    , 0x16: 3
+    , 0x18: 3
+    , 0x1A: 3
+    , 0x1C: 2
+    , 0x23: 1
+    , 0x25: 1
+    , 0x2C: 1
+    , 0x2D: 1
+    , 0x2E: 1
+    , 0x2F: 1
+    , 0x35: 1
+    , 0x36: 1
+    , 0x37: 1
+    , 0x39: 1
+    , 0x3C: 1
+    , 0x50: 1
+    , 0x55: 3
+}
+
+_MODE_CMD_ = 2  # BLT_CMD
+_MODE_RECORDING_ = 3  # BLT_RECORDING
+
+
+def _frame(code, args):
+    return bytes(TSND151.build_cmd(code, list(args)))
+
+
+def _time_bytes(dt):
+    ms = int(dt.microsecond / 1000)
+    return [dt.year % 100, dt.month, dt.day, dt.hour, dt.minute, dt.second, ms & 0xFF, ms >> 8]
+
+
+def _i24(v):
+    return int(v).to_bytes(3, 'little', signed=True)
+
+
+class TSND151Emulator:
+    """Emulated TSND151 served on a pty.
+
+    Parameters
+    ----------
+    serial_number: str
+        serial number returned by the device information (0x10)
+    saved_entries: list or None
+        entries already saved in the device memory, as (start datetime, number of records)
+    latency_sec: float
+        delay before each response to a command. Commands are not blocked by it,
+        i.e., responses to pipelined commands overlap like on a Bluetooth link.
+    corrupt_rate: float
+        probability to corrupt (flip a byte of) each frame sent
+    drop_rate: float
+        probability to drop each streaming frame
+    tick_sec: float
+        interval to emit streaming frames in a burst
+    max_pending_bytes: int
+        output kept while the client does not read. Older bytes are dropped over it.
+    clock_drift_ppm: float
+        rate error of the device clock, e.g., 50 means the device clock gains 50 us per sec.
+        It applies to the time (0x92) and the ms counters of samples.
+
+    """
+
+    _LOGGER_ = getLogger("TSND151Emulator")
+
+    def __init__(self, serial_number='AP00000000', saved_entries=None, latency_sec=0.0,
+                 corrupt_rate=0.0, drop_rate=0.0, tick_sec=0.002, max_pending_bytes=1 << 20, clock_drift_ppm=0.0):
+        self.serial_number = serial_number
+        self.latency_sec = latency_sec
+        self.corrupt_rate = corrupt_rate
+        self.drop_rate = drop_rate
+        self.tick_sec = tick_sec
+        self.max_pending_bytes = max_pending_bytes
+        self.clock_drift_ppm = clock_drift_ppm
+
+        self.master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        os.set_blocking(self.master_fd, False)
+        self.port = os.ttyname(self._slave_fd)
+
+        self._time_offset = datetime.timedelta(0)
+        self._clock_epoch = time.monotonic()
+        self._settings = {
+            'acc_gyro': [0, 0, 0]  # interval in ms, avg for send, avg for save
+            , 'magnetism': [0, 0, 0]
+            , 'atmosphere': [0, 0, 0]
+            , 'quaternion': [0, 0, 0]  # interval in ms
+            , 'battery': [0, 0]
+            , 'acc_range': 1
+            , 'gyro_range': 3
+            , 'option_button': 0
+            , 'overwrite_protection': 0
+            , 'auto_power_off': 0
+        }
+        self._entries = [(start, num) for start, num in (saved_entries or [])]
+        self._mode = _MODE_CMD_
+        self._recording_start = None  # host monotonic time
+        self._recording_stop = None
+        self._recording_start_dt = None  # device datetime
+        self._sent_samples = {}
+        self._download = None  # generator of frames for saved entry download
+
+        self._in_buf = bytearray()
+        self._out_buf = bytearray()
+        self._delayed = deque()  # (due time, frame) of responses delayed by latency_sec
+        self._reply_due = None  # due time of responses to the command being handled
+        self._silent_until = 0.0
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+        self.frame_count = 0
+        self.command_count = 0
+        self.dropped_bytes = 0
+        self.injected_corruptions = 0
+        self.injected_drops = 0
+
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop the emulator and close the pty."""
+        self._stop.set()
+        self._thread.join(1)
+        for fd in (self.master_fd, self._slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def is_recording(self):
+        return self._mode == _MODE_RECORDING_
+
+    @property
+    def saved_entry_num(self):
+        return len(self._entries)
+
+    def inject_disconnect(self, duration_sec):
+        """Go silent (no output, commands ignored) for duration_sec, like a Bluetooth dropout."""
+        self._silent_until = time.monotonic() + duration_sec
+
+    def stop_recording_by_button(self):
+        """Emulate a stop by the option button, i.e. 0x89 without a command."""
+        with self._lock:
+            self._stop_recording()
+
+    def start_recording_by_button(self):
+        """Emulate a start by the option button, i.e. 0x88 without a command."""
+        with self._lock:
+            self._start_recording(notify_settings=False)
+
+    def device_now(self):
+        return datetime.datetime.now() + self._time_offset + datetime.timedelta(seconds=self._drift_sec())
+
+    def _drift_sec(self):
+        return (time.monotonic() - self._clock_epoch) * self.clock_drift_ppm * 1e-6
+
+    def _device_elapsed_ms(self, since):
+        """ms elapsed on the device clock since a host time.monotonic()."""
+        return (time.monotonic() - since) * 1000 * (1 + self.clock_drift_ppm * 1e-6)
+
+    @property
+    def last_recording_sec(self):
+        """Duration of the last (or current) recording in sec."""
+        if self._recording_start is None:
+            return 0.0
+        stop = time.monotonic() if self.is_recording else self._recording_stop
+        return stop - self._recording_start
+
+    def sample_due_time(self, ms):
+        """Host time.monotonic() when the streaming sample with the ms counter of the last recording was due."""
+        start = self._recording_start
+        if start is None:
+            return None
+        return start + ((ms - self._ms_of_day(0)) & 0xFFFFFFFF) / 1000 / (1 + self.clock_drift_ppm * 1e-6)
+
+    # I/O loop
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                readable, _, _ = select.select([self.master_fd], [], [], self.tick_sec)
+            except (OSError, ValueError):
+                return
+
+            if readable:
+                try:
+                    data = os.read(self.master_fd, 4096)
+                except BlockingIOError:
+                    data = b''
+                except OSError:
+                    data = b''  # no client is connected
+                    time.sleep(self.tick_sec)
+                if time.monotonic() >= self._silent_until:
+                    self._in_buf += data
+                    self._handle_commands()
+
+            with self._lock:
+                if self._mode == _MODE_RECORDING_:
+                    self._emit_samples()
+                if self._download is not None:
+                    self._emit_download()
+                self._release_delayed()
+                self._flush()
+
+    def _send(self, code, args, streaming=False):
+        if time.monotonic() < self._silent_until:
+            return
+        if streaming and self.drop_rate > 0 and random.random() < self.drop_rate:
+            self.injected_drops += 1
+            return
+
+        frame = _frame(code, args)
+        if self.corrupt_rate > 0 and random.random() < self.corrupt_rate:
+            frame = bytearray(frame)
+            frame[random.randrange(2, len(frame))] ^= 0xFF
+            self.injected_corruptions += 1
+
+        if self._reply_due is not None:
+            self._delayed.append((self._reply_due, frame))
+        else:
+            self._enqueue(frame)
+
+    def _release_delayed(self):
+        now = time.monotonic()
+        while len(self._delayed) > 0 and self._delayed[0][0] <= now:
+            self._enqueue(self._delayed.popleft()[1])
+
+    def _enqueue(self, frame):
+        self._out_buf += frame
+        self.frame_count += 1
+        if len(self._out_buf) > self.max_pending_bytes:
+            over = len(self._out_buf) - self.max_pending_bytes
+            del self._out_buf[:over]
+            self.dropped_bytes += over
+
+    def _flush(self):
+        if len(self._out_buf) == 0:
+            return
+        try:
+            n = os.write(self.master_fd, self._out_buf)
+            del self._out_buf[:n]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.dropped_bytes += len(self._out_buf)
+            self._out_buf.clear()
+
+    # command handling
+
+    def _handle_commands(self):
+        buf = self._in_buf
+        while len(buf) >= 2:
+            if buf[0] != TSND151._START_BIT_[0]:
+                pos = buf.find(TSND151._START_BIT_)
+                del buf[:len(buf) if pos < 0 else pos]
+                continue
+
+            arg_len = _CMD_ARG_LEN_MAP_.get(buf[1])
+            if arg_len is None:
+                self._LOGGER_.warning(f'Unknown command: {buf[1]:#x}')
+                del buf[:1]
+                continue
+            if len(buf) < arg_len + 3:
+                return
+
+            frame = bytes(buf[:arg_len + 3])
+            del buf[:arg_len + 3]
+            check = 0
+            for b in frame:
+                check ^= b
+            if check != 0:
+                self._LOGGER_.warning(f'Invalid BCC of command: {frame[1]:#x}')
+                continue
+
+            self.command_count += 1
+            with self._lock:
+                if self.latency_sec > 0:
+                    self._reply_due = time.monotonic() + self.latency_sec
+                try:
+                    self._handle_command(frame[1], frame[2:-1])
+                finally:
+                    self._reply_due = None
+
+    def _ok(self, ok=True):
+        self._send(0x8F, [0x00 if ok else 0x01])
+
+    def _handle_command(self, cmd, args):
+        settings = self._settings
+        if cmd == 0x3C:
+            self._send(0xBC, [self._mode])
+            return
+        if cmd == 0x15:
+            if self._mode == _MODE_RECORDING_:
+                self._ok()
+                self._stop_recording()
+            else:
+                self._ok(False)
+            return
+        if cmd == 0x12:
+            self._send(0x92, _time_bytes(self.device_now()))
+            return
+        if self._mode == _MODE_RECORDING_ or self._download is not None:
+            self._ok(False)  # command mode only
+            return
+
+        if cmd == 0x10:
+            sn = self.serial_number.encode('ascii')[:10].ljust(10, b'\x00')
+            self._send(0x90, list(sn) + [0] * 20)
+        elif cmd == 0x11:
+            dt = datetime.datetime(2000 + args[0], args[1], args[2], args[3], args[4], args[5],
+                                   1000 * int.from_bytes(args[6:8], 'little'))
+            self._time_offset = dt - datetime.datetime.now() - datetime.timedelta(seconds=self._drift_sec())
+            self._ok()
+        elif cmd == 0x13:
+            self._start_recording()
+        elif cmd == 0x14:
+            self._send(0x93, self._recording_time_settings())
+        elif cmd in (0x16, 0x18, 0x1A, 0x55):
+            key = {0x16: 'acc_gyro', 0x18: 'magnetism', 0x1A: 'atmosphere', 0x55: 'quaternion'}[cmd]
+            settings[key] = list(args)
+            self._ok()
+        elif cmd == 0x1C:
+            settings['battery'] = list(args)
+            self._ok()
+        elif cmd == 0x23:
+            settings['acc_range'] = args[0]
+            self._send(0xA3, [args[0]])
+        elif cmd == 0x25:
+            settings['gyro_range'] = args[0]
+            self._ok()
+        elif cmd == 0x2C:
+            settings['option_button'] = args[0]
+            self._ok()
+        elif cmd == 0x2D:
+            self._send(0xAD, [settings['option_button']])
+        elif cmd == 0x2E:
+            settings['overwrite_protection'] = args[0]
+            self._ok()
+        elif cmd == 0x2F:
+            self._send(0xAF, [settings['overwrite_protection']])
+        elif cmd == 0x35:
+            self._entries.clear()
+            self._ok()
+        elif cmd == 0x36:
+            self._send(0xB6, [len(self._entries)])
+        elif cmd == 0x37:
+            self._send(0xB7, self._saved_entry_info(args[0]))
+        elif cmd == 0x39:
+            if 1 <= args[0] <= len(self._entries):
+                self._download = self._iter_download(*self._entries[args[0] - 1])
+            else:
+                self._ok(False)
+        elif cmd == 0x50:
+            settings['auto_power_off'] = args[0]
+            self._ok()
+        else:
+            self._ok(False)
+
+    def _recording_time_settings(self):
+        start = self._recording_start_dt if self._recording_start_dt is not None else self.device_now()
+        return ([1 if self._mode == _MODE_RECORDING_ else 0] + _time_bytes(start)[0:6]
+                + [100, 1, 1, 0, 0, 0])  # run forever
+
+    def _saved_entry_info(self, entry_num):
+        if not 1 <= entry_num <= len(self._entries):
+            return [0] * 24
+        start, num = self._entries[entry_num - 1]
+        acc_gyro = self._settings['acc_gyro']
+        return (_time_bytes(start) + [acc_gyro[0], acc_gyro[2], self._settings['acc_range'],
+                                      self._settings['gyro_range']]
+                + [0] * 8 + list(num.to_bytes(4, 'little')))
+
+    def _start_recording(self, notify_settings=True):
+        self._mode = _MODE_RECORDING_
+        self._recording_start = time.monotonic()
+        self._recording_start_dt = self.device_now()
+        self._sent_samples = {0x80: 0, 0x8A: 0}
+        if notify_settings:
+            self._send(0x93, self._recording_time_settings())
+        self._send(0x88, [0x00])
+
+    def _stop_recording(self):
+        if self._mode != _MODE_RECORDING_:
+            return
+        self._emit_samples()
+        acc_gyro = self._settings['acc_gyro']
+        if acc_gyro[0] > 0 and acc_gyro[2] > 0:
+            elapsed_ms = self._device_elapsed_ms(self._recording_start)
+            self._entries.append((self._recording_start_dt, int(elapsed_ms / (acc_gyro[0] * acc_gyro[2]))))
+            del self._entries[:-80]
+        self._mode = _MODE_CMD_
+        self._recording_stop = time.monotonic()
+        self._send(0x89, [0x00])
+
+    # streaming
+
+    def _stream_periods(self):
+        """(code, period in ms) of the enabled streams."""
+        quat = self._settings['quaternion']
+        acc_gyro = self._settings['acc_gyro']
+        if quat[0] > 0 and quat[1] > 0:
+            return [(0x8A, quat[0] * quat[1])]
+        if acc_gyro[0] > 0 and acc_gyro[1] > 0:
+            return [(0x80, acc_gyro[0] * acc_gyro[1])]
+        return []
+
+    def _ms_of_day(self, offset_ms):
+        start = self._recording_start_dt
+        day_ms = ((start.hour * 60 + start.minute) * 60 + start.second) * 1000 + start.microsecond // 1000
+        return int(day_ms + offset_ms) & 0xFFFFFFFF
+
+    @staticmethod
+    def _sample_args(code, ms, i):
+        phase = i / 100.0
+        acc = [_i24(1000 * math.sin(phase)), _i24(1000 * math.cos(phase)), _i24(10000)]
+        gyro = [_i24(500 * math.sin(phase * 2)), _i24(0), _i24(-500 * math.sin(phase * 2))]
+        head = list(ms.to_bytes(4, 'little'))
+        if code == 0x8A:
+            quat = [int(10000 * math.cos(phase / 2)), int(10000 * math.sin(phase / 2)), 0, 0]
+            head += b''.join(q.to_bytes(2, 'little', signed=True) for q in quat)
+        return head + list(b''.join(acc) + b''.join(gyro))
+
+    def _emit_samples(self):
+        elapsed_ms = self._device_elapsed_ms(self._recording_start)
+        for code, period in self._stream_periods():
+            due = int(elapsed_ms / period) + 1  # sample i is due at i * period
+            sent = self._sent_samples.get(code, 0)
+            for i in range(sent, due):
+                self._send(code, self._sample_args(code, self._ms_of_day(i * period), i), streaming=True)
+            self._sent_samples[code] = max(sent, due)
+
+    def _iter_download(self, start, num):
+        self._recording_start_dt = start
+        period = max(1, self._settings['acc_gyro'][0] * max(1, self._settings['acc_gyro'][2]))
+        for i in range(num):
+            yield 0x80, self._sample_args(0x80, self._ms_of_day(i * period), i)
+        yield 0xB9, [0x00]
+
+    def _emit_download(self, burst=512):
+        for _ in range(burst):
+            code, args = next(self._download)
+            self._send(code, args)
+            if code == 0xB9:
+                self._download = None
+                return
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve TSND151 emulators on ptys until Ctrl-C.')
+    parser.add_argument('--num', type=int, default=1, help='number of emulators')
+    parser.add_argument('--latency', type=float, default=0.0, help='response latency in sec')
+    parser.add_argument('--corrupt-rate', type=float, default=0.0, help='probability to corrupt a frame')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='probability to drop a streaming frame')
+    opts = parser.parse_args()
+
+    emulators = [TSND151Emulator(serial_number=f'AP{i:08d}', latency_sec=opts.latency,
+                                 corrupt_rate=opts.corrupt_rate, drop_rate=opts.drop_rate)
+                 for i in range(opts.num)]
+    try:
+        for emu in emulators:
+            print(emu.port, flush=True)
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for emu in emulators:
+            emu.close()
@@ -0,0 +1,161 @@
+from logging import getLogger
+
+
+class FrameDecoder:
+    """Incremental decoder which splits TSND151 frames out of a raw byte stream.
+
+    Bytes read from the serial port are appended to one reusable buffer, and
+    every complete frame (start bit, command code, arguments, BCC) found in it
+    is returned at once. An incomplete frame at the tail is kept until the next
+    chunk arrives.
+
+    Parameters
+    ----------
+    arg_len_map: dict
+        response code (bytes of length 1) -> argument length,
+        e.g., TSND151._RESPONSE_ARG_LEN_MAP_
+    start_bit: bytes
+        start bit of a frame
+    buffer_size: int
+        initial size of the internal buffer. It grows if a larger chunk is fed.
+
+    """
+
+    _LOGGER_ = getLogger("TSND151")
+
+    def __init__(self, arg_len_map, start_bit=b'\x9A', buffer_size=4096):
+        self._start_bit = start_bit
+        self._start_int = start_bit[0]
+        self._arg_len = [None] * 256
+        self._xor_steps = [None] * 256
+        self._codes = [bytes((i,)) for i in range(256)]
+        for code, arg_len in arg_len_map.items():
+            self._arg_len[code[0]] = arg_len
+            self._xor_steps[code[0]] = self._build_xor_steps(arg_len + 3)
+
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._head = 0  # first byte not decoded yet
+        self._tail = 0  # end of valid data
+
+        self.byte_count = 0
+        self.frame_count = 0
+        self.resync_count = 0
+        self.bcc_error_count = 0
+        self.invalid_code_count = 0
+        self.skipped_byte_count = 0
+
+    @property
+    def pending_bytes(self):
+        """Number of bytes kept for an incomplete frame."""
+        return self._tail - self._head
+
+    def reset(self):
+        """Drop buffered bytes, e.g., after the connection is reopened."""
+        self._head = 0
+        self._tail = 0
+
+    def _append(self, data):
+        n = len(data)
+        if self._tail + n > len(self._buf):
+            pending = self._tail - self._head
+            if pending + n > len(self._buf):
+                # grow
+                new_buf = bytearray(max(len(self._buf) * 2, pending + n))
+                new_buf[0:pending] = self._view[self._head:self._tail]
+                self._view.release()
+                self._buf = new_buf
+                self._view = memoryview(self._buf)
+            else:
+                # compact, copied through bytes since the areas may overlap
+                self._buf[0:pending] = bytes(self._view[self._head:self._tail])
+            self._head = 0
+            self._tail = pending
+
+        self._buf[self._tail:self._tail + n] = data
+        self._tail += n
+
+    @staticmethod
+    def _build_xor_steps(frame_len):
+        """(shift, mask) to fold a frame_len bytes int into its XOR of all bytes."""
+        steps = []
+        n = frame_len
+        while n > 1:
+            half = (n + 1) // 2
+            steps.append((half * 8, (1 << (half * 8)) - 1))
+            n = half
+        return steps
+
+    @staticmethod
+    def _xor(view, steps):
+        """XOR of all bytes in view, folded on a big int instead of a loop per byte."""
+        x = int.from_bytes(view, 'little')
+        for shift, mask in steps:
+            x = (x >> shift) ^ (x & mask)
+        return x
+
+    def feed(self, data):
+        """Append data and split all complete frames out of the buffer.
+
+        Parameters
+        ----------
+        data: bytes, bytearray, memoryview
+            raw bytes read from the serial port
+
+        Returns
+        -------
+        list
+            list of (cmd, args) as (bytes, bytes), in received order
+
+        """
+        if len(data) > 0:
+            self._append(data)
+            self.byte_count += len(data)
+
+        frames = []
+        buf = self._buf
+        view = self._view
+        head = self._head
+        tail = self._tail
+        start_int = self._start_int
+
+        while tail - head >= 2:
+            if buf[head] != start_int:
+                self.resync_count += 1
+                pos = buf.find(self._start_bit, head, tail)
+                if pos < 0:
+                    self.skipped_byte_count += tail - head
+                    head = tail
+                    break
+                self.skipped_byte_count += pos - head
+                head = pos
+                continue
+
+            code = buf[head + 1]
+            arg_len = self._arg_len[code]
+            if arg_len is None:
+                self.invalid_code_count += 1
+                self._LOGGER_.warning(f"Invalid cmd_code is received: {self._codes[code]}")
+                head += 1  # resync from the next start bit
+                continue
+
+            frame_end = head + arg_len + 3
+            if frame_end > tail:
+                break  # wait for the rest of the frame
+
+            if self._xor(view[head:frame_end], self._xor_steps[code]) != 0:
+                self.bcc_error_count += 1
+                self._LOGGER_.warning(f"Invalid Verification Bit: cmd_code={self._codes[code]}")
+                head += 1
+                continue
+
+            frames.append((self._codes[code], bytes(view[head + 2:frame_end - 1])))
+            head = frame_end
+
+        self._head = head
+        self._tail = tail
+        if head == tail:
+            self.reset()
+
+        self.frame_count += len(frames)
+        return frames
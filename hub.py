@@ -0,0 +1,205 @@
+"""Single-thread reader for many TSND151 connections.
+
+Each TSND151 normally polls its serial port in its own reader thread.
+TSND151Hub instead waits on the file descriptors of all its devices with
+selectors (epoll/kqueue) in one thread, decodes the frames and dispatches
+them to the response queues of each device. The command API of each TSND151
+works unchanged.
+
+Example
+-------
+>>> with TSND151Hub() as hub:
+...     sensors = [hub.open(path, wait_sec_on_open_for_stability=0) for path in paths]
+...     for tsnd151 in sensors:
+...         tsnd151.start_recording()
+
+The serial ports have to provide fileno(), i.e. POSIX serial ports.
+"""
+import selectors
+import time
+from logging import getLogger
+from queue import Queue, Empty
+from threading import RLock, Thread
+import serial
+from tsnd.tsnd151 import TSND151
+from tsnd.utils.thread_utils import ReusableLoopThread
+
+
+class TSND151Hub:
+    """Owner of many TSND151 connections read by one selector thread.
+
+    Parameters
+    ----------
+    select_timeout: float
+        max sec to wait in select, i.e. the interval to check timeouts and recoveries
+    recovery_interval: float
+        min interval in sec to retry the recovery of a lost connection.
+        The interval of a device doubles per failure up to TSND151._RECONNECT_MAX_SEC_.
+
+    """
+
+    _LOGGER_ = getLogger("TSND151")
+
+    def __init__(self, select_timeout=0.1, recovery_interval=0.5):
+        self.select_timeout = select_timeout
+        self.recovery_interval = recovery_interval
+        self._selector = selectors.DefaultSelector()
+        self._devices = []
+        self._last_read_time = {}
+        self._recovering = {}  # device -> next retry time, or None while a recovery thread reopens it
+        self._pending = Queue()  # (op, device) applied in the hub thread
+        self._lock = RLock()
+        self._thread = ReusableLoopThread(self._in_loop_select)
+        self._started = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    @property
+    def devices(self):
+        with self._lock:
+            return list(self._devices)
+
+    def open(self, path_to_serial_port, **kwargs):
+        """Open a TSND151 with TSND151.open and add it to the hub."""
+        tsnd151 = TSND151.open(path_to_serial_port, start_reader_thread=False, **kwargs)
+        self.add(tsnd151)
+        return tsnd151
+
+    def add(self, tsnd151):
+        """Add a TSND151 opened with start_reader_thread=False."""
+        if tsnd151.reader_thread_started:
+            raise ValueError("The reader thread of the TSND151 is running")
+
+        with self._lock:
+            self._devices.append(tsnd151)
+            self._last_read_time[tsnd151] = time.monotonic()
+            self._pending.put(('add', tsnd151))
+            if not self._started:
+                self._thread.start()
+                self._started = True
+
+    def remove(self, tsnd151, close=True):
+        with self._lock:
+            if tsnd151 in self._devices:
+                self._devices.remove(tsnd151)
+                self._pending.put(('remove', tsnd151))
+        if close:
+            tsnd151.close(tsnd151.wait_sec_on_auto_close_for_stability)
+
+    def close(self):
+        """Close all devices and stop the hub thread."""
+        for tsnd151 in self.devices:
+            self.remove(tsnd151, close=True)
+
+        if self._started:
+            self._thread.stop()
+            self._started = False
+        self._selector.close()
+
+    def _register(self, tsnd151):
+        try:
+            fd = tsnd151.serial.fileno()
+            key = self._selector.get_map().get(fd)
+            if key is not None and key.data is not tsnd151:  # the fd of a device closed directly is reused
+                self._drop_closed(key.data)
+            self._selector.register(fd, selectors.EVENT_READ, tsnd151)
+        except (KeyError, ValueError, AttributeError, OSError) as e:
+            self._LOGGER_.warning(f'Serial can not be registered to the hub. cause: {e}')
+            self._recovering[tsnd151] = time.monotonic() + self.recovery_interval
+
+    def _unregister(self, tsnd151):
+        for key in list(self._selector.get_map().values()):
+            if key.data is tsnd151:
+                self._selector.unregister(key.fileobj)
+
+    def _forget(self, tsnd151):
+        self._unregister(tsnd151)
+        self._recovering.pop(tsnd151, None)
+        self._last_read_time.pop(tsnd151, None)
+
+    def _drop_closed(self, tsnd151):
+        """Forget a device closed directly by TSND151.close, whose fd may be reused."""
+        self._forget(tsnd151)
+        with self._lock:
+            if tsnd151 in self._devices:
+                self._devices.remove(tsnd151)
+
+    def _apply_pending(self):
+        while True:
+            try:
+                op, tsnd151 = self._pending.get_nowait()
+            except Empty:
+                return
+
+            if op == 'add':
+                self._register(tsnd151)
+            elif op == 'remove':
+                self._forget(tsnd151)
+            elif tsnd151 in self._last_read_time:  # the result of a recovery thread, unless removed meanwhile
+                if op == 'recovered':
+                    del self._recovering[tsnd151]
+                    self._last_read_time[tsnd151] = time.monotonic()
+                    self._register(tsnd151)
+                else:
+                    self._recovering[tsnd151] = time.monotonic() + max(self.recovery_interval,
+                                                                       tsnd151.next_reconnect_delay())
+
+    def _in_loop_select(self):
+        self._apply_pending()
+
+        if len(self._selector.get_map()) == 0:
+            time.sleep(self.select_timeout)
+        else:
+            for key, _ in self._selector.select(self.select_timeout):
+                self._read(key.data)
+
+        self._check_timeouts()
+
+    def _read(self, tsnd151):
+        try:
+            data = tsnd151.read_available()
+        except (serial.SerialException, IOError, OSError) as e:
+            self._lost(tsnd151, e)
+            return
+
+        if len(data) > 0:
+            self._last_read_time[tsnd151] = time.monotonic()
+            tsnd151.feed_bytes(data)
+
+    def _lost(self, tsnd151, error):
+        self._unregister(tsnd151)
+        if tsnd151.is_closed():
+            return
+        self._LOGGER_.warning(f'Connection is lost: {tsnd151.port}. cause: {error}')
+        self._recovering[tsnd151] = time.monotonic()
+
+    def _check_timeouts(self):
+        now = time.monotonic()
+        for tsnd151, last in list(self._last_read_time.items()):
+            if tsnd151.is_closed():  # closed directly, not by remove
+                self._drop_closed(tsnd151)
+            elif (tsnd151 not in self._recovering and tsnd151.is_recording()
+                    and now - last > tsnd151.read_timeout):
+                self._lost(tsnd151, TimeoutError())
+
+        for tsnd151, retry_at in list(self._recovering.items()):
+            if retry_at is None or now < retry_at:
+                continue
+            if not tsnd151.auto_recovery or tsnd151.is_closed():
+                del self._recovering[tsnd151]
+                continue
+
+            # reopening takes up to seconds, which would stall the reads of the other devices
+            self._recovering[tsnd151] = None
+            Thread(target=self._in_thread_recover, args=(tsnd151,), daemon=True, name='tsnd151_hub_recovery').start()
+
+    def _in_thread_recover(self, tsnd151):
+        try:
+            error = tsnd151.recover_connection(TimeoutError())
+        except Exception as e:
+            error = e
+        self._pending.put(('recovered' if error is None else 'failed', tsnd151))
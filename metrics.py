@@ -0,0 +1,286 @@
+"""Runtime metrics of TSND151 connections and a local Prometheus endpoint.
+
+TSND151.stats() returns a snapshot of the counters and gauges of a device:
+bytes read, frames per response code, frame errors, queue depths, wait and hold
+time of serial_lock, recoveries and command latency histograms. MetricsServer
+serves the stats of many devices in the Prometheus text format on localhost.
+
+Example
+-------
+>>> tsnd151.stats()['frames']  # {'acc_gyro_data': 120000, 'simple': 12, ...}
+>>> with MetricsServer({'left_wrist': left, 'right_wrist': right}, port=9151):
+...     ...  # curl http://127.0.0.1:9151/metrics
+"""
+import bisect
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from threading import RLock, Thread
+
+_LOGGER_ = getLogger("TSND151")
+
+_LATENCY_HELP_ = 'Latency from a command to its response per response code.'
+
+
+class Histogram:
+    """Histogram with fixed buckets like a Prometheus histogram.
+
+    Parameters
+    ----------
+    buckets: tuple of float or None
+        upper bounds of the buckets (def: _DEFAULT_BUCKETS_ in sec)
+
+    """
+
+    _DEFAULT_BUCKETS_ = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(sorted(buckets if buckets is not None else self._DEFAULT_BUCKETS_))
+        self._counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """{'count', 'sum', 'buckets': [(upper bound, cumulative count)], the last bound is inf}"""
+        cumulative = []
+        total = 0
+        for le, n in zip(self.buckets + (float('inf'),), self._counts):
+            total += n
+            cumulative.append((le, total))
+        return {'count': self.count, 'sum': self.sum, 'buckets': cumulative}
+
+
+class MeteredLock:
+    """Reentrant lock which measures the time threads wait to acquire it and hold it.
+
+    An uncontended acquire is not timed for the wait, so it costs little more
+    than the lock itself. A hold is timed from the outermost acquire to its release.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._depth = 0  # of the owner
+        self._acquired_at = 0.0
+        self.wait_count = 0  # contended acquires
+        self.wait_sec = 0.0
+        self.max_wait_sec = 0.0
+        self.hold_count = 0
+        self.hold_sec = 0.0
+        self.max_hold_sec = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self._enter()
+            return True
+        if not blocking:
+            return False
+
+        start = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        waited = time.perf_counter() - start
+        if acquired:  # updated while holding the lock
+            self.wait_count += 1
+            self.wait_sec += waited
+            if waited > self.max_wait_sec:
+                self.max_wait_sec = waited
+            self._enter()
+        return acquired
+
+    def _enter(self):
+        self._depth += 1
+        if self._depth == 1:
+            self._acquired_at = time.perf_counter()
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:  # updated before the release, i.e., while holding the lock
+            held = time.perf_counter() - self._acquired_at
+            self.hold_count += 1
+            self.hold_sec += held
+            if held > self.max_hold_sec:
+                self.max_hold_sec = held
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.release()
+
+    def snapshot(self):
+        return {
+            'waits': self.wait_count
+            , 'wait_sec': self.wait_sec
+            , 'max_wait_sec': self.max_wait_sec
+            , 'holds': self.hold_count
+            , 'hold_sec': self.hold_sec
+            , 'max_hold_sec': self.max_hold_sec
+        }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _le(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def prometheus_text(devices):
+    """Stats of devices in the Prometheus text format.
+
+    Parameters
+    ----------
+    devices: dict
+        {device label: TSND151}
+
+    Returns
+    -------
+    str
+
+    """
+    metrics = {}  # name -> (type, help, [(labels, value)])
+
+    def add(name, type_, help_, labels, value):
+        metrics.setdefault(name, (type_, help_, []))[2].append((labels, value))
+
+    for device, tsnd151 in devices.items():
+        st = tsnd151.stats()
+        add('tsnd151_connected', 'gauge', 'Serial port is open.', _labels(device=device), int(st['connected']))
+        add('tsnd151_bytes_read_total', 'counter', 'Bytes read from the serial port.',
+            _labels(device=device), st['bytes_read'])
+        for code, n in st['frames'].items():
+            add('tsnd151_frames_total', 'counter', 'Frames received per response code.',
+                _labels(device=device, code=code), n)
+        for key, help_ in (('bcc_errors', 'Frames dropped by a BCC mismatch.')
+                           , ('invalid_codes', 'Unknown response codes.')
+                           , ('skipped_bytes', 'Bytes skipped to find a start bit.')
+                           , ('resyncs', 'Searches of the next start bit after a broken frame.')
+                           , ('recoveries', 'Connections lost and reopened.')):
+            add(f'tsnd151_{key}_total', 'counter', help_, _labels(device=device), st[key])
+        add('tsnd151_recovery_seconds_total', 'counter', 'Time spent in recovery of lost connections.',
+            _labels(device=device), st['recovery_sec'])
+        add('tsnd151_recovering', 'gauge', 'Connection is being recovered.',
+            _labels(device=device), int(st['recovering']))
+        add('tsnd151_rearms_total', 'counter', 'Re-arms of the device after recoveries.',
+            _labels(device=device), st['rearms'])
+        if st['last_gap_sec'] is not None:
+            add('tsnd151_last_gap_seconds', 'gauge', 'Gap of the last lost connection, up to the restart if re-armed.',
+                _labels(device=device), st['last_gap_sec'])
+        for code, n in st['queue_depths'].items():
+            add('tsnd151_queue_depth', 'gauge', 'Responses waiting in a response queue.',
+                _labels(device=device, code=code), n)
+        for code, n in st['queue_overflows'].items():
+            add('tsnd151_queue_overflows_total', 'counter', 'Responses dropped by a bounded response queue.',
+                _labels(device=device, code=code), n)
+        for code, subs in st['subscriptions'].items():
+            for i, sub in enumerate(subs):
+                labels = _labels(device=device, code=code, subscription=i)
+                add('tsnd151_subscription_lag_seconds', 'gauge',
+                    'Time from the arrival of the oldest record of the last batch to the end of its callback.',
+                    labels, sub['lag_sec'])
+                add('tsnd151_subscription_backlog_batches', 'gauge', 'Batches waiting for the callback.',
+                    labels, sub['backlog_batches'])
+                add('tsnd151_subscription_dropped_records_total', 'counter',
+                    'Records dropped by a subscription behind its callback.', labels, sub['dropped_records'])
+        add('tsnd151_pending_requests', 'gauge', 'Requests waiting for their responses.',
+            _labels(device=device), st['pending_requests'])
+        add('tsnd151_serial_lock_waits_total', 'counter', 'Contended acquires of serial_lock.',
+            _labels(device=device), st['serial_lock']['waits'])
+        add('tsnd151_serial_lock_wait_seconds_total', 'counter', 'Time waited to acquire serial_lock.',
+            _labels(device=device), st['serial_lock']['wait_sec'])
+        add('tsnd151_serial_lock_hold_seconds_total', 'counter', 'Time serial_lock is held.',
+            _labels(device=device), st['serial_lock']['hold_sec'])
+        add('tsnd151_serial_lock_max_hold_seconds', 'gauge', 'Longest hold of serial_lock.',
+            _labels(device=device), st['serial_lock']['max_hold_sec'])
+        add('tsnd151_write_queue_depth', 'gauge', 'Commands waiting for the writer thread.',
+            _labels(device=device), st['write_queue'])
+        for code, hist in st['command_latency'].items():
+            for le, n in hist['buckets']:
+                add('tsnd151_command_latency_seconds_bucket', 'histogram', _LATENCY_HELP_,
+                    _labels(device=device, code=code, le=_le(le)), n)
+            add('tsnd151_command_latency_seconds_sum', 'histogram', _LATENCY_HELP_,
+                _labels(device=device, code=code), hist['sum'])
+            add('tsnd151_command_latency_seconds_count', 'histogram', _LATENCY_HELP_,
+                _labels(device=device, code=code), hist['count'])
+
+    lines = []
+    typed = set()
+    for name, (type_, help_, samples) in metrics.items():
+        family = name.rsplit('_', 1)[0] if type_ == 'histogram' else name
+        if family not in typed:
+            typed.add(family)
+            lines.append(f'# HELP {family} {help_}')
+            lines.append(f'# TYPE {family} {type_}')
+        for labels, value in samples:
+            lines.append(f'{name}{labels} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """HTTP server of the stats of devices in the Prometheus text format at /metrics.
+
+    Parameters
+    ----------
+    devices: dict
+        {device label: TSND151}, e.g., {'AP09181536': tsnd151}. It can be updated while serving.
+    host: str
+        address to bind. The default serves only this host.
+    port: int
+        port to bind, or 0 to choose a free one (see port)
+
+    """
+
+    def __init__(self, devices, host='127.0.0.1', port=9151):
+        self.devices = devices
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                try:
+                    body = prometheus_text(dict(server.devices)).encode('utf-8')
+                except Exception as e:
+                    _LOGGER_.warning(f'Metrics can not be collected. cause: {e}')
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # a scrape every few sec is not worth a log line
+
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._thread = Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
@@ -0,0 +1,228 @@
+"""Declarative table of the TSND151 responses and decoders built from it.
+
+RESPONSE_TABLE maps each response code to its name and payload fields. At
+import, the fields of a code are compiled into one struct.Struct for the whole
+payload and a decoder returning a namedtuple of the code. A 24-bit int is
+unpacked as its lower 16 bits and its upper byte ('<Hb' or '<HB') and joined,
+so a payload is decoded by one unpack call. TSND151._RESPONSE_ARG_LEN_MAP_ and
+_RESPONSE_CODE_MAP_ are made from the table, so adding a code is a table edit.
+
+Fields of which the layout is not known are kept as bytes named 'data'.
+
+Example
+-------
+>>> decode(b'\\x80', payload)  # AccGyroData(ms=123456, acc=(-12, 10003, 25), gyro=(3, -1, 0))
+>>> decode_many(b'\\x82', payloads)  # [AtmosphereData(ms=..., atmosphere=..., temperature=...), ...]
+>>> RESPONSE_LAYOUTS[b'\\x90'].size  # 30
+
+See tsnd.batch_decoder.decode_batch to decode N payloads into a NumPy array.
+"""
+import struct
+from collections import namedtuple
+
+# kind -> (format of struct, bytes per value, signed)
+_KINDS_ = {
+    'u8': ('B', 1, False)
+    , 'i8': ('b', 1, True)
+    , 'u16': ('H', 2, False)
+    , 'i16': ('h', 2, True)
+    , 'u24': ('HB', 3, False)
+    , 'i24': ('Hb', 3, True)
+    , 'u32': ('I', 4, False)
+    , 'i32': ('i', 4, True)
+    , 'bytes': (None, 1, False)  # count is the length
+}
+
+_SETTINGS_FIELDS_ = (('interval_in_ms', 'u8'), ('avg_num_for_send', 'u8'), ('avg_num_for_save', 'u8'))
+
+# code -> (name, fields as (name, kind) or (name, kind, count))
+RESPONSE_TABLE = {
+    # notifications
+    b'\x80': ('acc_gyro_data', (('ms', 'u32'), ('acc', 'i24', 3), ('gyro', 'i24', 3)))  # 0.1 mg, 0.01 dps
+    , b'\x81': ('magnetism_data', (('ms', 'u32'), ('mag', 'i24', 3)))  # 0.1 uT
+    , b'\x82': ('atmosphere_data', (('ms', 'u32'), ('atmosphere', 'u24'), ('temperature', 'i16')))  # 0.01 hPa, degree C
+    , b'\x83': ('battery_voltage_data', (('ms', 'u32'), ('voltage', 'u16'), ('remaining', 'u8')))  # 0.01 V, %
+    , b'\x84': ('notification_84', (('ms', 'u32'), ('data', 'bytes', 5)))
+    , b'\x85': ('notification_85', (('ms', 'u32'), ('data', 'bytes', 2)))
+    , b'\x86': ('notification_86', (('ms', 'u32'), ('data', 'bytes', 9)))
+    , b'\x87': ('notification_87', (('ms', 'u32'), ('data', 'bytes', 1)))
+    , b'\x88': ('start_recording', (('result', 'u8'),))
+    , b'\x89': ('stop_recording', (('result', 'u8'),))
+    , b'\x8A': ('quaternion_acc_gyro_data', (('ms', 'u32'), ('quat', 'i16', 4), ('acc', 'i24', 3), ('gyro', 'i24', 3)))
+    , b'\x8B': ('data_8b', (('ms', 'u32'), ('data', 'bytes', 18)))
+    , b'\x8C': ('data_8c', (('ms', 'u32'), ('data', 'bytes', 8)))
+    # responses to commands
+    , b'\x8F': ('simple', (('result', 'u8'),))  # 0: OK, 1: NG
+    , b'\x90': ('device_info', (('serial_number', 'bytes', 10), ('data', 'bytes', 20)))
+    , b'\x92': ('time', (('year', 'u8'), ('month', 'u8'), ('day', 'u8'), ('hour', 'u8'), ('minute', 'u8')
+                         , ('second', 'u8'), ('millisecond', 'u16')))  # year since 2000
+    , b'\x93': ('recording_time_settings', (('scheduled', 'u8'), ('start', 'u8', 6), ('stop', 'u8', 6)))
+    , b'\x97': ('acc_gyro_settings', _SETTINGS_FIELDS_)
+    , b'\x99': ('magnetism_settings', _SETTINGS_FIELDS_)
+    , b'\x9B': ('atmosphere_settings', (('interval_in_10ms_unit', 'u8'),) + _SETTINGS_FIELDS_[1:])
+    , b'\x9D': ('battery_voltage_settings', (('send', 'u8'), ('save', 'u8')))
+    , b'\x9F': ('response_9f', (('data', 'bytes', 5),))
+    , b'\xA1': ('response_a1', (('data', 'bytes', 3),))
+    , b'\xA3': ('acc_range', (('range', 'u8'),))
+    , b'\xA6': ('gyro_range', (('range', 'u8'),))
+    , b'\xAA': ('response_aa', (('data', 'bytes', 12),))
+    , b'\xAB': ('response_ab', (('data', 'bytes', 9),))
+    , b'\xAD': ('option_button_behavior', (('mode', 'u8'),))
+    , b'\xAF': ('overwrite_protection', (('protection', 'u8'),))
+    , b'\xB1': ('response_b1', (('data', 'bytes', 4),))
+    , b'\xB3': ('response_b3', (('data', 'bytes', 1),))
+    , b'\xB6': ('saved_entry_num', (('num', 'u8'),))
+    , b'\xB7': ('saved_entry_info', (('start', 'u8', 6), ('millisecond', 'u16'), ('data', 'bytes', 12)
+                                     , ('record_num', 'u32')))
+    , b'\xB8': ('response_b8', (('data', 'bytes', 60),))
+    , b'\xB9': ('saved_entry_end', (('result', 'u8'),))
+    , b'\xBA': ('response_ba', (('data', 'bytes', 5),))
+    , b'\xBB': ('response_bb', (('data', 'bytes', 3),))
+    , b'\xBC': ('mode', (('mode', 'u8'),))
+    , b'\xBD': ('response_bd', (('data', 'bytes', 12),))
+    , b'\xBE': ('response_be', (('data', 'bytes', 12),))
+    , b'\xD1': ('auto_power_off', (('minutes', 'u8'),))
+    , b'\xD3': ('response_d3', (('data', 'bytes', 1),))
+    , b'\xD6': ('quaternion_settings', (('interval_in_5ms_unit', 'u8'),) + _SETTINGS_FIELDS_[1:])
+    , b'\xD8': ('response_d8', (('data', 'bytes', 78),))
+    , b'\xDA': ('response_da', (('data', 'bytes', 7),))
+    , b'\xDC': ('response_dc', (('data', 'bytes', 28),))
+    , b'\xDD': ('response_dd', (('data', 'bytes', 1),))
+}
+
+ResponseField = namedtuple('ResponseField', ('name', 'kind', 'count', 'offset', 'size', 'signed'))
+ResponseField.__doc__ = """A field of a payload. size is bytes per value, i.e., 1 for 'bytes'."""
+
+
+class ResponseLayout:
+    """Compiled layout of a response code.
+
+    Attributes
+    ----------
+    code: bytes
+    name: str
+    size: int
+        payload length
+    fields: tuple of ResponseField
+    record_type: type
+        namedtuple of the fields, e.g., AccGyroData
+    struct: struct.Struct
+        for the whole payload
+    decode: callable
+        payload -> record_type
+
+    """
+
+    __slots__ = ('code', 'name', 'size', 'fields', 'record_type', 'struct', 'decode', '_make')
+
+    def __init__(self, code, name, fields):
+        self.code = code
+        self.name = name
+
+        compiled = []
+        fmt = '<'
+        items = []  # expressions of the values of record_type from v, the unpacked tuple
+        offset = 0
+        index = 0
+        for field in fields:
+            field_name, kind = field[0:2]
+            count = field[2] if len(field) > 2 else 1
+            struct_fmt, size, signed = _KINDS_[kind]
+            compiled.append(ResponseField(field_name, kind, count, offset, size, signed))
+            offset += size * count
+
+            if struct_fmt is None:
+                fmt += f'{count}s'
+                items.append(f'v[{index}]')
+                index += 1
+                continue
+
+            values = []
+            for i in range(count):
+                fmt += struct_fmt
+                if len(struct_fmt) == 2:  # 24-bit as lower 16 bits and upper 8 bits
+                    values.append(f'v[{index}] + (v[{index + 1}] << 16)')
+                    index += 2
+                else:
+                    values.append(f'v[{index}]')
+                    index += 1
+            items.append(values[0] if count == 1 else f"({', '.join(values)},)")
+
+        self.size = offset
+        self.fields = tuple(compiled)
+        self.struct = struct.Struct(fmt)
+        self.record_type = namedtuple(''.join(word.capitalize() for word in name.split('_')),
+                                      [f.name for f in self.fields])
+
+        # built once, like namedtuple, so decoding is one unpack and one tuple without a loop
+        namespace = {'unpack': self.struct.unpack, 'new': tuple.__new__, 'cls': self.record_type}
+        exec(f"def decode(payload):\n    v = unpack(payload)\n    return new(cls, ({', '.join(items)},))\n"
+             f"def make(v):\n    return new(cls, ({', '.join(items)},))\n", namespace)
+        self.decode = namespace['decode']
+        self._make = namespace['make']
+
+    def __repr__(self):
+        return f'ResponseLayout(code={self.code!r}, name={self.name!r}, size={self.size})'
+
+
+RESPONSE_LAYOUTS = {code: ResponseLayout(code, name, fields) for code, (name, fields) in RESPONSE_TABLE.items()}
+
+
+def _layout_of(code):
+    layout = RESPONSE_LAYOUTS.get(code)
+    if layout is None:
+        raise ValueError(f"Unsupported response code: {code}")
+    return layout
+
+
+def decode(code, payload):
+    """Decode a payload of the response code.
+
+    Parameters
+    ----------
+    code: bytes
+        response code, a key of RESPONSE_TABLE
+    payload: bytes-like
+
+    Returns
+    -------
+    namedtuple
+        RESPONSE_LAYOUTS[code].record_type. Fields with a count over 1 are tuples.
+
+    Raises
+    ------
+    ValueError
+        If the code is not supported or the payload length is invalid.
+
+    """
+    try:
+        return _layout_of(code).decode(payload)
+    except struct.error as e:
+        raise ValueError(f"Invalid payload of {code}: {e}")
+
+
+def decode_many(code, payloads):
+    """Decode N payloads of the response code by struct.iter_unpack.
+
+    Parameters
+    ----------
+    code: bytes
+    payloads: bytes-like or iterable of bytes
+        N concatenated payloads, or N payloads
+
+    Returns
+    -------
+    list of namedtuple
+
+    Raises
+    ------
+    ValueError
+        If the code is not supported or the payload length is invalid.
+
+    """
+    layout = _layout_of(code)
+    buf = payloads if isinstance(payloads, (bytes, bytearray, memoryview)) else b''.join(payloads)
+    if len(buf) % layout.size != 0:
+        raise ValueError(f"Invalid payload length: {len(buf)} is not a multiple of {layout.size}")
+    make = layout._make
+    return [make(v) for v in layout.struct.iter_unpack(buf)]
@@ -0,0 +1,336 @@
+"""Chunked, compressed columnar recording format for decoded sample records.
+
+A recording file consists of a header and a sequence of self-contained
+chunks, so a crash loses at most the chunk being written.
+
+File layout (all ints are little-endian)::
+
+    b'TSNDREC1', header length (u4), header (UTF-8 JSON)
+    repeated chunks:
+        b'CHNK', row number (u4), compressed length (u4), crc32 (u4), zlib body
+
+The JSON header holds the response code, the record dtype and user settings,
+e.g., device settings and the start time returned by start_recording.
+A chunk body stores each column (each axis of a multi-axis field) one after
+another, delta encoded, so slow changing values compress well.
+
+Example
+-------
+>>> with RecordingWriter('acc.tsndrec', b'\\x80', settings=RecordingWriter.settings_of(tsnd151)) as w:
+...     tsnd151.set_response_queue('acc_gyro_data', w)  # payloads are written on arrival
+...     ...
+>>> rec = RecordingReader('acc.tsndrec').read_all()
+
+NumPy is required for this module.
+"""
+import datetime
+import json
+import os
+import struct
+import zlib
+from queue import Queue
+from threading import Event, Lock, Thread
+from logging import getLogger
+import numpy as np
+from tsnd.batch_decoder import decode_batch, SAMPLE_LAYOUTS
+
+_FILE_MAGIC_ = b'TSNDREC1'
+_CHUNK_MAGIC_ = b'CHNK'
+_CHUNK_HEADER_ = struct.Struct('<4sIII')
+_LENGTH_ = struct.Struct('<I')
+
+
+def _columns(dtype):
+    """List of (field name, axis index or None, base dtype) in storing order."""
+    cols = []
+    for name in dtype.names:
+        sub = dtype.fields[name][0]
+        if sub.shape:
+            cols.extend((name, i, sub.base) for i in range(sub.shape[0]))
+        else:
+            cols.append((name, None, sub))
+    return cols
+
+
+def _encode_column(values):
+    """Delta encode with wraparound in the column dtype. The first value is kept as is."""
+    delta = np.empty_like(values)
+    if values.size > 0:
+        delta[0] = values[0]
+        np.subtract(values[1:], values[:-1], out=delta[1:])
+    return delta.tobytes()
+
+
+def _decode_column(buf, dtype, n):
+    delta = np.frombuffer(buf, dtype=dtype, count=n)
+    return np.cumsum(delta, dtype=dtype)
+
+
+class RecordingWriter:
+    """Writer of a chunked recording file.
+
+    Records are buffered up to chunk_size rows, then handed to a writer
+    thread, which compresses and writes them as one chunk. put() only copies
+    the payload, so the reader thread of TSND151 never waits for the disk.
+    Memory use is bounded by chunk_size as long as the disk keeps up.
+
+    It has put() like queue.Queue, so it can be set by
+    TSND151.set_response_queue to write payloads as they arrive.
+    An error of the writer thread, e.g., disk full, is raised by flush or close.
+
+    Parameters
+    ----------
+    path: str
+        path to the output file
+    code: bytes
+        response code of the records, one of tsnd.batch_decoder.SAMPLE_LAYOUTS
+    settings: dict or None
+        JSON serializable settings saved in the header,
+        e.g., RecordingWriter.settings_of(tsnd151)
+    chunk_size: int
+        number of rows in a chunk
+    compress_level: int
+        zlib compression level
+    fsync: bool
+        If True, os.fsync is called after each chunk, in the writer thread.
+
+    """
+
+    _LOGGER_ = getLogger("TSND151")
+
+    def __init__(self, path, code, settings=None, chunk_size=4096, compress_level=6, fsync=False):
+        if code not in SAMPLE_LAYOUTS:
+            raise ValueError(f"Unsupported response code: {code}")
+
+        self.path = path
+        self.code = code
+        self.chunk_size = chunk_size
+        self.compress_level = compress_level
+        self.fsync = fsync
+        self._record_len = SAMPLE_LAYOUTS[code][0]
+        self._dtype = decode_batch(code, b'').dtype
+        self._columns = _columns(self._dtype)
+        self._pending_payloads = bytearray()
+        self._pending_records = []
+        self._pending_num = 0
+        self._lock = Lock()
+        self._chunk_queue = Queue()  # (payloads, records), an Event set when reached, or None to stop
+        self._error = None
+        self.row_count = 0
+        self.chunk_count = 0
+
+        header = {
+            'code': code.hex()
+            , 'dtype': self._dtype.descr
+            , 'chunk_size': chunk_size
+            , 'created_at': datetime.datetime.now().isoformat()
+            , 'settings': settings if settings is not None else {}
+        }
+        header_bytes = json.dumps(header).encode('utf-8')
+
+        self._file = open(path, 'wb')
+        self._file.write(_FILE_MAGIC_)
+        self._file.write(_LENGTH_.pack(len(header_bytes)))
+        self._file.write(header_bytes)
+        self._file.flush()
+
+        self._writer_thread = Thread(target=self._write_loop, daemon=True, name='tsnd151_recording_writer')
+        self._writer_thread.start()
+
+    @staticmethod
+    def settings_of(tsnd151, start_time=None):
+        """Build header settings from settings applied to a TSND151.
+
+        Parameters
+        ----------
+        tsnd151: TSND151
+        start_time: datetime.datetime or None
+            start time returned by start_recording.
+            If None, tsnd151.recording_start_time is used.
+
+        """
+        if start_time is None:
+            start_time = tsnd151.recording_start_time
+
+        return {
+            'start_time': start_time.isoformat() if start_time is not None else None
+            , 'port': tsnd151.port
+            , 'applied_settings': tsnd151.applied_settings
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def put(self, args, block=True, timeout=None):
+        """Append a raw payload of the code. block and timeout are ignored."""
+        with self._lock:
+            self._pending_payloads += args
+            self._pending_num += 1
+            if self._pending_num >= self.chunk_size:
+                self._hand_over()
+
+    def write(self, records):
+        """Append decoded records, a structured array by tsnd.batch_decoder."""
+        if records.dtype != self._dtype:
+            raise ValueError(f"Invalid dtype: {records.dtype}, expected {self._dtype}")
+
+        with self._lock:
+            self._pending_records.append(records)
+            self._pending_num += len(records)
+            if self._pending_num >= self.chunk_size:
+                self._hand_over()
+
+    def _hand_over(self):
+        """Pass the buffered records to the writer thread. Call it holding _lock."""
+        if self._pending_num == 0:
+            return
+        self._chunk_queue.put((self._pending_payloads, self._pending_records))
+        self._pending_payloads = bytearray()
+        self._pending_records = []
+        self._pending_num = 0
+
+    def _write_loop(self):
+        q = self._chunk_queue
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            if isinstance(item, Event):
+                item.set()
+                continue
+            if self._error is not None:  # the rest is dropped, not to write chunks after a missing one
+                continue
+            try:
+                self._write_records(*item)
+            except Exception as e:
+                self._error = e
+                self._LOGGER_.warning(f'Recording can not be written: {self.path}. cause: {e}')
+
+    def _write_records(self, payloads, parts):
+        if len(payloads) > 0:
+            parts.append(decode_batch(self.code, bytes(payloads)))
+        records = parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+        for start in range(0, len(records), self.chunk_size):
+            self._write_chunk(records[start:start + self.chunk_size])
+
+    def _write_chunk(self, records):
+        body = b''.join(_encode_column(np.ascontiguousarray(records[name] if axis is None else records[name][:, axis]))
+                        for name, axis, base in self._columns)
+        compressed = zlib.compress(body, self.compress_level)
+
+        self._file.write(_CHUNK_HEADER_.pack(_CHUNK_MAGIC_, len(records), len(compressed), zlib.crc32(compressed)))
+        self._file.write(compressed)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+        self.row_count += len(records)
+        self.chunk_count += 1
+
+    def flush(self):
+        """Write buffered records as a (short) chunk, and wait until the writer thread has written them."""
+        reached = Event()
+        with self._lock:
+            if self._file.closed:
+                return
+            self._hand_over()
+            self._chunk_queue.put(reached)
+        reached.wait()
+        self._raise_error()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._hand_over()
+            self._chunk_queue.put(None)
+            self._writer_thread.join()
+            self._file.close()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise IOError(f"Recording can not be written: {self.path}") from self._error
+
+
+class RecordingReader:
+    """Reader of a file written by RecordingWriter.
+
+    A truncated or broken chunk at the end (e.g., by a crash) is ignored with
+    a warning, and all chunks before it are read.
+
+    Parameters
+    ----------
+    path: str
+        path to the recording file
+
+    """
+
+    _LOGGER_ = getLogger("TSND151")
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(_FILE_MAGIC_)) != _FILE_MAGIC_:
+                raise ValueError(f"Not a recording file: {path}")
+            header_len = _LENGTH_.unpack(f.read(_LENGTH_.size))[0]
+            self.header = json.loads(f.read(header_len).decode('utf-8'))
+            self._data_offset = f.tell()
+
+        self.code = bytes.fromhex(self.header['code'])
+        self.dtype = np.dtype([tuple(d) for d in self.header['dtype']])
+        self._columns = _columns(self.dtype)
+
+    @property
+    def settings(self):
+        return self.header['settings']
+
+    @property
+    def start_time(self):
+        """start time in the settings as datetime.datetime, or None"""
+        start_time = self.settings.get('start_time')
+        return datetime.datetime.fromisoformat(start_time) if start_time is not None else None
+
+    def iter_chunks(self):
+        """Yield each chunk as a structured array."""
+        with open(self.path, 'rb') as f:
+            f.seek(self._data_offset)
+            while True:
+                head = f.read(_CHUNK_HEADER_.size)
+                if len(head) == 0:
+                    return
+                if len(head) < _CHUNK_HEADER_.size:
+                    self._LOGGER_.warning(f'Truncated chunk header is ignored: {self.path}')
+                    return
+
+                magic, n, length, crc = _CHUNK_HEADER_.unpack(head)
+                compressed = f.read(length)
+                if magic != _CHUNK_MAGIC_ or len(compressed) < length or zlib.crc32(compressed) != crc:
+                    self._LOGGER_.warning(f'Broken chunk is ignored: {self.path}')
+                    return
+
+                yield self._decode_chunk(zlib.decompress(compressed), n)
+
+    def _decode_chunk(self, body, n):
+        records = np.empty(n, dtype=self.dtype)
+        offset = 0
+        for name, axis, base in self._columns:
+            size = base.itemsize * n
+            values = _decode_column(body[offset:offset + size], base, n)
+            offset += size
+            if axis is None:
+                records[name] = values
+            else:
+                records[name][:, axis] = values
+        return records
+
+    def read_all(self):
+        """Read all chunks as one structured array."""
+        chunks = list(self.iter_chunks())
+        if len(chunks) == 0:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(chunks)
@@ -0,0 +1,295 @@
+"""Compact sample record types decoding fields lazily, and a packed container.
+
+TSND151.parse_acc_gyro and the other parsers return a tuple of lists of ints,
+about a dozen objects per sample. A record of this module keeps only the raw
+payload in one slot and decodes a field when it is accessed, and
+PackedRecords keeps N payloads of one response code in one buffer with
+column views as NumPy arrays.
+
+Example
+-------
+>>> rec = as_record(b'\\x80', payload)  # AccGyroRecord
+>>> rec.ms, rec.acc  # (123456, (-12, 10003, 25))
+>>> ms, acc, gyro = rec  # same order as TSND151.parse_acc_gyro
+>>> packed = PackedRecords.for_response('acc_gyro_data')
+>>> tsnd151.set_response_queue('acc_gyro_data', packed)  # single writer, i.e., the reader thread
+>>> packed.column('ms'), packed.column('acc')[:, 2], packed[-1].gyro
+
+NumPy is required for this module.
+"""
+import struct
+import numpy as np
+from tsnd.batch_decoder import SAMPLE_LAYOUTS, _decode_int_le, decode_batch
+
+_INT32_ = struct.Struct('<i')
+_UINT32_ = struct.Struct('<I')
+
+
+class _Field:
+    """Descriptor decoding a field of the raw payload on access.
+
+    1, 2 and 4 byte values are unpacked by one precompiled struct for all axes.
+    24-bit values are read as 32-bit from the byte before them and shifted,
+    which sign-extends them.
+    """
+
+    __slots__ = ('name', 'offset', 'size', 'count', 'signed', 'decode')
+
+    def __init__(self, name, offset, size, count, signed):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.count = count
+        self.signed = signed
+
+        if size == 3:
+            unpack_from = (_INT32_ if signed else _UINT32_).unpack_from
+            offsets = tuple(offset - 1 + 3 * i for i in range(count))
+            if count == 1:
+                self.decode = lambda raw: unpack_from(raw, offsets[0])[0] >> 8
+            else:
+                self.decode = lambda raw: tuple([unpack_from(raw, o)[0] >> 8 for o in offsets])
+        else:
+            fmt = {1: 'b', 2: 'h', 4: 'i'}[size]
+            unpack_from = struct.Struct(f"<{count}{fmt if signed else fmt.upper()}").unpack_from
+            if count == 1:
+                self.decode = lambda raw: unpack_from(raw, offset)[0]
+            else:
+                self.decode = lambda raw: unpack_from(raw, offset)
+
+    def __get__(self, record, owner):
+        if record is None:
+            return self
+        return self.decode(record._raw)
+
+
+class SampleRecord:
+    """Base of the record types. A subclass sets _CODE_, and gets a property per field of the code.
+
+    Parameters
+    ----------
+    raw: bytes
+        payload of the response code
+
+    """
+
+    __slots__ = ('_raw',)
+
+    _CODE_ = None
+    _LEN_ = 0
+    _FIELDS_ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        rec_len, layout = SAMPLE_LAYOUTS[cls._CODE_]
+        cls._LEN_ = rec_len
+        cls._FIELDS_ = tuple(_Field(*field) for field in layout)
+        for field in cls._FIELDS_:
+            setattr(cls, field.name, field)
+
+    def __init__(self, raw):
+        if len(raw) != self._LEN_:
+            raise ValueError(f"Invalid payload length: {len(raw)} for {self._LEN_}")
+        self._raw = raw
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def __iter__(self):
+        raw = self._raw
+        return iter([field.decode(raw) for field in self._FIELDS_])
+
+    def astuple(self):
+        """Fields in the order of the payload, like the parsers of TSND151 (with tuples for axes)."""
+        return tuple(self)
+
+    def asdict(self):
+        raw = self._raw
+        return {field.name: field.decode(raw) for field in self._FIELDS_}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._raw == other._raw
+
+    def __hash__(self):
+        return hash(self._raw)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{k}={v}' for k, v in self.asdict().items())})"
+
+
+class AccGyroRecord(SampleRecord):
+    """acc_gyro_data: ms, acc in 0.1 mg and gyro in 0.01 dps"""
+    __slots__ = ()
+    _CODE_ = b'\x80'
+
+
+class MagnetismRecord(SampleRecord):
+    """magnetism_data: ms, mag in 0.1 uT"""
+    __slots__ = ()
+    _CODE_ = b'\x81'
+
+
+class AtmosphereRecord(SampleRecord):
+    """atmosphere_data: ms, atmosphere in 0.01 hPa and temperature in 0.01 degree C"""
+    __slots__ = ()
+    _CODE_ = b'\x82'
+
+
+class BatteryVoltageRecord(SampleRecord):
+    """battery_voltage_data: ms, voltage in 0.01 V and remaining in %"""
+    __slots__ = ()
+    _CODE_ = b'\x83'
+
+
+class QuaternionAccGyroRecord(SampleRecord):
+    """quaternion_acc_gyro_data: ms, quat in 1/10000, acc in 0.1 mg and gyro in 0.01 dps"""
+    __slots__ = ()
+    _CODE_ = b'\x8A'
+
+
+RECORD_TYPES = {cls._CODE_: cls for cls in (AccGyroRecord, MagnetismRecord, AtmosphereRecord, BatteryVoltageRecord,
+                                            QuaternionAccGyroRecord)}
+
+
+def as_record(code, raw):
+    """Record of a payload of the response code, e.g., as_record(b'\\x80', payload).
+
+    Raises
+    ------
+    ValueError
+        If the code is not a sample stream or the payload length is invalid.
+
+    """
+    if code not in RECORD_TYPES:
+        raise ValueError(f"Unsupported response code: {code}")
+    return RECORD_TYPES[code](raw)
+
+
+class PackedRecords:
+    """Payloads of one response code packed in one growing buffer.
+
+    It has put() like queue.Queue, so it can be set by TSND151.set_response_queue.
+    It supports one writer with readers in other threads: a reader sees the
+    records appended before it reads the length. A column view keeps the buffer
+    of the time it is made, i.e., records appended later are not in it.
+
+    Parameters
+    ----------
+    code: bytes
+        response code, one of RECORD_TYPES
+    capacity: int
+        number of records allocated first. The buffer doubles when it is full.
+
+    """
+
+    def __init__(self, code, capacity=1024):
+        if code not in RECORD_TYPES:
+            raise ValueError(f"Unsupported response code: {code}")
+        if capacity <= 0:
+            raise ValueError(f"Invalid capacity: {capacity}")
+
+        self.code = code
+        self.record_type = RECORD_TYPES[code]
+        self.record_len = self.record_type._LEN_
+        self._fields = {field.name: field for field in self.record_type._FIELDS_}
+        self._buf = bytearray(capacity * self.record_len)
+        self._num = 0
+
+    @staticmethod
+    def for_response(resp_code, capacity=1024):
+        """Create a container for a key of TSND151._RESPONSE_CODE_MAP_."""
+        from tsnd.tsnd151 import TSND151
+
+        if resp_code not in TSND151._RESPONSE_CODE_MAP_:
+            raise ValueError("Invalid response code")
+        return PackedRecords(TSND151._RESPONSE_CODE_MAP_[resp_code], capacity)
+
+    def append(self, raw):
+        n, rec_len = self._num, self.record_len
+        if len(raw) != rec_len:
+            raise ValueError(f"Invalid payload length: {len(raw)} for {rec_len}")
+        buf = self._buf
+        if (n + 1) * rec_len > len(buf):
+            # a new buffer instead of resizing, since views of readers may export the old one
+            grown = bytearray(len(buf) * 2)
+            grown[0:n * rec_len] = buf[0:n * rec_len]
+            self._buf = buf = grown
+        buf[n * rec_len:(n + 1) * rec_len] = raw
+        self._num = n + 1
+
+    def extend(self, payloads):
+        for raw in payloads:
+            self.append(raw)
+
+    def put(self, args, block=True, timeout=None):
+        self.append(args)
+
+    def clear(self):
+        """Forget the records. Views made before keep their records."""
+        self._num = 0
+        self._buf = bytearray(len(self._buf))
+
+    def __len__(self):
+        return self._num
+
+    @property
+    def nbytes(self):
+        """Bytes allocated for the records."""
+        return len(self._buf)
+
+    def _snapshot(self):
+        n = self._num  # before the buffer, which has at least n records
+        return self._buf, n
+
+    def __getitem__(self, index):
+        buf, n = self._snapshot()
+        if isinstance(index, slice):
+            return [self.record_type(bytes(buf[i * self.record_len:(i + 1) * self.record_len]))
+                    for i in range(*index.indices(n))]
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("Record index out of range")
+        return self.record_type(bytes(buf[index * self.record_len:(index + 1) * self.record_len]))
+
+    def __iter__(self):
+        buf, n = self._snapshot()
+        rec_len, record_type = self.record_len, self.record_type
+        for i in range(n):
+            yield record_type(bytes(buf[i * rec_len:(i + 1) * rec_len]))
+
+    def raw_view(self):
+        """Records as an uint8 array of shape (N, record_len), a view of the buffer."""
+        buf, n = self._snapshot()
+        return np.frombuffer(buf, dtype=np.uint8, count=n * self.record_len).reshape(n, self.record_len)
+
+    def column(self, name):
+        """Field of all records as an array of shape (N,) or (N, axis).
+
+        1, 2 and 4 byte fields are strided views of the buffer without a copy,
+        and 24-bit fields are decoded into a new array.
+        """
+        field = self._fields.get(name)
+        if field is None:
+            raise ValueError(f"Invalid field: {name}")
+
+        buf, n = self._snapshot()
+        if field.size == 3:
+            raw = np.frombuffer(buf, dtype=np.uint8, count=n * self.record_len).reshape(n, self.record_len)
+            values = _decode_int_le(raw, field.offset, field.size, field.count, field.signed)
+            return values if field.count > 1 else values[:, 0]
+
+        dt = np.dtype(f"{'i' if field.signed else 'u'}{field.size}").newbyteorder('<')
+        if field.count > 1:
+            shape, strides = (n, field.count), (self.record_len, field.size)
+        else:
+            shape, strides = (n,), (self.record_len,)
+        view = np.ndarray(shape, dtype=dt, buffer=buf, offset=field.offset, strides=strides)
+        view.flags.writeable = False
+        return view
+
+    def to_array(self):
+        """Records as a structured array by tsnd.batch_decoder.decode_batch (a copy)."""
+        buf, n = self._snapshot()
+        return decode_batch(self.code, memoryview(buf)[0:n * self.record_len])
@@ -0,0 +1,259 @@
+"""Raw serial capture and replay for hardware-free runs of TSND151.
+
+A capture file records every chunk read from (and written to) the serial
+port with a monotonic host timestamp. A ReplaySerial feeds the read chunks
+back as a serial port, so it can be passed to TSND151.open in place of a port
+path.
+
+File layout (all ints are little-endian)::
+
+    b'TSNDCAP1'
+    repeated records:
+        timestamp in sec from the capture start (f8), direction (b'R' or b'W'), length (u4), data
+
+Example
+-------
+>>> tsnd151 = TSND151.open('/dev/rfcomm0', capture_path='session.tsndcap')  # capture
+>>> tsnd151 = TSND151.open(ReplaySerial('session.tsndcap', speed=None))  # replay at max speed
+"""
+import struct
+import time
+from threading import Lock
+
+_CAPTURE_MAGIC_ = b'TSNDCAP1'
+_RECORD_HEADER_ = struct.Struct('<dcI')
+READ = b'R'
+WRITE = b'W'
+_MAX_IN_WAITING_ = 4096  # like a driver buffer
+
+
+class CaptureWriter:
+    """Writer of a capture file. It can be shared by serial ports reopened on recovery.
+
+    Parameters
+    ----------
+    path: str
+        path to the capture file
+    capture_write: bool
+        If True, written bytes (commands) are also recorded.
+
+    """
+
+    def __init__(self, path, capture_write=True):
+        self.path = path
+        self.capture_write = capture_write
+        self._file = open(path, 'wb')
+        self._file.write(_CAPTURE_MAGIC_)
+        self._start = time.monotonic()
+        self._lock = Lock()
+
+    def record(self, direction, data):
+        if len(data) == 0 or (direction == WRITE and not self.capture_write):
+            return
+
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(_RECORD_HEADER_.pack(time.monotonic() - self._start, direction, len(data)))
+            self._file.write(data)
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def read_capture(path):
+    """Yield (timestamp, direction, data) of each record in a capture file.
+
+    A truncated record at the end is ignored.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(_CAPTURE_MAGIC_)) != _CAPTURE_MAGIC_:
+            raise ValueError(f"Not a capture file: {path}")
+
+        while True:
+            head = f.read(_RECORD_HEADER_.size)
+            if len(head) < _RECORD_HEADER_.size:
+                return
+            timestamp, direction, length = _RECORD_HEADER_.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, direction, data
+
+
+class CaptureSerial:
+    """Serial port wrapper which records the byte stream to a CaptureWriter.
+
+    Parameters
+    ----------
+    serial_: serial.Serial
+        opened serial port
+    capture: CaptureWriter
+
+    """
+
+    def __init__(self, serial_, capture):
+        self._serial = serial_
+        self._capture = capture
+
+    @property
+    def is_open(self):
+        return self._serial.is_open
+
+    @property
+    def in_waiting(self):
+        return self._serial.in_waiting
+
+    def fileno(self):
+        return self._serial.fileno()
+
+    def read(self, size=1):
+        data = self._serial.read(size)
+        self._capture.record(READ, data)
+        return data
+
+    def write(self, data):
+        self._capture.record(WRITE, bytes(data))
+        return self._serial.write(data)
+
+    def flush(self):
+        self._serial.flush()
+        self._capture.flush()
+
+    def close(self):
+        self._serial.close()
+        self._capture.flush()
+
+
+class ReplaySerial:
+    """Serial-like transport which replays read chunks of a capture file.
+
+    Parameters
+    ----------
+    path_or_records: str or list
+        path to a capture file, or a list of (timestamp, data) to be read
+    speed: float or None
+        1.0 is real-time, 2.0 is twice as fast.
+        None or 0 replays at maximum speed.
+    timeout: float
+        max sec for read() to wait data, like serial.Serial.timeout
+    loop: bool
+        If True, it restarts from the beginning at the end of the records.
+
+    """
+
+    def __init__(self, path_or_records, speed=1.0, timeout=0.01, loop=False):
+        if isinstance(path_or_records, str):
+            records = [(t, data) for t, direction, data in read_capture(path_or_records) if direction == READ]
+        else:
+            records = list(path_or_records)
+
+        self._times = [t - records[0][0] for t, data in records] if len(records) > 0 else []
+        self._chunks = [data for t, data in records]
+        self.speed = speed
+        self.timeout = timeout
+        self.loop = loop
+        self.written = bytearray()
+        self.is_open = True
+
+        self._index = 0  # chunk to read next
+        self._offset = 0  # offset in the chunk
+        self._start = None  # monotonic time the replay started
+        self._lock = Lock()
+
+    @property
+    def total_bytes(self):
+        return sum(len(c) for c in self._chunks)
+
+    @property
+    def eof(self):
+        """True if all records have been read (never True if loop)."""
+        return not self.loop and self._index >= len(self._chunks)
+
+    def open(self):
+        """Reopen, e.g., on auto recovery. The replay continues from the current position."""
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def rewind(self):
+        with self._lock:
+            self._index = 0
+            self._offset = 0
+            self._start = None
+
+    def _elapsed(self):
+        if self._start is None:
+            self._start = time.monotonic()
+        if not self.speed:
+            return float('inf')
+        return (time.monotonic() - self._start) * self.speed
+
+    def _wrap_if_needed(self):
+        if self.loop and self._index >= len(self._chunks) and len(self._chunks) > 0:
+            self._index = 0
+            self._offset = 0
+            self._start = None
+            self._elapsed()
+
+    def _available(self, elapsed):
+        n = 0
+        i = self._index
+        while i < len(self._chunks) and self._times[i] <= elapsed and n < _MAX_IN_WAITING_:
+            n += len(self._chunks[i]) - (self._offset if i == self._index else 0)
+            i += 1
+        return n
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            self._wrap_if_needed()
+            return min(self._available(self._elapsed()), _MAX_IN_WAITING_)
+
+    def _read_available(self, size):
+        self._wrap_if_needed()
+        elapsed = self._elapsed()
+        res = bytearray()
+        while (len(res) < size and self._index < len(self._chunks)
+               and self._times[self._index] <= elapsed):
+            chunk = self._chunks[self._index]
+            take = min(size - len(res), len(chunk) - self._offset)
+            res += chunk[self._offset:self._offset + take]
+            self._offset += take
+            if self._offset >= len(chunk):
+                self._index += 1
+                self._offset = 0
+        return bytes(res)
+
+    def read(self, size=1):
+        """Read up to size bytes whose time has come, waiting up to timeout."""
+        if not self.is_open:
+            raise IOError("Replay is closed")
+
+        with self._lock:
+            res = self._read_available(size)
+            if len(res) > 0 or not self.timeout:
+                return res
+            wait = self.timeout
+            if self._index < len(self._chunks) and self.speed:
+                wait = min(wait, (self._times[self._index] - self._elapsed()) / self.speed)
+
+        time.sleep(max(wait, 0))
+        with self._lock:
+            return self._read_available(size)
+
+    def write(self, data):
+        """Written bytes are kept in self.written and not replayed."""
+        self.written += bytes(data)
+        return len(data)
+
+    def flush(self):
+        pass
@@ -0,0 +1,174 @@
+"""Fixed-capacity ring buffer which can be set in place of a response queue.
+
+Payloads are copied into one preallocated NumPy array, so memory use is flat
+no matter how long a recording runs. If a consumer does not drain in time, the
+oldest records are overwritten and counted as overflow.
+
+Example
+-------
+>>> sink = RingBufferSink.for_response('quaternion_acc_gyro_data', capacity=60000)
+>>> tsnd151.set_response_queue('quaternion_acc_gyro_data', sink)
+>>> seq, payloads = sink.drain()
+>>> rec = sink.drain(decode=True)[1]  # structured array by tsnd.batch_decoder
+
+NumPy is required for this module.
+"""
+from queue import Empty
+from threading import Condition, Lock
+import time
+import numpy as np
+
+
+class RingBufferSink:
+    """Ring buffer of raw payloads of one response code.
+
+    It has put/get/qsize/empty like queue.Queue, so it can be used with
+    TSND151.set_response_queue, and drain/latest to get records as arrays.
+
+    Parameters
+    ----------
+    record_len: int
+        payload length of the response code
+    capacity: int
+        max number of records kept
+    code: bytes or None
+        response code, used to decode records by drain(decode=True)
+
+    """
+
+    def __init__(self, record_len, capacity=65536, code=None):
+        if capacity <= 0:
+            raise ValueError(f"Invalid capacity: {capacity}")
+
+        self.record_len = record_len
+        self.capacity = capacity
+        self.code = code
+        self._buf = np.zeros((capacity, record_len), dtype=np.uint8)
+        self._mem = memoryview(self._buf).cast('B')
+        self._write_seq = 0  # sequence number of the next record to write
+        self._read_seq = 0  # sequence number of the next record to read
+        self._overflow_count = 0
+        self._cond = Condition(Lock())
+
+    @staticmethod
+    def for_response(resp_code, capacity=65536):
+        """Create a sink for a key of TSND151._RESPONSE_CODE_MAP_."""
+        from tsnd.tsnd151 import TSND151
+
+        if resp_code not in TSND151._RESPONSE_CODE_MAP_:
+            raise ValueError("Invalid response code")
+
+        code = TSND151._RESPONSE_CODE_MAP_[resp_code]
+        return RingBufferSink(TSND151._RESPONSE_ARG_LEN_MAP_[code], capacity, code)
+
+    @property
+    def overflow_count(self):
+        """Number of records overwritten before being read."""
+        return self._overflow_count
+
+    @property
+    def total_count(self):
+        """Number of records put so far, i.e. the next sequence number."""
+        return self._write_seq
+
+    def put(self, args, block=True, timeout=None):
+        """Store a payload. block and timeout are ignored (never blocks)."""
+        n = self.record_len
+        with self._cond:
+            i = (self._write_seq % self.capacity) * n
+            self._mem[i:i + n] = args
+            self._write_seq += 1
+            if self._write_seq - self._read_seq > self.capacity:
+                self._read_seq += 1
+                self._overflow_count += 1
+            self._cond.notify()
+
+    def get(self, block=True, timeout=None):
+        """Get the oldest unread payload as bytes, like queue.Queue.get."""
+        with self._cond:
+            if block:
+                end_time = None if timeout is None else time.monotonic() + timeout
+                while self._write_seq == self._read_seq:
+                    remaining = None if end_time is None else end_time - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise Empty
+                    self._cond.wait(remaining)
+            elif self._write_seq == self._read_seq:
+                raise Empty
+
+            i = self._read_seq % self.capacity
+            self._read_seq += 1
+            return self._buf[i].tobytes()
+
+    def qsize(self):
+        return self._write_seq - self._read_seq
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def clear(self):
+        """Drop all unread records."""
+        with self._cond:
+            self._read_seq = self._write_seq
+
+    def _slice(self, start_seq, end_seq):
+        """Copy of records in [start_seq, end_seq). Call it holding _cond."""
+        start = start_seq % self.capacity
+        n = end_seq - start_seq
+        if start + n <= self.capacity:
+            payloads = self._buf[start:start + n].copy()  # a view would be overwritten by put
+        else:
+            payloads = np.concatenate([self._buf[start:], self._buf[:start + n - self.capacity]])
+
+        return np.arange(start_seq, end_seq, dtype=np.uint64), payloads
+
+    def _decode(self, payloads):
+        from tsnd.batch_decoder import decode_batch
+        return decode_batch(self.code, payloads)
+
+    def drain(self, max_num=None, decode=False):
+        """Get unread records and mark them as read.
+
+        The payload array is a copy taken under the lock, so records are not
+        torn by put from the reader thread.
+
+        Parameters
+        ----------
+        max_num: int or None
+            max number of records to get. None means all.
+        decode: bool
+            If True, payloads are decoded by tsnd.batch_decoder.decode_batch.
+
+        Returns
+        -------
+        tuple
+            (seq, payloads): seq is a uint64 array of sequence numbers,
+            payloads is a (N, record_len) uint8 array or a structured array.
+            A gap in seq from the previous drain means records were lost by overflow.
+
+        """
+        with self._cond:
+            start = self._read_seq
+            end = self._write_seq
+            if max_num is not None:
+                end = min(end, start + max_num)
+            self._read_seq = end
+            seq, payloads = self._slice(start, end)
+
+        return seq, self._decode(payloads) if decode else payloads
+
+    def latest(self, num, decode=False):
+        """Get the last num records (or less) without marking them as read.
+
+        Returns
+        -------
+        tuple
+            (seq, payloads) like drain
+
+        """
+        with self._cond:
+            end = self._write_seq
+            start = max(end - num, end - self.capacity, 0)
+            seq, payloads = self._slice(start, end)
+
+        return seq, self._decode(payloads) if decode else payloads
@@ -1,6 +1,7 @@
-from tsnd import TSND151
-from queue import Queue
+from tsnd import TSND151, DeviceSettings
+from tsnd.recording import RecordingWriter
 import numpy as np
+import threading
 import time
 
 
@@ -8,51 +9,72 @@ with open('serial_port.txt', 'r') as f:
     path_to_serial_port = f.readline()[0:-1] # remove \n
 
 hz=100
+save_as_recording = False  # True: stream into a chunked recording file (tsnd.recording) instead of csv
 with TSND151.open(path_to_serial_port, 
                   wait_sec_on_open_for_stability=0.2, 
                   wait_sec_on_auto_close_for_stability=0.2
         ) as tsnd151:
     # init
     tsnd151.stop_recording()
-    tsnd151.set_time()
-    tsnd151.set_acc_range(16)  # +-16g
-    tsnd151.set_gyro_range(2000)  # +-2000g, ignored
-    tsnd151.set_acc_and_gyro_interval(  # perhaps ignored, because quat is enabled.
-        interval_in_ms=2
-        , avg_num_for_send=int(1000 / hz / 2)  # 10 if 50Hz: 10 avg with 2 ms data = 20 ms
-        , avg_num_for_save=0)
-    tsnd151.set_quaternion_interval(
-        interval_in_5ms_unit=1
-        , avg_num_for_send=int(1000 / hz / 5)  # 4 if 50Hz: 4 avg with 5 ms data = 20 ms
-        , avg_num_for_save=0)
+    report = tsnd151.configure(DeviceSettings(  # one mode check and pipelined commands
+        time=True
+        , acc_range=16  # +-16g
+        , gyro_range=2000  # +-2000g, ignored
+        , acc_and_gyro_interval=(  # perhaps ignored, because quat is enabled.
+            2  # interval_in_ms
+            , int(1000 / hz / 2)  # avg_num_for_send, 10 if 50Hz: 10 avg with 2 ms data = 20 ms
+            , 0)  # avg_num_for_save
+        , quaternion_interval=(
+            1  # interval_in_5ms_unit
+            , int(1000 / hz / 5)  # avg_num_for_send, 4 if 50Hz: 4 avg with 5 ms data = 20 ms
+            , 0)  # avg_num_for_save
+        , magnetism_interval=(0, 0, 0)  # disable
+        , atmosphere_interval=(0, 0, 0)  # disable
+        , battery_voltage_measurement=(False, False)  # disable
+        , overwrite_protection=False  # enable overwrite
+        , auto_power_off=0))  # disable
+    failed = [setter_name for setter_name, success in report.items() if not success]
+    if len(failed) > 0:
+        print("Failed to configure:", failed)
 
-    tsnd151.set_magnetism_interval(0, 0, 0)  # disable
-    tsnd151.set_atmosphere_interval(0, 0, 0)  # disable
-    tsnd151.set_battery_voltage_measurement(False, False)  # disable
-    tsnd151.set_overwrite_protection(False)  # enable overwrite
-    tsnd151.set_auto_power_off(0)  # disable
-
-    q = Queue()
-    tsnd151.set_response_queue('quaternion_acc_gyro_data', q)
-    start_time = tsnd151.start_recording(force_restart=True).timestamp()
+    # writer and subscription before start_recording, else records arriving in between are dropped
+    started = {'time': None}  # start time of recording, set by the return of start_recording
+    started_event = threading.Event()
+    writer = None
+    rows = []
+    if save_as_recording:
+        day = tsnd151.get_time().replace(hour=0, minute=0, second=0, microsecond=0)  # ms counters are of the day
+        writer = RecordingWriter("tmp.tsndrec", TSND151._RESPONSE_CODE_MAP_['quaternion_acc_gyro_data'],
+                                 settings=RecordingWriter.settings_of(tsnd151, day))
     ##############################
-    try:
-        def conv(q_data):
-            ms, _, acc, gyro = TSND151.parse_quaternion_acc_gyro(q_data)
-            res = [ms / 1000 + start_time, ]
-            res.extend(acc)
-            res.extend(gyro)
-            return np.array(res)
+    def on_batch(rec):  # called on a worker thread with a decoded batch, one batch at a time
+        if writer is not None:
+            writer.write(rec)
+        else:
+            started_event.wait()
+            if started['time'] is None:  # start_recording failed, so ms counters can not be converted
+                return
+            rows.append(np.column_stack([rec['ms'] / 1000 + started['time'], rec['acc'], rec['gyro']]))
 
-        while True:
-            #if q.empty():
-            time.sleep(0.005)  # 5 ms
-            #else:
-            #    res = np.array([conv(q.get()) for i in range(q.qsize())])
-            #    print(res)
+    sub = tsnd151.subscribe('quaternion_acc_gyro_data', on_batch, batch_size=hz, max_latency=0.5)
+    try:
+        try:
+            start_time = tsnd151.start_recording(force_restart=True)
+            if start_time is not None:
+                started['time'] = start_time.timestamp()
+        finally:
+            started_event.set()  # on_batch never waits forever, even if start_recording raised
+        if started['time'] is None:
+            print("Failed to start recording")
+        else:
+            while True:
+                time.sleep(1)  # records are delivered without polling
     finally:
         tsnd151.stop_recording()
-        res = np.array([conv(q.get()) for i in range(q.qsize())])
-        np.savetxt("tmp.csv", res, delimiter=',')
+        tsnd151.unsubscribe(sub)  # delivers the rest
+        print(sub.stats())
+        if writer is not None:
+            writer.close()
+        else:
+            np.savetxt("tmp.csv", np.concatenate(rows) if len(rows) > 0 else np.empty((0, 7)), delimiter=',')
     ##############################
-
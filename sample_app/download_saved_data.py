@@ -1,4 +1,6 @@
 from tsnd import TSND151
+from tsnd.batch_decoder import decode_acc_gyro_batch, drain_queue
+from tsnd.download import download_saved_entry
 from queue import Queue
 import numpy as np
 import sys
@@ -8,6 +10,8 @@ import time
 with open('serial_port.txt', 'r') as f:
     path_to_serial_port = f.readline()[0:-1] # remove \n
 
+save_as_recording = False  # True: stream each entry into chunked recording files (tsnd.download) instead of csv
+
 
 with TSND151.open(path_to_serial_port) as tsnd151:
     # init
@@ -39,23 +43,31 @@ with TSND151.open(path_to_serial_port) as tsnd151:
                 print(f"invalid input {cmd}")
                 continue
 
-        def conv(q_data, start_time):
-            ms, acc, gyro = TSND151.parse_acc_gyro(q_data)
-            res = [ms / 1000 + start_time, ]
-            res.extend(acc)
-            res.extend(gyro)
-            return np.array(res)
+        def conv(payloads, start_time):
+            rec = decode_acc_gyro_batch(payloads)
+            return np.column_stack([rec['ms'] / 1000 + start_time, rec['acc'], rec['gyro']])
 
         for i in targets:
-            q = Queue()
-            tsnd151.set_response_queue('acc_gyro_data', q)  # it should be arranged for the used recording setting
             start_time = start_times[i]
             start_timestamp = start_time.replace(hour=0, minute=0, second=0, microsecond=0).timestamp() 
 
             print(f'{i+1}/{total_entry_num}: start_time={start_time.strftime("%Y-%m-%d_%H-%M-%S")}', end='', flush=True)
-            tsnd151.get_saved_entry(i+1)
-            res = np.array([conv(q.get(), start_timestamp) for i in range(q.qsize())])
+            if save_as_recording:
+                # records are written chunk by chunk while downloading, with constant memory
+                def show(progress):
+                    eta = f'{progress.eta_sec:.0f} s' if progress.eta_sec is not None else '-'
+                    print(f'\r{i+1}/{total_entry_num}: {progress.records} records, '
+                          f'{progress.records_per_sec:.0f} records/s, {progress.bytes_per_sec / 1000:.1f} kB/s, '
+                          f'ETA {eta}', end='', flush=True)
+
+                summary = download_saved_entry(tsnd151, i+1, start_time.strftime("%Y-%m-%d_%H-%M-%S"), progress=show)
+                print(f' {summary["records"]}', end='')
+            else:
+                q = Queue()
+                tsnd151.set_response_queue('acc_gyro_data', q)  # it should be arranged for the used recording setting
+                tsnd151.get_saved_entry(i+1)
+                res = conv(drain_queue(q), start_timestamp)
 
-            np.savetxt(f'{start_time.strftime("%Y-%m-%d_%H-%M-%S")}.csv.gz', res, delimiter=',')
+                np.savetxt(f'{start_time.strftime("%Y-%m-%d_%H-%M-%S")}.csv.gz', res, delimiter=',')
             print(' [Done]')
 
@@ -0,0 +1,260 @@
+"""Callback subscriptions delivering decoded batches on an executor.
+
+TSND151.subscribe sets a Subscription as the sink of a response code. The
+reader thread only appends each payload to the pending batch. A flusher
+thread cuts a batch when it reaches batch_size or its oldest payload is
+max_latency sec old, and the batch is decoded and passed to the callback on
+an executor, e.g., a thread or process pool. Batches of a subscription are
+delivered one at a time in order, so a slow callback only fills the backlog
+of its own subscription, whose oldest batches are dropped over
+max_pending_batches.
+
+Example
+-------
+>>> def on_batch(rec):
+...     print(len(rec), rec['acc'].mean(axis=0))
+>>> sub = tsnd151.subscribe('acc_gyro_data', on_batch, batch_size=100, max_latency=0.1)
+>>> ...
+>>> sub.stats()  # {'delivered_records': ..., 'lag_sec': ..., 'dropped_records': ..., ...}
+>>> tsnd151.unsubscribe(sub)
+
+With a process pool, the callback has to be picklable, e.g., a function at module level.
+
+NumPy is required for this module.
+"""
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from threading import Condition, Lock, Thread
+from tsnd.batch_decoder import decode_batch
+
+_LOGGER_ = getLogger("TSND151")
+
+_DEFAULT_EXECUTOR_ = None
+_DEFAULT_EXECUTOR_LOCK_ = Lock()
+
+
+def _default_executor():
+    global _DEFAULT_EXECUTOR_
+    with _DEFAULT_EXECUTOR_LOCK_:
+        if _DEFAULT_EXECUTOR_ is None:
+            _DEFAULT_EXECUTOR_ = ThreadPoolExecutor(max_workers=4, thread_name_prefix='tsnd_subscription')
+        return _DEFAULT_EXECUTOR_
+
+
+def _deliver(callback, code, payloads, decode):
+    """Run in the executor, i.e., in a worker process for a process pool."""
+    callback(decode_batch(code, payloads) if decode else payloads)
+
+
+class Subscription:
+    """Subscription of a response code, see the module docstring.
+
+    Parameters
+    ----------
+    code: bytes
+        response code, e.g., TSND151._RESPONSE_CODE_MAP_['acc_gyro_data']
+    callback: callable
+        called with a structured array of tsnd.batch_decoder (or the joined payloads if not decode)
+    batch_size: int
+        max number of records in a batch
+    max_latency: int, float
+        max sec from the arrival of a record to the cut of its batch
+    executor: concurrent.futures.Executor or None
+        executor to run callbacks. If None, a thread pool shared by subscriptions.
+    max_pending_batches: int
+        max number of batches waiting for the callback. The oldest ones are dropped over it.
+    decode: bool
+        If False, callback gets the payloads joined as bytes.
+
+    """
+
+    def __init__(self, code, callback, batch_size=100, max_latency=0.05, executor=None, max_pending_batches=64,
+                 decode=True):
+        if batch_size <= 0:
+            raise ValueError(f"Invalid batch_size: {batch_size}")
+        if max_pending_batches <= 0:
+            raise ValueError(f"Invalid max_pending_batches: {max_pending_batches}")
+
+        self.code = code
+        self.callback = callback
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.executor = executor if executor is not None else _default_executor()
+        self.max_pending_batches = max_pending_batches
+        self.decode = decode
+
+        self._cond = Condition(Lock())
+        self._pending = []  # payloads of the batch being filled
+        self._pending_since = None  # time.monotonic() of the oldest pending payload
+        self._backlog = deque()  # (payloads, arrival of the oldest) waiting for the callback
+        self._in_flight = False
+        self._closed = False
+
+        self.received_records = 0
+        self.delivered_batches = 0
+        self.delivered_records = 0
+        self.dropped_batches = 0
+        self.dropped_records = 0
+        self.error_count = 0
+        self.lag_sec = 0.0  # from the arrival of the oldest record to the end of the callback, of the last batch
+        self.max_lag_sec = 0.0
+
+        self._thread = Thread(target=self._run, daemon=True, name='tsnd_subscription_flusher')
+        self._thread.start()
+
+    @property
+    def overflow_count(self):
+        """Records dropped, like BoundedQueue.overflow_count."""
+        return self.dropped_records
+
+    def put(self, args, block=True, timeout=None):
+        """Append a payload to the pending batch. It never blocks the reader thread."""
+        with self._cond:
+            if self._closed:
+                return
+            self._pending.append(args)
+            self.received_records += 1
+            n = len(self._pending)
+            if n == 1:
+                self._pending_since = time.monotonic()
+                self._cond.notify()  # starts the latency timer
+            elif n == self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        cond = self._cond
+        while True:
+            with cond:
+                while not self._closed:
+                    n = len(self._pending)
+                    if n >= self.batch_size:
+                        break
+                    if n == 0:
+                        cond.wait()
+                        continue
+                    remaining = self._pending_since + self.max_latency - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    cond.wait(remaining)
+
+                if len(self._pending) > 0:
+                    self._cut()
+                closed = self._closed
+            self._submit_next()
+            if closed:
+                return
+
+    def _cut(self):
+        """Move the pending payloads into the backlog as batches. Call it holding the lock."""
+        pending, since = self._pending, self._pending_since
+        self._pending, self._pending_since = [], None
+        for i in range(0, len(pending), self.batch_size):
+            self._backlog.append((pending[i:i + self.batch_size], since))
+        while len(self._backlog) > self.max_pending_batches:
+            payloads, _ = self._backlog.popleft()
+            self.dropped_batches += 1
+            self.dropped_records += len(payloads)
+
+    def _submit_next(self):
+        with self._cond:
+            if self._in_flight or len(self._backlog) == 0:
+                return
+            payloads, since = self._backlog.popleft()
+            self._in_flight = True
+
+        try:
+            fut = self.executor.submit(_deliver, self.callback, self.code, b''.join(payloads), self.decode)
+        except RuntimeError as e:  # the executor is shut down
+            _LOGGER_.warning(f'Batch can not be delivered. cause: {e}')
+            with self._cond:
+                self._in_flight = False
+                self.dropped_batches += 1
+                self.dropped_records += len(payloads)
+            return
+        fut.add_done_callback(lambda f: self._on_delivered(f, len(payloads), since))
+
+    def _on_delivered(self, fut, n, since):
+        lag = time.monotonic() - since
+        error = fut.exception() if not fut.cancelled() else None
+        with self._cond:
+            self._in_flight = False
+            if error is not None:
+                self.error_count += 1
+            self.delivered_batches += 1
+            self.delivered_records += n
+            self.lag_sec = lag
+            if lag > self.max_lag_sec:
+                self.max_lag_sec = lag
+            self._cond.notify_all()
+        if error is not None:
+            _LOGGER_.warning(f'Callback of a subscription failed. cause: {error!r}')
+        self._submit_next()
+
+    def stats(self):
+        """Counters and the lag of the subscription.
+
+        Returns
+        -------
+        dict
+            received_records, delivered_batches, delivered_records, dropped_batches, dropped_records,
+            errors, pending_records (not cut yet), backlog_batches, lag_sec, max_lag_sec
+
+        """
+        with self._cond:
+            return {
+                'received_records': self.received_records
+                , 'delivered_batches': self.delivered_batches
+                , 'delivered_records': self.delivered_records
+                , 'dropped_batches': self.dropped_batches
+                , 'dropped_records': self.dropped_records
+                , 'errors': self.error_count
+                , 'pending_records': len(self._pending)
+                , 'backlog_batches': len(self._backlog) + int(self._in_flight)
+                , 'lag_sec': self.lag_sec
+                , 'max_lag_sec': self.max_lag_sec
+            }
+
+    def close(self, timeout=None):
+        """Stop receiving, and wait the delivery of the records received.
+
+        Parameters
+        ----------
+        timeout: int, float or None
+            max sec to wait the delivery. None waits until all are delivered.
+
+        Returns
+        -------
+        bool
+            True if all batches are delivered
+
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+        end_time = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight or len(self._backlog) > 0:
+                remaining = None if end_time is None else end_time - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+
+class Fanout:
+    """Sink passing each payload to many sinks, e.g., subscriptions of the same response code."""
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+
+    def put(self, args, block=True, timeout=None):
+        for sink in self.sinks:
+            sink.put(args, block, timeout)
+
+    @property
+    def overflow_count(self):
+        return sum(getattr(sink, 'overflow_count', 0) for sink in self.sinks)
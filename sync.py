@@ -0,0 +1,155 @@
+"""Incremental sync of saved entries with a local entry index.
+
+sync_saved_entries downloads only the saved entries not yet stored in a
+local directory. Entries are identified by the device id (serial number of
+the device information, 0x90) and the full entry information (0xB7, i.e.,
+start time, settings and the number of records), not by the entry number,
+which changes when the device memory is cleared.
+
+Directory layout::
+
+    directory/index.json
+    directory/{device id}/{entry start time}_{response code name}.tsndrec
+
+An entry is added to the index only after its download is complete, so a
+broken transfer is retried from the beginning on the next attempt.
+
+Example
+-------
+>>> summary = sync_saved_entries(tsnd151, 'synced')
+>>> summary['downloaded'], summary['skipped']  # e.g., ([3], 2)
+
+NumPy is required for this module.
+"""
+import datetime
+import json
+import os
+import time
+from logging import getLogger
+from tsnd.tsnd151 import TSND151
+from tsnd.download import download_saved_entry, output_paths
+
+_LOGGER_ = getLogger("TSND151")
+
+
+class SavedEntryIndex:
+    """Index of synced entries, saved as JSON.
+
+    {device id: {entry information as hex: {entry_num, start_time, records, paths, synced_at}}}
+
+    Parameters
+    ----------
+    path: str
+        path to the index file. It is created on the first save.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._devices = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self._devices = json.load(f)
+
+    def contains(self, device_id, info):
+        return bytes(info).hex() in self._devices.get(device_id, {})
+
+    def entries(self, device_id):
+        """Synced entries of a device as {entry information as hex: record}."""
+        return dict(self._devices.get(device_id, {}))
+
+    def add(self, device_id, info, record):
+        self._devices.setdefault(device_id, {})[bytes(info).hex()] = record
+        self.save()
+
+    def save(self):
+        """Write the index atomically, i.e., a crash keeps the previous index."""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._devices, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def _remove_outputs(path_prefix):
+    for path in output_paths(path_prefix).values():
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def sync_saved_entries(tsnd151, directory, progress=None, retries=2, retry_wait_sec=1, idle_timeout_sec=10):
+    """Download saved entries not in the index of the directory.
+
+    Parameters
+    ----------
+    tsnd151: TSND151
+    directory: str
+        directory of the index and the recording files
+    progress: callable or None
+        passed to download_saved_entry
+    retries: int
+        number of retries of a broken transfer (timeout or lost connection)
+    retry_wait_sec: int, float
+        wait before a retry, e.g., for the auto recovery of the connection
+    idle_timeout_sec: int, float
+        passed to download_saved_entry
+
+    Returns
+    -------
+    dict
+        device_id: str
+        downloaded: list of entry numbers downloaded
+        skipped: number of entries synced already
+        failed: list of entry numbers failed after retries
+        or None if the mode is recording
+
+    """
+    if not tsnd151.check_is_cmd_mode():
+        return None
+
+    device_id = TSND151.parse_device_info(tsnd151.get_device_info())['serial_number']
+    index = SavedEntryIndex(os.path.join(directory, 'index.json'))
+    device_dir = os.path.join(directory, device_id)
+    os.makedirs(device_dir, exist_ok=True)
+
+    summary = {'device_id': device_id, 'downloaded': [], 'skipped': 0, 'failed': []}
+    for entry_num in range(1, tsnd151.get_saved_entry_num() + 1):
+        info = tsnd151.get_saved_entry_info(entry_num)
+        if info is None:
+            break
+        if index.contains(device_id, info):
+            summary['skipped'] += 1
+            continue
+
+        start_time = TSND151.parse_saved_entry_info(info)['start_time']
+        path_prefix = os.path.join(device_dir, start_time.strftime("%Y-%m-%d_%H-%M-%S"))
+        for attempt in range(retries + 1):
+            _remove_outputs(path_prefix)  # a broken transfer is downloaded from the beginning
+            try:
+                res = download_saved_entry(tsnd151, entry_num, path_prefix, progress=progress,
+                                           idle_timeout_sec=idle_timeout_sec)
+                if res is not None and sum(res['records'].values()) < res['expected_records']:
+                    raise IOError(f"{sum(res['records'].values())} of {res['expected_records']} records are received")
+                break
+            except (TimeoutError, IOError) as e:
+                _LOGGER_.warning(f'Download of saved entry {entry_num} is broken ({attempt + 1}/{retries + 1}). '
+                                 f'cause: {e}')
+                res = None
+                time.sleep(retry_wait_sec)
+
+        if res is None:
+            _remove_outputs(path_prefix)
+            summary['failed'].append(entry_num)
+            continue
+
+        index.add(device_id, info, {
+            'entry_num': entry_num
+            , 'start_time': start_time.isoformat()
+            , 'records': res['records']
+            , 'paths': {name: os.path.relpath(path, directory) for name, path in res['paths'].items()}
+            , 'synced_at': datetime.datetime.now().isoformat()
+        })
+        summary['downloaded'].append(entry_num)
+
+    return summary
@@ -0,0 +1,161 @@
+"""Sampled tracing of the read/decode/dispatch and command paths of TSND151.
+
+A Tracer set by TSND151.set_tracer times the stages of every N-th pass of
+the reader loop and of the command path, and passes the spans to its sinks.
+Without a tracer, the hot path only checks it is None.
+
+Stages
+------
+read        serial.read of a chunk, including the wait for data (args: bytes)
+decode      frame splitting and BCC check by the frame decoder (args: frames)
+dispatch    mode tracking, request matching and q.put into the response queues (args: frames)
+read_response   the byte by byte read of a frame by read_response
+build_cmd   building a command frame
+queue_wait  wait in the queue of the writer thread
+lock_wait   wait for serial_lock before a write
+write       serial.write of the commands queued together (args: bytes, commands)
+wait        wait for a response by request/wait_response (args: code)
+
+Example
+-------
+>>> hist = HistogramSink()
+>>> chrome = ChromeTraceSink('trace.json')
+>>> tsnd151.set_tracer(Tracer([hist, chrome], sample_every=100))
+>>> ...
+>>> hist.summary()  # {'read': {'count': ..., 'mean_us': ...}, 'decode': {...}, ...}
+>>> chrome.close()  # open trace.json in chrome://tracing or Perfetto
+"""
+import json
+import os
+import threading
+from collections import deque
+from threading import Lock
+from tsnd.metrics import Histogram
+
+
+class Tracer:
+    """Sampler of stages passing spans to sinks.
+
+    Parameters
+    ----------
+    sinks: object or list
+        objects having record(stage, start_ns, end_ns, thread_id, args)
+    sample_every: int
+        trace one of sample_every passes of each path, i.e., 1 traces all
+
+    """
+
+    def __init__(self, sinks, sample_every=100):
+        if sample_every < 1:
+            raise ValueError(f"Invalid sample_every: {sample_every}")
+        self.sinks = list(sinks) if isinstance(sinks, (list, tuple)) else [sinks]
+        self.sample_every = sample_every
+        self._count = 0
+
+    def sample(self):
+        """Return True if this pass is traced. Races between threads only shift the sampling."""
+        self._count += 1
+        return self._count % self.sample_every == 0
+
+    def record(self, stage, start_ns, end_ns, args=None):
+        """Pass a span timed by time.perf_counter_ns() to the sinks."""
+        thread_id = threading.get_ident()
+        for sink in self.sinks:
+            sink.record(stage, start_ns, end_ns, thread_id, args)
+
+
+class HistogramSink:
+    """Sink keeping a histogram of the durations of each stage.
+
+    Parameters
+    ----------
+    buckets: tuple of float or None
+        upper bounds of the buckets in sec (def: _DEFAULT_BUCKETS_)
+
+    """
+
+    _DEFAULT_BUCKETS_ = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2,
+                         5e-2, 1e-1)
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets if buckets is not None else self._DEFAULT_BUCKETS_
+        self._histograms = {}  # stage -> Histogram
+        self._lock = Lock()
+
+    def record(self, stage, start_ns, end_ns, thread_id, args):
+        with self._lock:
+            hist = self._histograms.get(stage)
+            if hist is None:
+                hist = self._histograms[stage] = Histogram(self.buckets)
+            hist.observe((end_ns - start_ns) / 1e9)
+
+    def histograms(self):
+        """{stage: Histogram.snapshot()}"""
+        with self._lock:
+            return {stage: hist.snapshot() for stage, hist in self._histograms.items()}
+
+    def summary(self):
+        """{stage: {'count', 'total_ms', 'mean_us', 'p50_us', 'p99_us'}}, percentiles by bucket upper bounds."""
+        res = {}
+        for stage, snap in self.histograms().items():
+            count = snap['count']
+
+            def percentile(ratio):
+                for le, n in snap['buckets']:
+                    if n >= ratio * count:
+                        return le * 1e6
+                return float('inf')
+
+            res[stage] = {
+                'count': count
+                , 'total_ms': snap['sum'] * 1e3
+                , 'mean_us': snap['sum'] / count * 1e6 if count > 0 else 0.0
+                , 'p50_us': percentile(0.5)
+                , 'p99_us': percentile(0.99)
+            }
+        return res
+
+
+class ChromeTraceSink:
+    """Sink writing spans as complete events ('ph': 'X') of the Chrome trace event format.
+
+    The file is written by flush or close, and can be opened by chrome://tracing or Perfetto.
+
+    Parameters
+    ----------
+    path: str
+    max_events: int
+        max number of events kept, i.e., older ones are dropped
+
+    """
+
+    def __init__(self, path, max_events=1000000):
+        self.path = path
+        self._events = deque(maxlen=max_events)
+        self._pid = os.getpid()
+        self._lock = Lock()
+
+    def record(self, stage, start_ns, end_ns, thread_id, args):
+        event = {'name': stage, 'ph': 'X', 'ts': start_ns / 1000, 'dur': (end_ns - start_ns) / 1000,
+                 'pid': self._pid, 'tid': thread_id}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+
+    def flush(self):
+        with self._lock:
+            events = list(self._events)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
@@ -3,8 +3,15 @@ import time
 from enum import IntEnum
 from tsnd.utils.common_utils import check_range
 from tsnd.utils.thread_utils import ReusableLoopThread
+from tsnd.frame_decoder import FrameDecoder
+from tsnd.replay import CaptureWriter, CaptureSerial
+from tsnd.metrics import Histogram, MeteredLock
+from tsnd.bounded_queue import BoundedQueue
+from tsnd.protocol import RESPONSE_LAYOUTS
+from collections import deque
+from concurrent import futures
 from queue import Queue, Empty
-from threading import RLock, Thread
+from threading import Lock, RLock, Thread, current_thread
 from logging import getLogger
 import serial
 
@@ -20,6 +27,14 @@ class TSND151:
     _NG_BIT_ = b'\x01'
     _OVERWRITE_OK_BIT_ = b'\x00'
     _OVERWRITE_NG_BIT_ = b'\x01'
+    _MODE_MAX_AGE_SEC_ = 30  # the tracked mode is re-queried if not updated for it
+    _MAX_PENDING_PINGS_ = 3  # connection is regarded as lost if pings are not replied
+    _LATE_RESPONSE_SEC_ = 1.0  # a cancelled request drops its response arrived in it, i.e., it is regarded as lost after it
+    _MAX_WRITE_BATCH_ = 32  # commands queued together are written by one write
+    _RECONNECT_MIN_SEC_ = 0.1  # first wait after a failed reopening, doubled per failure
+    _RECONNECT_MAX_SEC_ = 5.0
+    _REARM_TIME_TOLERANCE_SEC_ = 1.0  # the time is re-applied if the device clock is off by more than it
+    _REARM_MODE_TIMEOUT_SEC_ = 1.0  # a reopened port may not reach the device yet, so the mode is retried
 
     class OptionButtonMode(IntEnum):
         DISABLE = 0
@@ -28,77 +43,20 @@ class TSND151:
         EVENT = 3
         EVENT_WITH_BUZZER = 4
 
-    _RESPONSE_ARG_LEN_MAP_ = {
-        b'\x8F': 1
-        , b'\x90': 30
-        , b'\x92': 8
-        , b'\x93': 13
-        , b'\x97': 3
-        , b'\x99': 3
-        , b'\x9B': 3
-        , b'\x9D': 2
-        , b'\x9F': 5
-        , b'\xA1': 3
-        , b'\xA3': 1
-        , b'\xA6': 1
-        , b'\xAA': 12
-        , b'\xAB': 9
-        , b'\xAD': 1
-        , b'\xAF': 1
-        , b'\xB1': 4
-        , b'\xB3': 1
-        , b'\xB6': 1
-        , b'\xB7': 24
-        , b'\xB8': 60
-        , b'\xB9': 1
-        , b'\xBA': 5
-        , b'\xBB': 3
-        , b'\xBC': 1
-        , b'\xBD': 12
-        , b'\xBE': 12
-        , b'\xD1': 1
-        , b'\xD3': 1
-        , b'\xD6': 3
-        , b'\xD8': 78
-        , b'\xDA': 7
-        , b'\xDC': 28
-        , b'\xDD': 1
-        , b'\x80': 22
-        , b'\x81': 13
-        , b'\x82': 9
-        , b'\x83': 7
-        , b'\x84': 9
-        , b'\x85': 6
-        , b'\x86': 13
-        , b'\x87': 5
-        , b'\x88': 1
-        , b'\x89': 1
-        , b'\x8A': 30
-        , b'\x8B': 22
-        , b'\x8C': 12}
-
-    _RESPONSE_CODE_MAP_ = {
-        'simple': b'\x8F'
-        , 'acc_gyro_data': b'\x80'
-        , 'magnetism_data': b'\x81'
-        , 'atmosphere_data': b'\x82'
-        , 'battery_voltage_data': b'\x83'
-        , 'start_recording': b'\x88'
-        , 'stop_recording': b'\x89'
-        , 'quaternion_acc_gyro_data': b'\x8A'
-        , 'time': b'\x92'
-        , 'recording_time_settings': b'\x93'
-        , 'acc_range': b'\xA3'
-        , 'overwrite_protection': b'\xAF'
-        , 'saved_entry_num': b'\xB6'
-        , 'saved_entry_info': b'\xB7'
-        , 'saved_entry_end': b'\xB9'
-        , 'mode': b'\xBC'
-        , 'option_button_behavior': b'\xAD'
-    }
+    # from the table of tsnd.protocol
+    _RESPONSE_ARG_LEN_MAP_ = {code: layout.size for code, layout in RESPONSE_LAYOUTS.items()}
+
+    _RESPONSE_CODE_MAP_ = {layout.name: code for code, layout in RESPONSE_LAYOUTS.items()}
+
+    _RESPONSE_NAME_MAP_ = {code: name for name, code in _RESPONSE_CODE_MAP_.items()}
+
+    # responses streamed while recording, i.e., not replies to commands
+    _STREAM_CODE_NAMES_ = ('acc_gyro_data', 'magnetism_data', 'atmosphere_data', 'battery_voltage_data'
+                           , 'quaternion_acc_gyro_data')
 
     _CMD_CODE_MAP_ = {
-        'set_time': 0x11
+        'get_device_info': 0x10
+        , 'set_time': 0x11
         , 'get_time': 0x12
         , 'start': 0x13
         , 'get_recording_time_settings': 0x14
@@ -122,7 +80,8 @@ class TSND151:
         , 'set_quaternion_interval': 0x55
     }
 
-    def __init__(self, response_wait_timeout=5, auto_recovery=True, response_wait_auto_recovery_limit=5):
+    def __init__(self, response_wait_timeout=5, auto_recovery=True, response_wait_auto_recovery_limit=5,
+                 rearm_on_recovery=False):
         """**Use TSND151.open instead of this**
 
         Do not use it directory.
@@ -136,6 +95,9 @@ class TSND151:
         auto_recovery: bool
             If True, it will try to recover from serial connection error.
 
+        rearm_on_recovery: bool
+            If True, the device is re-armed after a recovery, see rearm.
+
         """
 
         self.response_wait_timeout = response_wait_timeout
@@ -143,6 +105,27 @@ class TSND151:
         self._recovered = False
         self._serial_property = {}
         self._recording_start_time = None
+        self._applied_settings = {}
+        self._capture = None
+        self._continuity = None
+        self._tracer = None
+        self._feed_traced = False  # feed_bytes is traced in the pass sampled by read_available
+        self.recovery_count = 0
+        self.recovery_sec = 0.0
+        self._recovery_started = None  # time.monotonic() when the connection is lost
+        self._reconnect_delay = self._RECONNECT_MIN_SEC_
+        self.rearm_on_recovery = rearm_on_recovery
+        self.rearm_count = 0
+        self.last_gap_sec = None  # of the last lost connection, up to the restart of recording if re-armed
+        self._last_rearm = None
+        self._time_synced = False  # set_time succeeded with the host clock
+        self._lost_at = None  # time.monotonic() when the connection is lost, kept until it is re-armed
+        self._recording_at_loss = False
+        self._rearm_thread = None
+        self._rearm_requested = False
+        self._frame_counts = {}  # response code -> number of frames
+        self._latency = {}  # response code -> Histogram of sec from a command to its response
+        self._subscriptions = {}  # response code -> list of tsnd.subscription.Subscription
         self._response_wait_auto_recovery_limit = response_wait_auto_recovery_limit
 
         self.serial = None
@@ -159,20 +142,113 @@ class TSND151:
             , self._RESPONSE_CODE_MAP_['acc_range']: Queue()
             , self._RESPONSE_CODE_MAP_['time']: Queue()
             , self._RESPONSE_CODE_MAP_['option_button_behavior']: Queue()
+            , self._RESPONSE_CODE_MAP_['device_info']: Queue()
         }
 
-        self.serial_lock = RLock()
+        self.serial_lock = MeteredLock()  # guards the serial object and writes. Reads do not hold it.
+        self._write_queue = Queue()  # (frame, future of the write, perf_counter_ns() if traced), or None to stop
+        self._writer_thread = None  # None: send writes in the calling thread
         self.__close = False
         self.sensor_to_local_time_gap_in_microsecond = 0
+        self._frame_decoder = FrameDecoder(self._RESPONSE_ARG_LEN_MAP_, self._START_BIT_)
         self._read_response_thread = ReusableLoopThread(self._in_loop_read_response)
+        self._reader_thread_started = False  # False if frames are read by others, e.g., TSND151Hub
         self._recording_will_stop_at = None
+        self._mode = (None, 0.0)  # (tracked mode or None if unknown, monotonic time updated)
+        self._mode_event_codes = {self._RESPONSE_CODE_MAP_['mode'], self._RESPONSE_CODE_MAP_['start_recording'],
+                                  self._RESPONSE_CODE_MAP_['stop_recording']}
+        self._pings = []  # futures of pings not replied
+        self._waiters = {}  # response code -> deque of futures, in the sent order
+        self._waiters_lock = Lock()
+        self._request_lock = RLock()  # keeps the order of futures same as the sent order
 
         self.wait_sec_on_auto_close_for_stability = 0.2
+        self.mode_max_age_sec = self._MODE_MAX_AGE_SEC_
 
     @property
     def recording_start_time(self):
         return self._recording_start_time
 
+    @property
+    def port(self):
+        """Path to the serial port, or the serial-like object given to open."""
+        return self._serial_property.get('port')
+
+    @property
+    def read_timeout(self):
+        """Sec without any data to regard the connection as lost while recording, timeout_sec of open."""
+        return self._serial_property['timeout']
+
+    @property
+    def reader_thread_started(self):
+        """False if frames are read by others with read_available and feed_bytes, e.g., TSND151Hub."""
+        return self._reader_thread_started
+
+    def stats(self):
+        """Snapshot of the runtime metrics, see tsnd.metrics.
+
+        Returns
+        -------
+        dict
+            port: str
+            connected: bool
+            mode: int or None, tracked mode
+            bytes_read: int
+            frames: {response code name: number of frames}
+            bcc_errors, invalid_codes, skipped_bytes, resyncs: int, by the frame decoder
+            queue_depths: {response code name: number of responses in the queue}
+            queue_overflows: {response code name: responses dropped}, of bounded queues, e.g., BoundedQueue
+            pending_requests: int
+            serial_lock: {'waits', 'wait_sec', 'max_wait_sec'} of contended acquires, and {'holds', 'hold_sec', 'max_hold_sec'}
+            write_queue: int, commands waiting for the writer thread
+            recoveries: int
+            recovering: bool
+            recovery_sec: float, total time from a lost connection to its reopening
+            rearms: int, re-arms done after recoveries, see rearm
+            last_gap_sec: float or None, see last_gap_sec
+            command_latency: {response code name: {'count', 'sum', 'buckets'}}, see tsnd.metrics.Histogram
+            subscriptions: {response code name: [Subscription.stats()]}, see subscribe
+
+        """
+        def name_of(code):
+            return self._RESPONSE_NAME_MAP_.get(code, code.hex())
+
+        decoder = self._frame_decoder
+        recovery_sec = self.recovery_sec
+        recovery_started = self._recovery_started
+        if recovery_started is not None:
+            recovery_sec += time.monotonic() - recovery_started
+        with self._waiters_lock:
+            pending = sum(len(waiters) for waiters in self._waiters.values())
+        serial_ = self.serial  # not under serial_lock, which a write may hold
+
+        return {
+            'port': self._serial_property.get('port')
+            , 'connected': serial_ is not None and serial_.is_open
+            , 'mode': self.cached_mode
+            , 'bytes_read': decoder.byte_count
+            , 'frames': {name_of(code): n for code, n in list(self._frame_counts.items())}
+            , 'bcc_errors': decoder.bcc_error_count
+            , 'invalid_codes': decoder.invalid_code_count
+            , 'skipped_bytes': decoder.skipped_byte_count
+            , 'resyncs': decoder.resync_count
+            , 'queue_depths': {name_of(code): q.qsize() for code, q in list(self._response_queue_map.items())
+                               if hasattr(q, 'qsize')}
+            , 'queue_overflows': {name_of(code): q.overflow_count for code, q in list(self._response_queue_map.items())
+                                  if hasattr(q, 'overflow_count')}
+            , 'pending_requests': pending
+            , 'serial_lock': self.serial_lock.snapshot()
+            , 'write_queue': self._write_queue.qsize()
+            , 'recoveries': self.recovery_count
+            , 'recovering': recovery_started is not None
+            , 'recovery_sec': recovery_sec
+            , 'rearms': self.rearm_count
+            , 'last_gap_sec': self.last_gap_sec
+            , 'command_latency': {name_of(code): hist.snapshot() for code, hist in list(self._latency.items())}
+            , 'subscriptions': {name_of(code): [sub.stats() for sub in subs]
+                                for code, subs in list(self._subscriptions.items()) if len(subs) > 0}
+        }
+
     @property
     def auto_recovery(self):
         return self._auto_recovery
@@ -181,6 +257,55 @@ class TSND151:
     def recovered(self):
         return self._recovered
 
+    @property
+    def last_rearm(self):
+        """Result of the last rearm as a dict, or None if not re-armed yet.
+
+        mode: mode found after the reopening, recording_at_loss: bool, applied: report of configure,
+        restarted: bool, recording restarted, gap_sec: float
+        """
+        return None if self._last_rearm is None else dict(self._last_rearm)
+
+    @property
+    def cached_mode(self):
+        """Mode tracked locally, or None if it is unknown or stale. See get_mode for values."""
+        mode, updated_at = self._mode
+        if mode is None or time.monotonic() - updated_at > self.mode_max_age_sec:
+            return None
+        return mode
+
+    @property
+    def applied_settings(self):
+        """Settings applied successfully by setters, as {setter name: kwargs}."""
+        return {k: dict(v) for k, v in self._applied_settings.items()}
+
+    def _remember_setting(self, setter_name, success, **kwargs):
+        if success:
+            self._applied_settings[setter_name] = kwargs
+        return success
+
+    def set_continuity_tracker(self, tracker):
+        """Set a tracker observing every received frame, e.g., tsnd.continuity.ContinuityTracker.
+
+        Parameters
+        ----------
+        tracker: object having observe(cmd, args), mark_reconnect(gap_sec) and mark_rearm(gap_sec, restarted),
+                 or None to stop
+
+        """
+        self._continuity = tracker
+
+    def set_tracer(self, tracer):
+        """Set a tracer timing the stages of the reader loop and the command path.
+
+        Parameters
+        ----------
+        tracer: tsnd.tracing.Tracer or None to stop
+            Any object having sample() and record(stage, start_ns, end_ns, args) can be used.
+
+        """
+        self._tracer = tracer
+
     def set_response_queue(self, resp_code, q):
         """Set a queue to store responses from the sensor with specified code.
 
@@ -191,6 +316,7 @@ class TSND151:
         resp_code: string
             Please use a key of self._RESPONSE_CODE_MAP_.
         q: queue. or None to stop store response
+            Any object having put(), e.g., tsnd.ring_buffer.RingBufferSink, can be used.
 
         Raises
         ------
@@ -203,16 +329,130 @@ class TSND151:
 
         self._response_queue_map[TSND151._RESPONSE_CODE_MAP_[resp_code]] = q
 
+    def set_queue_limit(self, resp_code, capacity, policy='drop_oldest', **kwargs):
+        """Set a tsnd.bounded_queue.BoundedQueue as the response queue of resp_code.
+
+        Responses to commands are never dropped, so only the 'spill' policy is allowed for
+        them. 'block' would stall the reader thread which completes the requests.
+
+        Parameters
+        ----------
+        resp_code: string
+            Please use a key of self._RESPONSE_CODE_MAP_.
+        capacity: int
+            max number of responses kept in memory
+        policy: str
+            'drop_oldest', 'drop_newest', 'block' or 'spill'
+        kwargs:
+            passed to BoundedQueue, e.g., high_water, on_high_water, block_timeout, spill_dir
+
+        Returns
+        -------
+        BoundedQueue
+
+        Raises
+        ------
+        ValueError
+            If resp_code is not in self._RESPONSE_CODE_MAP_, or the policy may drop or block responses to commands.
+
+        """
+        if resp_code not in TSND151._RESPONSE_CODE_MAP_:
+            raise ValueError("Invalid response code")
+        if resp_code not in self._STREAM_CODE_NAMES_ and policy != 'spill':
+            raise ValueError(f"Only 'spill' is allowed for responses to commands: {resp_code}")
+
+        q = BoundedQueue(capacity, policy, **kwargs)
+        self.set_response_queue(resp_code, q)
+        return q
+
+    def subscribe(self, resp_code, callback, batch_size=100, max_latency=0.05, executor=None, **kwargs):
+        """Deliver decoded batches of a stream to callback on an executor, see tsnd.subscription.
+
+        The reader thread only appends payloads to the pending batch, so a slow callback
+        never blocks it. A queue already set to resp_code keeps receiving responses.
+
+        Parameters
+        ----------
+        resp_code: string
+            one of self._STREAM_CODE_NAMES_
+        callback: callable
+            called with a structured array of tsnd.batch_decoder
+        batch_size: int
+            max number of records in a batch
+        max_latency: int, float
+            max sec from the arrival of a record to the cut of its batch
+        executor: concurrent.futures.Executor or None
+            thread or process pool to run callback. If None, a thread pool shared by subscriptions.
+        kwargs:
+            passed to Subscription, e.g., max_pending_batches, decode
+
+        Returns
+        -------
+        Subscription
+            having stats() of the lag and drops
+
+        Raises
+        ------
+        ValueError
+            If resp_code is not a stream.
+
+        """
+        from tsnd.subscription import Fanout, Subscription  # NumPy is required for it
+
+        if resp_code not in self._STREAM_CODE_NAMES_:
+            raise ValueError(f"Only streams can be subscribed: {resp_code}")
+
+        code = TSND151._RESPONSE_CODE_MAP_[resp_code]
+        sub = Subscription(code, callback, batch_size, max_latency, executor, **kwargs)
+        sink = self._response_queue_map.get(code)
+        if isinstance(sink, Fanout):
+            sink.sinks = sink.sinks + [sub]  # replaced, not mutated, for the reader thread
+        else:
+            self._response_queue_map[code] = Fanout([sub] if sink is None else [sink, sub])
+        self._subscriptions[code] = self._subscriptions.get(code, []) + [sub]
+        return sub
+
+    def unsubscribe(self, sub, timeout=None):
+        """Stop a subscription, and wait the delivery of the records received.
+
+        Parameters
+        ----------
+        sub: Subscription
+            returned by subscribe
+        timeout: int, float or None
+            max sec to wait the delivery. None waits until all are delivered.
+
+        Returns
+        -------
+        bool
+            True if all batches are delivered
+
+        """
+        subs = self._subscriptions.get(sub.code, [])
+        if sub in subs:
+            self._subscriptions[sub.code] = [s for s in subs if s is not sub]
+            fanout = self._response_queue_map.get(sub.code)
+            sinks = [s for s in getattr(fanout, 'sinks', [fanout]) if s is not sub]
+            if not hasattr(fanout, 'sinks'):
+                pass  # replaced by set_response_queue
+            elif len(sinks) == 0:
+                self._response_queue_map[sub.code] = None
+            elif len(sinks) == 1 and sinks[0] not in self._subscriptions[sub.code]:
+                self._response_queue_map[sub.code] = sinks[0]  # the queue set before subscribe
+            else:
+                fanout.sinks = sinks
+        return sub.close(timeout)
+
     def get_response_queue(self, resp_code):
         if resp_code not in TSND151._RESPONSE_CODE_MAP_:
             raise ValueError("Invalid response code")
 
-        return self._response_queue_map[TSND151._RESPONSE_CODE_MAP_[resp_code]]
+        return self._response_queue_map.get(TSND151._RESPONSE_CODE_MAP_[resp_code])
 
     def clear_all_queue(self):
         """Drop all response already received."""
         for q in self._response_queue_map.values():
-            if q is not None:
+            if q is not None and hasattr(q, 'empty'):  # subscriptions deliver all
                 while not q.empty():
                     q.get()
 
@@ -231,11 +471,35 @@ class TSND151:
              , baudrate=115200
              , wait_sec_on_open_for_stability=2
              , wait_sec_on_auto_close_for_stability=2
-             , response_wait_timeout=5):
-        tsnd151 = TSND151(response_wait_timeout=response_wait_timeout)
+             , response_wait_timeout=5
+             , capture_path=None
+             , start_reader_thread=True
+             , rearm_on_recovery=False):
+        """Open a TSND151.
+
+        Parameters
+        ----------
+        path_to_serial_port: str or serial-like object
+            path to the serial port, or an object having read/write/in_waiting/is_open/close
+            like serial.Serial, e.g., tsnd.replay.ReplaySerial
+        timeout_sec: int, float
+            timeout to detect a lost connection while recording
+        capture_path: str or None
+            If set, the raw byte stream is captured to the file (see tsnd.replay).
+        start_reader_thread: bool
+            If False, the reader thread is not started and frames have to be read
+            by others, e.g., tsnd.hub.TSND151Hub.
+        rearm_on_recovery: bool
+            If True, the device is re-armed after a recovery of a lost connection, i.e.,
+            the settings are re-applied and recording is restarted if the device stopped. See rearm.
+
+        """
+        tsnd151 = TSND151(response_wait_timeout=response_wait_timeout, rearm_on_recovery=rearm_on_recovery)
         tsnd151._serial_property['port'] = path_to_serial_port
         tsnd151._serial_property['baudrate'] = baudrate
         tsnd151._serial_property['timeout'] = timeout_sec
+        if capture_path is not None:
+            tsnd151._capture = CaptureWriter(capture_path)
 
         with tsnd151.serial_lock:
             tsnd151.__close = False
@@ -243,7 +507,10 @@ class TSND151:
             tsnd151.wait_sec_on_auto_close_for_stability = wait_sec_on_auto_close_for_stability
             time.sleep(wait_sec_on_open_for_stability)
 
-        tsnd151._read_response_thread.start()
+        tsnd151._start_writer()
+        if start_reader_thread:
+            tsnd151._read_response_thread.start()
+            tsnd151._reader_thread_started = True
 
         return tsnd151
 
@@ -252,13 +519,18 @@ class TSND151:
 
         with self.serial_lock:
             if self.is_serial_ready():
-                self.serial.close()
-                del self.serial
+                serial_, self.serial = self.serial, None  # the reader sees None, not a closed port
+                serial_.close()
                 time.sleep(wait_sec_for_stability)
-                self.serial = None
 
-        self._read_response_thread.stop()
+        if self._reader_thread_started:
+            self._read_response_thread.stop()
+        self._stop_writer()
 
+        self._fail_requests(IOError("Serial is closed"))
+
+        if self._capture is not None:
+            self._capture.close()
 
 
     def is_closed(self):
@@ -276,19 +548,20 @@ class TSND151:
     def read(self, num=1, ping_check_interval = 2):
         res = b''
 
-        last_read_time = datetime.datetime.now()
+        last_read_time = last_ping_time = datetime.datetime.now()
 
         while len(res) < num and not self.is_closed():
-            with self.serial_lock:
-                if not self.is_serial_ready():
-                    raise IOError("Serial is not ready")
-                _b = self.serial.read(num - len(res)) # it return silently when timed out
+            _b = self._read_serial(num - len(res))  # it return silently when timed out
 
             if len(_b) == 0:
+                now = datetime.datetime.now()
                 if self.is_recording():
-                    if (datetime.datetime.now() - last_read_time).total_seconds() > self._serial_property['timeout']:
+                    if (now - last_read_time).total_seconds() > self._serial_property['timeout']:
                         raise TimeoutError()
-                elif (datetime.datetime.now() - last_read_time).total_seconds() > ping_check_interval:
+                elif ((now - last_read_time).total_seconds() > ping_check_interval
+                      and (now - last_ping_time).total_seconds() > ping_check_interval
+                      and self.cached_mode is None):
+                    last_ping_time = now
                     self._ping()
             else:
                 last_read_time = datetime.datetime.now()
@@ -300,6 +573,16 @@ class TSND151:
         return res
 
     def read_response(self):
+        tracer = self._tracer
+        if tracer is not None and tracer.sample():
+            start = time.perf_counter_ns()
+            try:
+                return self._read_response()
+            finally:
+                tracer.record('read_response', start, time.perf_counter_ns())
+        return self._read_response()
+
+    def _read_response(self):
         while not self.is_closed():
             b = self.read()
             if b == self._START_BIT_:
@@ -320,8 +603,191 @@ class TSND151:
 
         return cmd, args
 
+    def read_frames(self, ping_check_interval=2):
+        """Read all frames available on the serial port at once.
+
+        It drains whatever the serial port holds into the frame decoder
+        instead of reading byte by byte, and blocks until at least one
+        complete frame is decoded.
+
+        Parameters
+        ----------
+        ping_check_interval: int, float
+            interval in sec to ping the sensor while no data is received and the tracked mode is stale
+
+        Returns
+        -------
+        list
+            list of (cmd, args) as (bytes, bytes), in received order
+
+        """
+        return self._read_frames(ping_check_interval)
+
+    def _read_frames(self, ping_check_interval=2, tracer=None):
+        """read_frames timing 'read' and 'decode' by tracer, if given."""
+        last_read_time = last_ping_time = datetime.datetime.now()
+
+        while not self.is_closed():
+            if tracer is not None:
+                start = time.perf_counter_ns()
+            _b = self._read_serial(None)  # it return silently when timed out
+            if tracer is not None:
+                read_end = time.perf_counter_ns()
+
+            if len(_b) == 0:
+                if tracer is not None:
+                    tracer.record('read', start, read_end, {'bytes': 0})
+                now = datetime.datetime.now()
+                if self.is_recording():
+                    if (now - last_read_time).total_seconds() > self._serial_property['timeout']:
+                        raise TimeoutError()
+                elif ((now - last_read_time).total_seconds() > ping_check_interval
+                      and (now - last_ping_time).total_seconds() > ping_check_interval
+                      and self.cached_mode is None):
+                    last_ping_time = now
+                    self._ping()
+            else:
+                last_read_time = datetime.datetime.now()
+                frames = self._frame_decoder.feed(_b)
+                if tracer is not None:
+                    decode_end = time.perf_counter_ns()
+                    tracer.record('read', start, read_end, {'bytes': len(_b)})
+                    tracer.record('decode', read_end, decode_end, {'frames': len(frames)})
+                if len(frames) > 0:
+                    return frames
+
+        raise IOError("Serial is closed")
+
+    def _read_serial(self, num):
+        """Read num bytes, or the bytes waiting (at least 1) if num is None, without serial_lock.
+
+        A read blocks up to the timeout of the port, so holding the lock would make
+        commands wait behind it. Reads and writes of a serial port can run at once.
+        """
+        serial_ = self.serial
+        if serial_ is None or not serial_.is_open:
+            raise IOError("Serial is not ready")
+        try:
+            if num is None:
+                waiting = serial_.in_waiting
+                num = waiting if waiting > 0 else 1
+            return serial_.read(num)
+        except Exception as e:
+            if serial_ is not self.serial or not serial_.is_open:  # closed by close or recovery while reading
+                raise IOError(f"Serial is closed while reading. cause: {e}")
+            raise
+
+    def read_available(self):
+        """Read the bytes waiting on the serial port (at least 1), without serial_lock.
+
+        It is for readers other than the reader thread, e.g., tsnd.hub.TSND151Hub.
+        It returns b'' when the port timed out. Pass the bytes to feed_bytes.
+        """
+        tracer = self._tracer
+        if tracer is not None and tracer.sample():
+            start = time.perf_counter_ns()
+            data = self._read_serial(None)
+            tracer.record('read', start, time.perf_counter_ns(), {'bytes': len(data)})
+            self._feed_traced = len(data) > 0
+            return data
+        return self._read_serial(None)
+
+    def feed_bytes(self, data):
+        """Decode bytes got by read_available and dispatch the frames to the requests and response queues.
+
+        Returns
+        -------
+        int
+            number of the decoded frames
+
+        """
+        tracer = self._tracer
+        if tracer is not None and self._feed_traced:
+            self._feed_traced = False
+            start = time.perf_counter_ns()
+            frames = self._frame_decoder.feed(data)
+            decode_end = time.perf_counter_ns()
+            self._dispatch_frames(frames)
+            tracer.record('decode', start, decode_end, {'frames': len(frames)})
+            tracer.record('dispatch', decode_end, time.perf_counter_ns(), {'frames': len(frames)})
+            return len(frames)
+
+        frames = self._frame_decoder.feed(data)
+        self._dispatch_frames(frames)
+        return len(frames)
+
+    def _dispatch_frames(self, frames):
+        """Put decoded frames into the response queues."""
+        queue_map = self._response_queue_map
+        mode_event_codes = self._mode_event_codes
+        waiters_map = self._waiters
+        tracker = self._continuity
+        frame_counts = self._frame_counts
+        for cmd, args in frames:
+            frame_counts[cmd] = frame_counts.get(cmd, 0) + 1
+            if tracker is not None:
+                tracker.observe(cmd, args)
+            if cmd in mode_event_codes:
+                self._track_mode(cmd, args)
+            waiters = waiters_map.get(cmd)
+            if waiters and self._complete(waiters, args):
+                continue
+            q = queue_map.get(cmd)
+            if q is not None:
+                q.put(args)
+
+    def _complete(self, waiters, args):
+        """Complete the oldest future waiting the response. Return False if no future is waiting."""
+        now = time.monotonic()
+        with self._waiters_lock:
+            # responses come in the order of requests. A reply for a timed out or cancelled request is dropped.
+            while True:
+                if len(waiters) == 0:
+                    return False
+                fut = waiters.popleft()
+                # not set yet if it is being cancelled by a caller, whose done callback has not run
+                if not fut.cancelled() or now < getattr(fut, 'drop_response_until', now + self._LATE_RESPONSE_SEC_):
+                    break
+
+        if fut.set_running_or_notify_cancel():
+            hist = self._latency.get(fut.code)
+            if hist is None:
+                hist = self._latency[fut.code] = Histogram()
+            hist.observe(now - fut.sent_at)
+            fut.set_result(args)
+        return True
+
+    def _track_mode(self, cmd, args):
+        """Update the tracked mode by a mode reply or a start/stop notification.
+
+        The notifications are sent also on start/stop by the option button.
+        Bit 0 of the mode is recording (see get_mode).
+        """
+        mode = self._mode[0]
+        if cmd == self._RESPONSE_CODE_MAP_['mode']:
+            self._set_mode(args[0])
+        elif cmd == self._RESPONSE_CODE_MAP_['start_recording']:
+            self._set_mode(3 if mode is None else mode | 1)
+            if self._recording_will_stop_at is None:  # e.g., started by the option button
+                self._recording_will_stop_at = datetime.datetime(9999, 1, 1, 0, 0, 0)
+        else:
+            self._set_mode(2 if mode is None else mode & ~1)
+            self._recording_will_stop_at = None
+
+    def _set_mode(self, mode):
+        self._mode = (mode, time.monotonic())
+
+    def _invalidate_mode(self):
+        """Forget the tracked mode, e.g., when a command failed or the connection is recovered."""
+        self._mode = (None, 0.0)
 
     def _open_serial(self, open_timeout=5):
+        port = self._serial_property['port']
+        if not isinstance(port, str):
+            # serial-like transport given to open
+            if not port.is_open and hasattr(port, 'open'):
+                port.open()
+            return port if self._capture is None else CaptureSerial(port, self._capture)
 
         q = Queue()
 
@@ -329,7 +795,7 @@ class TSND151:
             s = serial.Serial(port=self._serial_property['port'], 
                               baudrate=self._serial_property['baudrate'], 
                               timeout=0.01) # 10 msec, it is just a check interval.
-            q.put(s)
+            q.put(s if self._capture is None else CaptureSerial(s, self._capture))
             time.sleep(open_timeout)
             if not q.empty(): # timed out while open. the base thread going to other operations.
                 try:
@@ -356,11 +822,14 @@ class TSND151:
 
         error = None
         try:
-            cmd, args = self.read_response()
-            if cmd in self._response_queue_map:
-                q = self._response_queue_map[cmd]
-                if q is not None:
-                    q.put(args)
+            tracer = self._tracer
+            if tracer is not None and tracer.sample():
+                frames = self._read_frames(tracer=tracer)
+                start = time.perf_counter_ns()
+                self._dispatch_frames(frames)
+                tracer.record('dispatch', start, time.perf_counter_ns(), {'frames': len(frames)})
+            else:
+                self._dispatch_frames(self._read_frames())
 
         except serial.SerialException as e:
             error = e
@@ -379,7 +848,7 @@ class TSND151:
             if self.auto_recovery:
                 if datetime.datetime.now().microsecond % 10 == 0:
                     self._LOGGER_.warning(f'Auto recovery will be done. {error}')
-                time.sleep(0.1)
+                time.sleep(self.next_reconnect_delay())
             else:
                 raise error
 
@@ -388,11 +857,21 @@ class TSND151:
             error = None  # pass
         elif self.auto_recovery:
                 # recovery
+            cause = error
             error = None
             self._recovered = True
+            self._invalidate_mode()  # notifications may be lost while disconnected
+            self._fail_requests(IOError("Connection is recovered before the response"))
 
             with self.serial_lock:
                 if self.is_serial_ready():
+                    # counted once per lost connection, not per retry of reopening
+                    self.recovery_count += 1
+                    self._recovery_started = time.monotonic()
+                    if self._lost_at is None:  # not again while re-arming, which may have changed the state
+                        self._lost_at = self._recovery_started
+                        self._recording_at_loss = self.is_recording()
+                    self._LOGGER_.warning(f'Connection is lost, reopening. cause: {cause}')
                     try:
                         self.serial.close()
                         time.sleep(0.1)
@@ -401,10 +880,10 @@ class TSND151:
                     except IOError as e:
                         self._LOGGER_.warning(f'Serial can not be closed on auto recovery. cause: {e}')
                     finally:
-                        del self.serial
                         self.serial = None
 
                 try:
+                    self._frame_decoder.reset()
                     self.serial = self._open_serial()
                 except serial.SerialException as e:
                     error = e
@@ -412,11 +891,263 @@ class TSND151:
                     error = e
                 except IOError as e:
                     error = e
-        
+
+            if error is None and self._recovery_started is not None:
+                gap_sec = time.monotonic() - self._recovery_started
+                self.recovery_sec += gap_sec
+                self.last_gap_sec = gap_sec
+                self._recovery_started = None
+                self._reconnect_delay = self._RECONNECT_MIN_SEC_
+                if self._continuity is not None:
+                    self._continuity.mark_reconnect(gap_sec)
+                if self.rearm_on_recovery:
+                    self._start_rearm()
+                else:
+                    self._lost_at = None
+
         return error
 
+    def next_reconnect_delay(self):
+        """Wait before the next reopening, doubled per failure up to _RECONNECT_MAX_SEC_."""
+        delay = self._reconnect_delay
+        self._reconnect_delay = min(delay * 2, self._RECONNECT_MAX_SEC_)
+        return delay
+
+    def _start_rearm(self):
+        """Re-arm in another thread, since the reader thread has to read the responses."""
+        self._rearm_requested = True
+        if self._rearm_thread is not None and self._rearm_thread.is_alive():
+            return  # the running one re-arms again
+        self._rearm_thread = Thread(target=self._in_thread_rearm, daemon=True, name='tsnd151_rearm')
+        self._rearm_thread.start()
+
+    def _in_thread_rearm(self):
+        delay = self._LATE_RESPONSE_SEC_  # else the reply to a retry is dropped as the late one of the timed out query
+        while self._rearm_requested and not self.is_closed():
+            self._rearm_requested = False
+            try:
+                self.rearm()
+            except TimeoutError as e:  # e.g., the device is still out of range
+                self._LOGGER_.info(f'Re-arm will be retried in {delay} sec. cause: {e}')
+                self._rearm_requested = True
+                time.sleep(delay)
+                delay = min(delay * 2, self._RECONNECT_MAX_SEC_)
+            except (IOError, serial.SerialException) as e:  # lost again, and requested again by the recovery
+                self._LOGGER_.warning(f'Re-arm failed. cause: {e}')
+
+    def rearm(self):
+        """Restore the state of the device lost with the connection.
+
+        It checks the mode first. A device still recording is left as it is.
+        A device in the command mode, e.g., stopped by the option button or
+        turned off, gets the settings applied before (see applied_settings)
+        and recording is restarted if it was recording when the connection was
+        lost. Settings which can be read from the device (option button and
+        overwrite protection) are re-applied only if they differ, and the time
+        only if it was set with the host clock and the device clock is off by
+        more than _REARM_TIME_TOLERANCE_SEC_. The others can not be read, so
+        they are re-applied by configure.
+
+        It is called in a thread after a recovery if rearm_on_recovery is True,
+        and retried with a backoff until the device replies the mode. The gap,
+        from the lost connection to the reply (or to the restart of recording),
+        is kept as last_gap_sec and given to the continuity tracker by mark_rearm.
+
+        Returns
+        -------
+        dict
+            see last_rearm
+
+        Raises
+        ------
+        TimeoutError
+            If a response is not received.
+        IOError
+            If the connection is lost again.
+
+        """
+        lost_at = self._lost_at
+        mode = self._get_mode(self._REARM_MODE_TIMEOUT_SEC_)
+        report = {}
+        restarted = False
+        if (mode & 1) == 0:
+            self._recording_will_stop_at = None  # else the silence is regarded as a lost connection
+            report = self.configure(self._rearm_commands())
+            if self._recording_at_loss:
+                self.start_recording()
+                restarted = True
+                self._recovered = True  # start_recording clears it, but the data has a gap
+        elif not self.is_recording():  # e.g., started by the option button while disconnected
+            self._recording_will_stop_at = datetime.datetime(9999, 1, 1, 0, 0, 0)
+
+        gap_sec = self.last_gap_sec
+        if lost_at is not None:
+            gap_sec = self.last_gap_sec = time.monotonic() - lost_at
+            self._lost_at = None
+        self.rearm_count += 1
+        self._last_rearm = {
+            'mode': mode
+            , 'recording_at_loss': self._recording_at_loss
+            , 'applied': report
+            , 'restarted': restarted
+            , 'gap_sec': gap_sec
+        }
+        self._LOGGER_.warning(f'Re-armed after a recovery. mode: {mode}, applied: {list(report)}, '
+                              f'restarted: {restarted}, gap: {gap_sec} sec')
+        if self._continuity is not None:
+            self._continuity.mark_rearm(gap_sec, restarted)
+        return self.last_rearm
+
+    def _rearm_commands(self):
+        """Settings to re-apply, as (setter name, kwargs) in the order of DeviceSettings."""
+        applied = self._applied_settings
+        commands = []
+        if self._time_synced:
+            device_time = self.get_time()
+            if (device_time is None or abs((device_time - datetime.datetime.now()).total_seconds())
+                    > self._REARM_TIME_TOLERANCE_SEC_):
+                commands.append(('set_time', {'dt': None}))
+
+        for field, setter_name, arg_names in DeviceSettings._FIELDS_:
+            kwargs = applied.get(setter_name)
+            if kwargs is None:
+                continue
+            if setter_name == 'set_option_button_behavior' and int(self.get_option_button_behavior()) == kwargs['mode']:
+                continue
+            if (setter_name == 'set_overwrite_protection'
+                    and self.get_overwrite_protection() == bool(kwargs.get('enable', False))):
+                continue
+            commands.append((setter_name, dict(kwargs)))
+        return commands
+
 
     def send(self, cmd, args=(0x00,)):
+        """Write a command. With the writer thread, it is queued and this waits until it is written.
+
+        Raises
+        ------
+        IOError
+            If the serial is not ready.
+        TimeoutError
+            If the writer does not write it in response_wait_timeout.
+
+        """
+        self._wait_written(self._send_async(cmd, args))
+
+    def _send_async(self, cmd, args):
+        """Queue a command to the writer thread, and return a future of the write.
+
+        Without the writer thread, it writes the command and returns None.
+        """
+        tracer = self._tracer
+        traced = tracer is not None and tracer.sample()
+        if self._writer_thread is None:
+            if traced:
+                self._send_traced(tracer, cmd, args)
+            else:
+                self._write_direct(cmd, args)
+            return None
+
+        if traced:
+            start = time.perf_counter_ns()
+            frame = bytes(self.build_cmd(cmd, args))
+            built = time.perf_counter_ns()
+            tracer.record('build_cmd', start, built, {'cmd': cmd})
+            return self._enqueue_write(frame, built)
+        return self._enqueue_write(bytes(self.build_cmd(cmd, args)))
+
+    def _enqueue_write(self, frame, queued_at=None):
+        written = futures.Future()
+        self._write_queue.put((frame, written, queued_at))
+        return written
+
+    def _wait_written(self, written):
+        """Wait the write of a queued command. On timeout, the command is cancelled if it is not being written."""
+        if written is None:
+            return
+        try:
+            written.result(self.response_wait_timeout)
+        except futures.TimeoutError:
+            written.cancel()  # fails if the writer has taken it, i.e., it is written anyway
+            raise TimeoutError("Command is not written in time")
+
+    def _start_writer(self):
+        if self._writer_thread is None:
+            self._writer_thread = Thread(target=self._write_loop, daemon=True, name='tsnd151_writer')
+            self._writer_thread.start()
+
+    def _stop_writer(self):
+        thread = self._writer_thread
+        if thread is not None:
+            self._writer_thread = None  # later sends write directly, and fail as the serial is closed
+            self._write_queue.put(None)
+            if thread is not current_thread():
+                thread.join(1)
+
+    def _write_loop(self):
+        """Write queued commands. Commands queued together are joined into one write."""
+        q = self._write_queue
+        stopping = False
+        while not stopping:
+            item = q.get()
+            if item is None:
+                break
+            items = [item]
+            while len(items) < self._MAX_WRITE_BATCH_:
+                try:
+                    item = q.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                items.append(item)
+
+            picked = time.perf_counter_ns()
+            try:
+                with self.serial_lock:
+                    locked = time.perf_counter_ns()
+                    # a command cancelled by the timeout of its sender is not written
+                    items = [item for item in items if item[1].set_running_or_notify_cancel()]
+                    if len(items) == 0:
+                        continue
+                    data = b''.join([frame for frame, written, queued_at in items])
+                    serial_ = self.serial
+                    if serial_ is None or not serial_.is_open:
+                        raise IOError("Serial is not ready")
+                    serial_.write(data)
+                    serial_.flush()
+            except Exception as e:  # the writer keeps running for the recovery
+                for frame, written, queued_at in items:
+                    written.set_exception(e)
+                continue
+            done = time.perf_counter_ns()
+
+            for frame, written, queued_at in items:
+                written.set_result(len(frame))
+            tracer = self._tracer
+            if tracer is not None:
+                for frame, written, queued_at in items:
+                    if queued_at is not None:
+                        tracer.record('queue_wait', queued_at, picked)
+                        tracer.record('lock_wait', picked, locked)
+                        tracer.record('write', locked, done, {'bytes': len(data), 'commands': len(items)})
+
+        for frame, written, queued_at in self._drain_write_queue():
+            if written.set_running_or_notify_cancel():
+                written.set_exception(IOError("Serial is closed"))
+
+    def _drain_write_queue(self):
+        items = []
+        while True:
+            try:
+                item = self._write_queue.get_nowait()
+            except Empty:
+                return items
+            if item is not None:
+                items.append(item)
+
+    def _write_direct(self, cmd, args):
         with self.serial_lock:
             if not self.is_serial_ready():
                 raise IOError("Serial is not ready")
@@ -424,6 +1155,22 @@ class TSND151:
             self.serial.write(self.build_cmd(cmd, args))
             self.serial.flush()
 
+    def _send_traced(self, tracer, cmd, args):
+        start = time.perf_counter_ns()
+        frame = self.build_cmd(cmd, args)
+        built = time.perf_counter_ns()
+        with self.serial_lock:
+            locked = time.perf_counter_ns()
+            if not self.is_serial_ready():
+                raise IOError("Serial is not ready")
+
+            self.serial.write(frame)
+            self.serial.flush()
+        written = time.perf_counter_ns()
+        tracer.record('build_cmd', start, built, {'cmd': cmd})
+        tracer.record('lock_wait', built, locked)
+        tracer.record('write', locked, written, {'cmd': cmd, 'bytes': len(frame)})
+
 
     @staticmethod
     def build_cmd(cmd_code, args):
@@ -443,10 +1190,168 @@ class TSND151:
         total_cmd.append(bcc)
         return total_cmd
 
+    def send_request(self, cmd_name, args=(0x00,), code_name='simple'):
+        """Send a command and return a future of its response.
+
+        The future is completed by the reader thread (or TSND151Hub) as soon as
+        the response arrives. Responses of a code are matched to requests in the
+        sent order, so concurrent callers never take each other's responses.
+        A response to a cancelled or timed-out request is dropped if it arrives
+        within _LATE_RESPONSE_SEC_, otherwise the response is regarded as lost.
+
+        Parameters
+        ----------
+        cmd_name: string
+            Please use a key of self._CMD_CODE_MAP_.
+        args: list
+            arguments of the command
+        code_name: string
+            code of the response. Please use a key of self._RESPONSE_CODE_MAP_.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            result() is the arguments of the response as bytes
+
+        """
+        with self._request_lock:  # queued in the order of the futures
+            fut = self._expect(code_name)
+            try:
+                written = self._send_async(self._CMD_CODE_MAP_[cmd_name], args)
+            except BaseException:
+                self._discard(fut)
+                raise
+        try:
+            self._wait_written(written)
+        except TimeoutError:
+            if written.cancelled():
+                self._discard(fut)  # never written
+            else:
+                self._cancel_request(fut)  # written late, so its response is dropped
+            raise
+        except BaseException:
+            self._discard(fut)
+            raise
+        return fut
+
+    def request(self, cmd_name, args=(0x00,), code_name='simple', timeout_sec=None):
+        """Send a command and wait its response. See send_request.
+
+        Raises
+        ------
+        TimeoutError
+            If the response does not arrive in timeout_sec (def: response_wait_timeout).
+        IOError
+            If the connection is closed or recovered before the response.
+
+        """
+        return self._wait(self.send_request(cmd_name, args, code_name), code_name, timeout_sec)
+
+    def wait_request(self, fut, timeout_sec=None):
+        """Wait the response of a future returned by send_request.
+
+        A timed out request is cancelled, and its late response is dropped (see send_request).
+
+        Returns
+        -------
+        bytes
+            arguments of the response
+
+        Raises
+        ------
+        TimeoutError
+            If the response does not arrive in timeout_sec (def: response_wait_timeout).
+        IOError
+            If the connection is closed or recovered before the response.
+
+        """
+        return self._wait(fut, self._RESPONSE_NAME_MAP_.get(fut.code, fut.code.hex()), timeout_sec)
+
+    def _send_request_with_notification(self, notification_name, cmd_name, args=(0x00,), code_name='simple'):
+        """send_request also expecting a notification following the response, e.g., start_recording.
+
+        Returns
+        -------
+        tuple
+            (future of the notification, future of the response)
+
+        """
+        with self._request_lock:
+            notified = self._expect(notification_name)
+            try:
+                return notified, self.send_request(cmd_name, args, code_name)
+            except BaseException:
+                self._discard(notified)
+                raise
+
+    def _expect(self, code_name):
+        """Register a future for the next response of code_name. Call it before sending."""
+        fut = futures.Future()
+        fut.add_done_callback(self._on_request_done)
+        code = self._RESPONSE_CODE_MAP_[code_name]
+        fut.code = code
+        fut.sent_at = time.monotonic()
+        with self._waiters_lock:
+            self._waiters.setdefault(code, deque()).append(fut)
+        return fut
+
+    def _on_request_done(self, fut):
+        if fut.cancelled() and not hasattr(fut, 'drop_response_until'):  # cancelled by a caller
+            fut.drop_response_until = time.monotonic() + self._LATE_RESPONSE_SEC_
+
+    def _cancel_request(self, fut):
+        """Cancel a future kept registered to drop its late response.
+
+        drop_response_until is set before the cancel, since the reader may see
+        the future cancelled before its done callbacks run.
+        """
+        fut.drop_response_until = time.monotonic() + self._LATE_RESPONSE_SEC_
+        fut.cancel()
+
+    def _discard(self, fut):
+        """Unregister a future whose response will never come, e.g., the command is rejected."""
+        self._cancel_request(fut)
+        with self._waiters_lock:
+            for waiters in self._waiters.values():
+                if fut in waiters:
+                    waiters.remove(fut)
+
+    def _wait(self, fut, code_name, timeout_sec=None):
+        tracer = self._tracer
+        if tracer is not None and tracer.sample():
+            start = time.perf_counter_ns()
+            try:
+                return self._wait_result(fut, code_name, timeout_sec)
+            finally:
+                tracer.record('wait', start, time.perf_counter_ns(), {'code': code_name})
+        return self._wait_result(fut, code_name, timeout_sec)
+
+    def _wait_result(self, fut, code_name, timeout_sec=None):
+        if timeout_sec is None:
+            timeout_sec = self.response_wait_timeout
+        try:
+            return fut.result(timeout_sec)
+        except futures.TimeoutError:
+            self._cancel_request(fut)  # kept registered to drop the late response
+            raise TimeoutError(f'Timeout occurred while waiting response for {code_name}')
+        except futures.CancelledError:
+            raise TimeoutError(f'Request for {code_name} is cancelled')
+
+    def _fail_requests(self, error):
+        with self._waiters_lock:
+            waiters = [fut for q in self._waiters.values() for fut in q]
+            self._waiters.clear()
+        for fut in waiters:
+            if fut.set_running_or_notify_cancel():
+                fut.set_exception(error)
+
     def wait_response(self, code_name, timeout_sec=None):
         """
         Waits for a response with the specified code from the response queue.
 
+        It gets only responses not matched to a request of send_request/request,
+        e.g., after send(). Please use request instead.
+
         Args:
             code_name (str): The name of the response code to wait for.
             timeout_sec (float, optional): The maximum time to wait for the response, in seconds.
@@ -461,7 +1366,16 @@ class TSND151:
             IOError: If the connection for TSND151 is lost.
 
         """
+        tracer = self._tracer
+        if tracer is not None and tracer.sample():
+            start = time.perf_counter_ns()
+            try:
+                return self._wait_response(code_name, timeout_sec)
+            finally:
+                tracer.record('wait', start, time.perf_counter_ns(), {'code': code_name})
+        return self._wait_response(code_name, timeout_sec)
 
+    def _wait_response(self, code_name, timeout_sec=None):
         if timeout_sec is None:
             timeout_sec = self.response_wait_timeout
 
@@ -472,7 +1386,7 @@ class TSND151:
         q = self._response_queue_map[code]
 
         wait_start = datetime.datetime.now()
-        while not self._read_response_thread.check_should_be_stop():
+        while not self._should_stop_waiting():
             try:
                 return q.get(timeout= min(timeout_sec, 0.1))  # 0.1 is a check interval
             except Empty:
@@ -480,34 +1394,41 @@ class TSND151:
                 if is_timed_out:
                     raise TimeoutError(f'Timeout occurred while waiting response for {code_name}')
 
+    def _should_stop_waiting(self):
+        if self._reader_thread_started:
+            return self._read_response_thread.check_should_be_stop()
+        return self.is_closed()
+
     def check_success(self):
         return self.wait_response('simple') == self._OK_BIT_
 
     def set_time(self, dt=None):
-        if dt is not None and not isinstance(dt, datetime.datetime):
-            raise ValueError('Invalid dt. type(dt) have to be datetime.datetime.')
-
-        if not self.check_is_cmd_mode():
-            return False
-
-        if dt is None:
-            dt = datetime.datetime.now()
-        msec = int(round(dt.microsecond / 1000)).to_bytes(2, "little", signed=False)
-        self.send(self._CMD_CODE_MAP_['set_time'], [
-            dt.year % 100, dt.month,
-            dt.day, dt.hour, dt.minute,
-            dt.second, msec[0], msec[1]])
-
-        return self.check_success()
+        return self._apply_setting('set_time', dt=dt)
 
     def get_time(self):
         if not self.check_is_cmd_mode():
             return None
 
-        self.send(self._CMD_CODE_MAP_['get_time'])
-        resp = self.wait_response('time')
+        resp = self.request('get_time', code_name='time')
         return self.parse_time(resp)
 
+    def get_device_info(self):
+        """Return the device information (0x90 response), see parse_device_info."""
+        return self.request('get_device_info', code_name='device_info')
+
+    @staticmethod
+    def parse_device_info(bytes_):
+        """Parse the device information.
+
+        Returns
+        -------
+        dict
+            serial_number: str, e.g., 'AP09181536', which identifies the device
+        """
+        return {
+            'serial_number': bytes_[0:10].rstrip(b'\x00').decode('ascii', errors='replace')
+        }
+
     def calc_sensor_time_gap_in_microsecond(self, loop_n=10):
         """Calculate time gap between the sensor and local
 
@@ -515,6 +1436,7 @@ class TSND151:
         calculate time gap as a mean of them.
         The calculated time gap is saved as tsnd151.sensor_to_local_time_gap_in_microsecond.
         So, local's time = tsnd151.sensor_to_local_time_gap_in_microsecond + sensor's time
+        See tsnd.clock.ClockSync for an estimate with drift and round trip filtering.
 
         Parameters
         ----------
@@ -541,7 +1463,10 @@ class TSND151:
         return self.sensor_to_local_time_gap_in_microsecond
 
     def check_is_cmd_mode(self, cannot_send_cmd_warn=True):
-        mode = self.get_mode()
+        """Check the mode by the tracked mode, or by get_mode if it is unknown or stale."""
+        mode = self.cached_mode
+        if mode is None:
+            mode = self.get_mode()
         is_cmd_mode = mode == 0 or mode == 2
         if cannot_send_cmd_warn and not is_cmd_mode:
             self._LOGGER_.warning('Mode is recording. Command cannot be sent.')
@@ -550,49 +1475,16 @@ class TSND151:
 
     def set_acc_range(self, g=4):
         """g: 2 or 4 or 8 or 16"""
-
-        if not self.check_is_cmd_mode():
-            return False
-
-        if g == 2:
-            flag = 0x00
-        elif g == 4:
-            flag = 0x01
-        elif g == 8:
-            flag = 0x02
-        elif g == 16:
-            flag = 0x03
-        else:
-            raise ValueError(f"Invalid acc range: (2,4,8,16) but {g}")
-
-        self.send(self._CMD_CODE_MAP_['set_acc_range'], [flag])
-        resp = self.wait_response('acc_range')
-        return resp[0] == flag
+        return self._apply_setting('set_acc_range', g=g)
 
     def set_gyro_range(self, dps=2000):
         """dps: 250, 500, 1000, 2000"""
-
-        if not self.check_is_cmd_mode():
-            return False
-
-        if dps == 250:
-            flag = 0x00
-        elif dps == 500:
-            flag = 0x01
-        elif dps == 1000:
-            flag = 0x02
-        elif dps == 2000:
-            flag = 0x03
-        else:
-            raise ValueError(f"Invalid gyro range: (250,500,1000,2000) but {dps}")
-
-        self.send(self._CMD_CODE_MAP_['set_gyro_range'], [flag])
-        return self.check_success()
+        return self._apply_setting('set_gyro_range', dps=dps)
 
     def set_quaternion_interval(self, interval_in_5ms_unit, avg_num_for_send=1, avg_num_for_save=0):
         """
         interval_in_5ms_unit: interval in 5 ms unit.
-                              0: off, on: 1-51 (means 5-255 ms interval) 
+                              0: off, on: 1-51 (means 5-255 ms interval)
         avg_num_for_send    : N of SMA for sending via Bluetooth. (def:1)
                               0: off (not send), enable: 1-255.
                               e.g., If it is 2 and interval is set 5 ms, data will be sent every 10 ms.
@@ -604,22 +1496,13 @@ class TSND151:
         NOTE1: +-2000 gyro range is forced.
         NOTE2: quaternion_acc_gyro_data response is used, no acc_gyro_data.
         """
-
-        check_range("interval_in_5ms_unit", interval_in_5ms_unit, 0, 51)
-        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
-        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
-
-        if not self.check_is_cmd_mode():
-            return False
-
-        self.send(self._CMD_CODE_MAP_['set_quaternion_interval'],
-                  [interval_in_5ms_unit * 5, avg_num_for_send, avg_num_for_save])
-        return self.check_success()
+        return self._apply_setting('set_quaternion_interval', interval_in_5ms_unit=interval_in_5ms_unit,
+                                   avg_num_for_send=avg_num_for_send, avg_num_for_save=avg_num_for_save)
 
     def set_acc_and_gyro_interval(self, interval_in_ms, avg_num_for_send=1, avg_num_for_save=0):
         """
         interval_in_ms   : interval in ms.
-                           0: off, on: 1-255 
+                           0: off, on: 1-255
         avg_num_for_send : N of SMA for sending via Bluetooth. (def:1)
                            0: off (not send), enable: 1-255.
                            e.g., If it is 2 and interval is set 5 ms, data will be sent every 10 ms.
@@ -627,21 +1510,13 @@ class TSND151:
                            0: off (not save), enable: 1-255.
                            e.g., If it is 2 and interval is set 5 ms, data will be saved every 10 ms.
         """
-        check_range("interval_in_ms", interval_in_ms, 0, 255)
-        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
-        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
-
-        if not self.check_is_cmd_mode():
-            return False
-
-        self.send(self._CMD_CODE_MAP_['set_acc_and_gyro_interval'],
-                  [interval_in_ms, avg_num_for_send, avg_num_for_save])
-        return self.check_success()
+        return self._apply_setting('set_acc_and_gyro_interval', interval_in_ms=interval_in_ms,
+                                   avg_num_for_send=avg_num_for_send, avg_num_for_save=avg_num_for_save)
 
     def set_magnetism_interval(self, interval_in_ms, avg_num_for_send=1, avg_num_for_save=0):
         """
         interval_in_ms   : interval in ms.
-                           0: off, on: 10-255 
+                           0: off, on: 10-255
         avg_num_for_send : N of SMA for sending via Bluetooth. (def:1)
                            0: off (not send), enable: 1-255.
                            e.g., If it is 2 and interval is set 5 ms, data will be sent every 10 ms.
@@ -649,23 +1524,13 @@ class TSND151:
                            0: off (not save), enable: 1-255.
                            e.g., If it is 2 and interval is set 5 ms, data will be saved every 10 ms.
         """
-
-        if interval_in_ms != 0:
-            check_range("interval_in_ms", interval_in_ms, 10, 255)
-        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
-        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
-
-        if not self.check_is_cmd_mode():
-            return False
-
-        self.send(self._CMD_CODE_MAP_['set_magnetism_interval'],
-                  [interval_in_ms, avg_num_for_send, avg_num_for_save])
-        return self.check_success()
+        return self._apply_setting('set_magnetism_interval', interval_in_ms=interval_in_ms,
+                                   avg_num_for_send=avg_num_for_send, avg_num_for_save=avg_num_for_save)
 
     def set_atmosphere_interval(self, interval_in_10ms_unit, avg_num_for_send=1, avg_num_for_save=0):
         """
         interval_in_10ms_unit: interval in 10 ms unit.
-                               0: off, on: 4-255 (means 40-2550 ms interval) 
+                               0: off, on: 4-255 (means 40-2550 ms interval)
         avg_num_for_send     : N of SMA for sending via Bluetooth. (def:1)
                                0: off (not send), enable: 1-255.
                                e.g., If it is 2 and interval is set 10 ms, data will be sent every 20 ms.
@@ -673,72 +1538,36 @@ class TSND151:
                                0: off (not save), enable: 1-255.
                                e.g., If it is 2 and interval is set 10 ms, data will be saved every 20 ms.
         """
-
-        if interval_in_10ms_unit != 0:
-            check_range("interval_in_10ms_unit", interval_in_10ms_unit, 4, 255)
-        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
-        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
-
-        if not self.check_is_cmd_mode():
-            return False
-
-        self.send(self._CMD_CODE_MAP_['set_atmosphere_interval'],
-                  [interval_in_10ms_unit, avg_num_for_send, avg_num_for_save])
-        return self.check_success()
+        return self._apply_setting('set_atmosphere_interval', interval_in_10ms_unit=interval_in_10ms_unit,
+                                   avg_num_for_send=avg_num_for_send, avg_num_for_save=avg_num_for_save)
 
     def set_battery_voltage_measurement(self, send=False, save=False):
         """
         send: sending via Bluetooth or not. (def:False)
         send: sending to device memory or not. (def:False)
         """
-        if not isinstance(send, bool):
-            ValueError(f"Invalid 'send' (have to be bool):{send}")
-        if not isinstance(save, bool):
-            ValueError(f"Invalid 'save' (have to be bool):{save}")
-
-        if not self.check_is_cmd_mode():
-            return False
-
-        self.send(self._CMD_CODE_MAP_['set_battery_voltage_measurement'], [send, save])
-        return self.check_success()
+        return self._apply_setting('set_battery_voltage_measurement', send=send, save=save)
 
 
     def set_option_button_behavior(self, mode: OptionButtonMode):
         """
         mode: mode of the option button
         """
-        try:
-            mode = TSND151.OptionButtonMode(mode)
-        except ValueError as e:
-            ValueError(f"Invalid 'mode' (have to be one of the TSND151.OptionButtonMode): {mode}")
-
-        if not self.check_is_cmd_mode():
-            return False
-
-        self.send(self._CMD_CODE_MAP_['set_option_button_behavior'], [mode])
-        return self.check_success()
+        return self._apply_setting('set_option_button_behavior', mode=int(mode))
 
 
     def get_option_button_behavior(self):
         """
         return: one of the TSND151.OptionButtonMode
         """
-        self.send(self._CMD_CODE_MAP_['get_option_button_behavior'])
-        res = self.wait_response('option_button_behavior')
+        res = self.request('get_option_button_behavior', code_name='option_button_behavior')
         return TSND151.OptionButtonMode(int.from_bytes(res, byteorder='little'))
 
     def set_overwrite_protection(self, enable=False):
         """
         enable: enable overwrite protection for device memory or not
         """
-        if not isinstance(enable, bool):
-            ValueError(f"Invalid 'enable', {enable}, (have to be bool).")
-
-        if not self.check_is_cmd_mode():
-            return False
-
-        self.send(self._CMD_CODE_MAP_['set_overwrite_protection'], [enable])
-        return self.check_success()
+        return self._apply_setting('set_overwrite_protection', enable=enable)
 
     def get_overwrite_protection(self):
         """
@@ -747,22 +1576,215 @@ class TSND151:
         if not self.check_is_cmd_mode():
             return None
 
-        self.send(self._CMD_CODE_MAP_['get_overwrite_protection'])
-        res = self.wait_response('overwrite_protection')
+        res = self.request('get_overwrite_protection', code_name='overwrite_protection')
         return res == TSND151._OVERWRITE_NG_BIT_
 
     def set_auto_power_off(self, minutes):
         """
         minutes: 0:off, 1-20:minutes for auto power off
         """
-        if minutes != 0:
-            check_range("minutes", minutes, 1, 20)
+        return self._apply_setting('set_auto_power_off', minutes=minutes)
+
+    def configure(self, settings, pipeline_depth=4, timeout_sec=None):
+        """Apply many settings with one mode check and pipelined commands.
+
+        Each setter checks the mode and waits its response before the next
+        command, so a setup with 10 setters costs at least 10 round-trips.
+        configure checks the mode once, and sends up to pipeline_depth commands
+        before waiting their responses, which are matched in the sent order.
+
+        Parameters
+        ----------
+        settings: DeviceSettings or list
+            settings to apply, or a list of (setter name, kwargs)
+        pipeline_depth: int
+            max number of commands waiting responses. 1 sends commands one by one.
+        timeout_sec: int, float
+            timeout to wait each response. If None, response_wait_timeout is used.
+
+        Returns
+        -------
+        dict
+            {setter name: True if applied}, in the applied order.
+            All are False if the mode is recording.
+            If a response is timed out, the rest are not sent and False.
+
+        Raises
+        ------
+        ValueError
+            If a setting is invalid. No setting is sent in this case.
+
+        """
+        check_range("pipeline_depth", pipeline_depth, 1, 255)
+        commands = settings.commands() if isinstance(settings, DeviceSettings) else list(settings)
+        if len(commands) == 0:
+            return {}
+
+        for setter_name, kwargs in commands:
+            self._setting_command(setter_name, kwargs)  # raise ValueError before the mode check
+
+        if not self.check_is_cmd_mode():
+            return {setter_name: False for setter_name, kwargs in commands}
+
+        # build the time just after the mode check
+        requests = [(setter_name, kwargs) + self._setting_command(setter_name, kwargs)
+                    for setter_name, kwargs in commands]
+
+        report = {}
+        sent = deque()  # (setter name, kwargs, future, response code name, expected response)
+        try:
+            for setter_name, kwargs, args, code_name, expected in requests:
+                if len(sent) >= pipeline_depth:
+                    self._finish_configure(sent.popleft(), report, timeout_sec)
+                sent.append((setter_name, kwargs, self.send_request(setter_name, args, code_name),
+                             code_name, expected))
+
+            while len(sent) > 0:
+                self._finish_configure(sent.popleft(), report, timeout_sec)
+        except TimeoutError as e:
+            for setter_name, kwargs, fut, code_name, expected in sent:
+                self._cancel_request(fut)
+            self._LOGGER_.warning(f'Configure is aborted. {e}')
+
+        for setter_name, kwargs in commands:
+            report.setdefault(setter_name, False)
+        return report
 
+    def _finish_configure(self, request, report, timeout_sec):
+        setter_name, kwargs, fut, code_name, expected = request
+        report[setter_name] = self._finish_setting(setter_name, kwargs, fut, code_name, expected, timeout_sec)
+
+    def _apply_setting(self, setter_name, **kwargs):
+        """Validate, check the mode, send the command of a setter and wait its response."""
+        self._setting_command(setter_name, kwargs)  # raise ValueError before the mode check
         if not self.check_is_cmd_mode():
             return False
 
-        self.send(self._CMD_CODE_MAP_['set_auto_power_off'], [minutes])
-        return self.check_success()
+        args, code_name, expected = self._setting_command(setter_name, kwargs)  # e.g., now of set_time
+        fut = self.send_request(setter_name, args, code_name)
+        return self._finish_setting(setter_name, kwargs, fut, code_name, expected)
+
+    def _finish_setting(self, setter_name, kwargs, fut, code_name, expected, timeout_sec=None):
+        success = self._wait(fut, code_name, timeout_sec) == expected
+        if not success:
+            self._invalidate_mode()  # e.g., rejected because it is recording
+        if setter_name == 'set_time':
+            if success:
+                self._time_synced = kwargs.get('dt') is None  # re-applied by rearm only if it was the host clock
+            return success  # time is not a setting to be reapplied
+        return self._remember_setting(setter_name, success, **kwargs)
+
+    def _setting_command(self, setter_name, kwargs):
+        """Validate kwargs of a setter.
+
+        Returns
+        -------
+        tuple
+            (args, response code name, expected response)
+
+        """
+        args = getattr(self, f'_{setter_name}_args')(**kwargs)
+        if setter_name == 'set_acc_range':
+            return args, 'acc_range', bytes(args)
+        return args, 'simple', self._OK_BIT_
+
+    @staticmethod
+    def _set_time_args(dt=None):
+        if dt is not None and not isinstance(dt, datetime.datetime):
+            raise ValueError('Invalid dt. type(dt) have to be datetime.datetime.')
+
+        if dt is None:
+            dt = datetime.datetime.now()
+        msec = int(round(dt.microsecond / 1000)).to_bytes(2, "little", signed=False)
+        return [dt.year % 100, dt.month,
+                dt.day, dt.hour, dt.minute,
+                dt.second, msec[0], msec[1]]
+
+    @staticmethod
+    def _set_acc_range_args(g):
+        if g == 2:
+            flag = 0x00
+        elif g == 4:
+            flag = 0x01
+        elif g == 8:
+            flag = 0x02
+        elif g == 16:
+            flag = 0x03
+        else:
+            raise ValueError(f"Invalid acc range: (2,4,8,16) but {g}")
+        return [flag]
+
+    @staticmethod
+    def _set_gyro_range_args(dps):
+        if dps == 250:
+            flag = 0x00
+        elif dps == 500:
+            flag = 0x01
+        elif dps == 1000:
+            flag = 0x02
+        elif dps == 2000:
+            flag = 0x03
+        else:
+            raise ValueError(f"Invalid gyro range: (250,500,1000,2000) but {dps}")
+        return [flag]
+
+    @staticmethod
+    def _set_quaternion_interval_args(interval_in_5ms_unit, avg_num_for_send=1, avg_num_for_save=0):
+        check_range("interval_in_5ms_unit", interval_in_5ms_unit, 0, 51)
+        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
+        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
+        return [interval_in_5ms_unit * 5, avg_num_for_send, avg_num_for_save]
+
+    @staticmethod
+    def _set_acc_and_gyro_interval_args(interval_in_ms, avg_num_for_send=1, avg_num_for_save=0):
+        check_range("interval_in_ms", interval_in_ms, 0, 255)
+        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
+        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
+        return [interval_in_ms, avg_num_for_send, avg_num_for_save]
+
+    @staticmethod
+    def _set_magnetism_interval_args(interval_in_ms, avg_num_for_send=1, avg_num_for_save=0):
+        if interval_in_ms != 0:
+            check_range("interval_in_ms", interval_in_ms, 10, 255)
+        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
+        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
+        return [interval_in_ms, avg_num_for_send, avg_num_for_save]
+
+    @staticmethod
+    def _set_atmosphere_interval_args(interval_in_10ms_unit, avg_num_for_send=1, avg_num_for_save=0):
+        if interval_in_10ms_unit != 0:
+            check_range("interval_in_10ms_unit", interval_in_10ms_unit, 4, 255)
+        check_range("avg_num_for_send", avg_num_for_send, 0, 255)
+        check_range("avg_num_for_save", avg_num_for_save, 0, 255)
+        return [interval_in_10ms_unit, avg_num_for_send, avg_num_for_save]
+
+    @staticmethod
+    def _set_battery_voltage_measurement_args(send=False, save=False):
+        if not isinstance(send, bool):
+            raise ValueError(f"Invalid 'send' (have to be bool):{send}")
+        if not isinstance(save, bool):
+            raise ValueError(f"Invalid 'save' (have to be bool):{save}")
+        return [send, save]
+
+    @staticmethod
+    def _set_option_button_behavior_args(mode):
+        try:
+            mode = TSND151.OptionButtonMode(mode)
+        except ValueError as e:
+            raise ValueError(f"Invalid 'mode' (have to be one of the TSND151.OptionButtonMode): {mode}") from e
+        return [mode]
+
+    @staticmethod
+    def _set_overwrite_protection_args(enable=False):
+        if not isinstance(enable, bool):
+            raise ValueError(f"Invalid 'enable', {enable}, (have to be bool).")
+        return [enable]
+
+    @staticmethod
+    def _set_auto_power_off_args(minutes):
+        if minutes != 0:
+            check_range("minutes", minutes, 1, 20)
+        return [minutes]
 
     def is_recording(self):
         return (self._recording_will_stop_at is not None 
@@ -780,9 +1802,10 @@ class TSND151:
 
         flag = [0, 0, 1, 1, 0, 0, 0,  # start immediately
                 0, 0, 1, 1, 0, 0, 0]  # run forever
-        self.send(self._CMD_CODE_MAP_['start'], flag)
+        started, settings = self._send_request_with_notification('start_recording', 'start', flag,
+                                                                 'recording_time_settings')
 
-        resp = self.wait_response('recording_time_settings')
+        resp = self._wait(settings, 'recording_time_settings')
         start_time = None
         if resp[0] == 1:
             if return_start_time_hms:
@@ -805,7 +1828,7 @@ class TSND151:
         self._recovered = False
         self._recording_start_time = start_time
 
-        self.wait_response('start_recording')
+        self._wait(started, 'start_recording')
         return start_time
 
     def stop_recording(self):
@@ -813,14 +1836,13 @@ class TSND151:
             self._LOGGER_.info('Stopped already')
             return True
 
-        cmd_code = self._CMD_CODE_MAP_['stop']
-        self.send(cmd_code)
-
-        resp = self.check_success()
-        if not resp:
+        stopped, resp = self._send_request_with_notification('stop_recording', 'stop')
+        if self._wait(resp, 'simple') != self._OK_BIT_:
+            self._discard(stopped)
+            self._invalidate_mode()
             return False
 
-        self.wait_response('stop_recording')
+        self._wait(stopped, 'stop_recording')
         self._recording_will_stop_at = None
         self._recording_start_time = None
         return True
@@ -829,8 +1851,7 @@ class TSND151:
         if not self.check_is_cmd_mode():
             return None
 
-        self.send(self._CMD_CODE_MAP_['get_recording_time_settings'])
-        resp = self.wait_response('recording_time_settings')
+        resp = self.request('get_recording_time_settings', code_name='recording_time_settings')
 
         scheduled = resp[0] == 1
         if return_start_time_hms:
@@ -843,17 +1864,30 @@ class TSND151:
         return scheduled, start_time, stop_time
 
     def get_mode(self):
+        """Query the mode to the device. See also cached_mode."""
         return self._get_mode()
-    
+
     def _ping(self):
-        self._get_mode(0.2)
+        """Query the mode without waiting. The reply updates the tracked mode."""
+        self._pings = [fut for fut in self._pings if not fut.done()]
+        if len(self._pings) >= self._MAX_PENDING_PINGS_:
+            for fut in self._pings:
+                self._cancel_request(fut)
+            self._pings = []
+            raise TimeoutError('No reply to ping')
+        if self._writer_thread is None:
+            self._pings.append(self.send_request('get_mode', code_name='mode'))
+            return
+        with self._request_lock:  # queued without waiting the write, since it is called by the reader
+            fut = self._expect('mode')
+            self._enqueue_write(bytes(self.build_cmd(self._CMD_CODE_MAP_['get_mode'], (0x00,))))
+        self._pings.append(fut)
 
     def _get_mode(self, timeout_sec=None):
         """
         return: 0: USB_CMD, 1:USB_RECORDING, 2: BLT_CMD, 3:BLT_RECORDING
         """
-        self.send(self._CMD_CODE_MAP_['get_mode'])
-        resp = self.wait_response('mode', timeout_sec)
+        resp = self.request('get_mode', code_name='mode', timeout_sec=timeout_sec)
 
         return resp[0]
 
@@ -864,8 +1898,7 @@ class TSND151:
         if not self.check_is_cmd_mode():
             return None
 
-        self.send(self._CMD_CODE_MAP_['get_saved_entry_num'])
-        resp = self.wait_response('saved_entry_num')
+        resp = self.request('get_saved_entry_num', code_name='saved_entry_num')
         return resp[0]
 
     def get_saved_entry_start_date(self, entry_num: int, remove_hms=True):
@@ -897,13 +1930,53 @@ class TSND151:
         if entry_num > self.get_saved_entry_num():
             return None
 
-        self.send(self._CMD_CODE_MAP_['get_saved_entry_info'], [entry_num])
-        dt = self.parse_time(self.wait_response('saved_entry_info'))
+        dt = self.parse_time(self.request('get_saved_entry_info', [entry_num], 'saved_entry_info'))
         if remove_hms:
             dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
 
         return dt
 
+    def get_saved_entry_info(self, entry_num: int):
+        """Return the raw information (0xB7 response) of a saved entry.
+
+        Parameters
+        ----------
+        entry_num: int
+           target entry number
+           1 <= entry_num <= 80
+
+        Returns
+        -------
+        bytes
+            24 bytes of the information, see parse_saved_entry_info,
+            or None if the entry does not exist
+
+        """
+        assert 1 <= entry_num <= 80
+
+        if not self.check_is_cmd_mode():
+            return None
+
+        if entry_num > self.get_saved_entry_num():
+            return None
+
+        return self.request('get_saved_entry_info', [entry_num], 'saved_entry_info')
+
+    @staticmethod
+    def parse_saved_entry_info(bytes_):
+        """Parse the information of a saved entry.
+
+        Returns
+        -------
+        dict
+            start_time: datetime.datetime of the start
+            record_num: number of records in the entry
+        """
+        return {
+            'start_time': TSND151.parse_time(bytes_[0:8])
+            , 'record_num': int.from_bytes(bytes_[20:24], "little", signed=False)
+        }
+
     def get_saved_entry(self, entry_num: int, timeout_sec = 600):
         """Start saved entry download.
 
@@ -936,8 +2009,7 @@ class TSND151:
         if entry_num > self.get_saved_entry_num():
             return False
 
-        self.send(self._CMD_CODE_MAP_['get_saved_entry'], [entry_num])
-        self.wait_response('saved_entry_end', timeout_sec)
+        self.request('get_saved_entry', [entry_num], 'saved_entry_end', timeout_sec)
         return True
 
     def clear_saved_entry(self):
@@ -945,8 +2017,7 @@ class TSND151:
         if not self.check_is_cmd_mode():
             return False
 
-        self.send(self._CMD_CODE_MAP_['clear_saved_data'])
-        return self.check_success()
+        return self.request('clear_saved_data') == self._OK_BIT_
 
     @staticmethod
     def parse_acc_gyro(bytes_):
@@ -1004,3 +2075,89 @@ class TSND151:
             , second=int.from_bytes(bytes_[5:6], "little", signed=False)
             , microsecond=1000 * int.from_bytes(bytes_[6:8], "little", signed=False)
         )
+
+
+class DeviceSettings:
+    """Declarative settings of a TSND151 applied by TSND151.configure.
+
+    Each field is applied by the setter of the same name (set_<field>).
+    None means unchanged. Interval fields take a tuple or a dict of the setter
+    arguments, e.g., acc_and_gyro_interval=(2, 5, 0) or
+    acc_and_gyro_interval={'interval_in_ms': 2, 'avg_num_for_send': 5}.
+
+    Example
+    -------
+    >>> settings = DeviceSettings(time=True, acc_range=16, quaternion_interval=(1, 4, 0),
+    ...                           magnetism_interval=(0, 0, 0), auto_power_off=0)
+    >>> report = tsnd151.configure(settings)  # {'set_time': True, 'set_acc_range': True, ...}
+
+    Parameters
+    ----------
+    time: bool or datetime.datetime or None
+        True sets the current local time.
+
+    """
+
+    # field -> (setter name, argument names), in the applied order
+    _FIELDS_ = (
+        ('time', 'set_time', ('dt',))
+        , ('acc_range', 'set_acc_range', ('g',))
+        , ('gyro_range', 'set_gyro_range', ('dps',))
+        , ('acc_and_gyro_interval', 'set_acc_and_gyro_interval',
+           ('interval_in_ms', 'avg_num_for_send', 'avg_num_for_save'))
+        , ('quaternion_interval', 'set_quaternion_interval',
+           ('interval_in_5ms_unit', 'avg_num_for_send', 'avg_num_for_save'))
+        , ('magnetism_interval', 'set_magnetism_interval',
+           ('interval_in_ms', 'avg_num_for_send', 'avg_num_for_save'))
+        , ('atmosphere_interval', 'set_atmosphere_interval',
+           ('interval_in_10ms_unit', 'avg_num_for_send', 'avg_num_for_save'))
+        , ('battery_voltage_measurement', 'set_battery_voltage_measurement', ('send', 'save'))
+        , ('option_button_behavior', 'set_option_button_behavior', ('mode',))
+        , ('overwrite_protection', 'set_overwrite_protection', ('enable',))
+        , ('auto_power_off', 'set_auto_power_off', ('minutes',))
+    )
+
+    def __init__(self, time=None, acc_range=None, gyro_range=None, acc_and_gyro_interval=None,
+                 quaternion_interval=None, magnetism_interval=None, atmosphere_interval=None,
+                 battery_voltage_measurement=None, option_button_behavior=None,
+                 overwrite_protection=None, auto_power_off=None):
+        self.time = time
+        self.acc_range = acc_range
+        self.gyro_range = gyro_range
+        self.acc_and_gyro_interval = acc_and_gyro_interval
+        self.quaternion_interval = quaternion_interval
+        self.magnetism_interval = magnetism_interval
+        self.atmosphere_interval = atmosphere_interval
+        self.battery_voltage_measurement = battery_voltage_measurement
+        self.option_button_behavior = option_button_behavior
+        self.overwrite_protection = overwrite_protection
+        self.auto_power_off = auto_power_off
+
+    def __repr__(self):
+        fields = ', '.join(f'{field}={getattr(self, field)!r}' for field, setter_name, arg_names in self._FIELDS_
+                           if getattr(self, field) is not None)
+        return f'DeviceSettings({fields})'
+
+    def commands(self):
+        """Return the settings as a list of (setter name, kwargs), skipping None."""
+        res = []
+        for field, setter_name, arg_names in self._FIELDS_:
+            value = getattr(self, field)
+            if value is None or (field == 'time' and value is False):
+                continue
+
+            if field == 'time':
+                kwargs = {'dt': None if value is True else value}
+            elif isinstance(value, dict):
+                kwargs = dict(value)
+            elif isinstance(value, (list, tuple)):
+                if len(value) > len(arg_names):
+                    raise ValueError(f"Too many values for {field}: {value}")
+                kwargs = dict(zip(arg_names, value))
+            else:
+                kwargs = {arg_names[0]: value}
+
+            if field == 'option_button_behavior':
+                kwargs['mode'] = int(kwargs['mode'])
+            res.append((setter_name, kwargs))
+        return res